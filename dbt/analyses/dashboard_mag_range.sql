@@ -0,0 +1,14 @@
+{# Dashboard: the events of a magnitude range (the magnitude slider), every place and magnitude type #}
+SELECT
+  time,
+  latitude,
+  longitude,
+  mag,
+  mag_type,
+  place
+FROM
+  {{ ref('mart_earthquake') }}
+WHERE
+  time >= TIMESTAMP '2000-01-01'
+  AND mag BETWEEN 6.5 AND 9.9
+  AND mag_floor BETWEEN 6 AND 9
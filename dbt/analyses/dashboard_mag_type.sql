@@ -0,0 +1,15 @@
+{# Dashboard: the events of a magnitude type above a magnitude, by place #}
+SELECT
+  place,
+  COUNT(*) AS event_count,
+  MAX(mag) AS max_mag
+FROM
+  {{ ref('mart_earthquake') }}
+WHERE
+  time >= TIMESTAMP '2000-01-01'
+  AND mag_type = 'mww'
+  AND mag >= 5.5
+  {# the cluster column of mag (mag >= 5.5 implies mag_floor >= 5) #}
+  AND mag_floor >= 5
+GROUP BY
+  place
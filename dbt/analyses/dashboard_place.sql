@@ -0,0 +1,17 @@
+{#
+  Dashboard: the events of a place (the place filter), over the years shown.
+  The dashboard query patterns (analyses/dashboard_*.sql) are the ones mart_earthquake is clustered for,
+  prefect/benchmarks/bench_clustering.py measures the bytes they scan with each clustering.
+#}
+SELECT
+  time,
+  latitude,
+  longitude,
+  mag,
+  mag_type,
+  place
+FROM
+  {{ ref('mart_earthquake') }}
+WHERE
+  time >= TIMESTAMP '2000-01-01'
+  AND place = 'alaska'
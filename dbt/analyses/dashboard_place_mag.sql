@@ -0,0 +1,15 @@
+{# Dashboard: every filter set, a place, a magnitude type and a magnitude range, by year #}
+SELECT
+  year,
+  COUNT(*) AS event_count,
+  AVG(mag) AS avg_mag
+FROM
+  {{ ref('mart_earthquake') }}
+WHERE
+  time >= TIMESTAMP '2000-01-01'
+  AND place = 'japan'
+  AND mag_type = 'mb'
+  AND mag >= 4.5
+  AND mag_floor >= 4
+GROUP BY
+  year
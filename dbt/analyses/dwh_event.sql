@@ -0,0 +1,7 @@
+{# The records of an event in the dwh (e.g. to check an event of the dashboard), dwh_usgs is clustered by id #}
+SELECT
+  *
+FROM
+  {{ ref('dwh_usgs') }}
+WHERE
+  id = 'us7000abcd'
@@ -0,0 +1,112 @@
+{#
+  Cross-database macros: BigQuery SQL by default, DuckDB for the targets of type duckdb.
+  The regular expressions are RE2 on both, pass them as they would be written in a raw string (r'...').
+  regexp_extract returns the first capturing group, the pattern must have exactly one.
+#}
+
+{% macro timestamp_millis(expression) %}
+  {{- return(adapter.dispatch('timestamp_millis', 'world_earthquake_pipeline')(expression)) -}}
+{% endmacro %}
+
+{% macro default__timestamp_millis(expression) -%}
+  TIMESTAMP_MILLIS({{ expression }})
+{%- endmacro %}
+
+{% macro duckdb__timestamp_millis(expression) -%}
+  epoch_ms({{ expression }})
+{%- endmacro %}
+
+
+{% macro day_of_week(expression) %}
+  {{- return(adapter.dispatch('day_of_week', 'world_earthquake_pipeline')(expression)) -}}
+{% endmacro %}
+
+{# 1 (Sunday) to 7 (Saturday) #}
+{% macro default__day_of_week(expression) -%}
+  EXTRACT(DAYOFWEEK FROM {{ expression }})
+{%- endmacro %}
+
+{% macro duckdb__day_of_week(expression) -%}
+  (dayofweek({{ expression }}) + 1)
+{%- endmacro %}
+
+
+{% macro star_except(columns) %}
+  {{- return(adapter.dispatch('star_except', 'world_earthquake_pipeline')(columns)) -}}
+{% endmacro %}
+
+{% macro default__star_except(columns) -%}
+  * EXCEPT ({{ columns | join(', ') }})
+{%- endmacro %}
+
+{% macro duckdb__star_except(columns) -%}
+  * EXCLUDE ({{ columns | join(', ') }})
+{%- endmacro %}
+
+
+{% macro contains_substr(expression, search) %}
+  {{- return(adapter.dispatch('contains_substr', 'world_earthquake_pipeline')(expression, search)) -}}
+{% endmacro %}
+
+{# case-insensitive, like CONTAINS_SUBSTR #}
+{% macro default__contains_substr(expression, search) -%}
+  CONTAINS_SUBSTR({{ expression }}, '{{ search }}')
+{%- endmacro %}
+
+{% macro duckdb__contains_substr(expression, search) -%}
+  contains(lower({{ expression }}), lower('{{ search }}'))
+{%- endmacro %}
+
+
+{% macro regexp_contains(expression, pattern) %}
+  {{- return(adapter.dispatch('regexp_contains', 'world_earthquake_pipeline')(expression, pattern)) -}}
+{% endmacro %}
+
+{% macro default__regexp_contains(expression, pattern) -%}
+  REGEXP_CONTAINS({{ expression }}, r'{{ pattern }}')
+{%- endmacro %}
+
+{% macro duckdb__regexp_contains(expression, pattern) -%}
+  regexp_matches({{ expression }}, '{{ pattern }}')
+{%- endmacro %}
+
+
+{% macro regexp_extract(expression, pattern) %}
+  {{- return(adapter.dispatch('regexp_extract', 'world_earthquake_pipeline')(expression, pattern)) -}}
+{% endmacro %}
+
+{% macro default__regexp_extract(expression, pattern) -%}
+  REGEXP_EXTRACT({{ expression }}, r'{{ pattern }}')
+{%- endmacro %}
+
+{% macro duckdb__regexp_extract(expression, pattern) -%}
+  regexp_extract({{ expression }}, '{{ pattern }}', 1)
+{%- endmacro %}
+
+
+{% macro regexp_replace(expression, pattern, replacement) %}
+  {{- return(adapter.dispatch('regexp_replace', 'world_earthquake_pipeline')(expression, pattern, replacement)) -}}
+{% endmacro %}
+
+{# all the matches are replaced #}
+{% macro default__regexp_replace(expression, pattern, replacement) -%}
+  REGEXP_REPLACE({{ expression }}, r'{{ pattern }}', '{{ replacement }}')
+{%- endmacro %}
+
+{% macro duckdb__regexp_replace(expression, pattern, replacement) -%}
+  regexp_replace({{ expression }}, '{{ pattern }}', '{{ replacement }}', 'g')
+{%- endmacro %}
+
+
+{% macro month_start(expression) %}
+  {{- return(adapter.dispatch('month_start', 'world_earthquake_pipeline')(expression)) -}}
+{% endmacro %}
+
+{# the first instant of the month of a timestamp, as a timestamp #}
+{% macro default__month_start(expression) -%}
+  TIMESTAMP_TRUNC({{ expression }}, MONTH)
+{%- endmacro %}
+
+{% macro duckdb__month_start(expression) -%}
+  CAST(date_trunc('month', {{ expression }}) AS TIMESTAMP)
+{%- endmacro %}
@@ -0,0 +1,61 @@
+{#
+  Grid keys of the rollups, see prefect/flows/utils/geo.py for the same keys in Python (keep them in sync).
+  The grid cells are geohash cells, computed with integer arithmetic (the same on BigQuery and DuckDB):
+  a cell is (lat_index, lon_index), the row and column of the cell in a grid of 2^lat_bits x 2^lon_bits,
+  and its geohash interleaves their bits (longitude first) in base 32.
+#}
+
+{% macro geohash_bits(precision) %}
+  {%- set bits = precision * 5 -%}
+  {#- (lat_bits, lon_bits) -#}
+  {{ return((bits // 2, (bits + 1) // 2)) }}
+{% endmacro %}
+
+
+{% macro geohash_lat_index(latitude, precision) -%}
+  {%- set lat_bits = geohash_bits(precision)[0] -%}
+  LEAST(GREATEST(CAST(FLOOR(({{ latitude }} + 90) / 180 * {{ 2 ** lat_bits }}) AS INT64), 0), {{ 2 ** lat_bits - 1 }})
+{%- endmacro %}
+
+
+{% macro geohash_lon_index(longitude, precision) -%}
+  {%- set lon_bits = geohash_bits(precision)[1] -%}
+  LEAST(GREATEST(CAST(FLOOR(({{ longitude }} + 180) / 360 * {{ 2 ** lon_bits }}) AS INT64), 0), {{ 2 ** lon_bits - 1 }})
+{%- endmacro %}
+
+
+{% macro geohash_from_index(lat_index, lon_index, precision) -%}
+  {%- set lat_bits, lon_bits = geohash_bits(precision) -%}
+  {%- set chars = [] -%}
+  {%- for i in range(precision) -%}
+    {%- set terms = [] -%}
+    {%- for j in range(5) -%}
+      {%- set n = i * 5 + j -%}
+      {#- the even bits are the bits of the longitude, the odd bits the bits of the latitude, most significant first -#}
+      {%- if n % 2 == 0 -%}
+        {%- do terms.append("((" ~ lon_index ~ " >> " ~ (lon_bits - 1 - n // 2) ~ ") & 1) * " ~ 2 ** (4 - j)) -%}
+      {%- else -%}
+        {%- do terms.append("((" ~ lat_index ~ " >> " ~ (lat_bits - 1 - n // 2) ~ ") & 1) * " ~ 2 ** (4 - j)) -%}
+      {%- endif -%}
+    {%- endfor -%}
+    {%- do chars.append("SUBSTR('0123456789bcdefghjkmnpqrstuvwxyz', 1 + " ~ terms | join(" + ") ~ ", 1)") -%}
+  {%- endfor -%}
+  ({{ chars | join(" || ") }})
+{%- endmacro %}
+
+
+{# the center of the cell, e.g. to plot the cells on a map #}
+{% macro geohash_cell_latitude(lat_index, precision) -%}
+  (-90 + ({{ lat_index }} + 0.5) * 180 / {{ 2 ** geohash_bits(precision)[0] }})
+{%- endmacro %}
+
+
+{% macro geohash_cell_longitude(lon_index, precision) -%}
+  (-180 + ({{ lon_index }} + 0.5) * 360 / {{ 2 ** geohash_bits(precision)[1] }})
+{%- endmacro %}
+
+
+{# the lower bound of the bin of size bin_size, e.g. 4.5 for 4.7 with 0.5 #}
+{% macro mag_bin(mag, bin_size) -%}
+  (FLOOR({{ mag }} / {{ bin_size }}) * {{ bin_size }})
+{%- endmacro %}
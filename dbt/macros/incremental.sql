@@ -0,0 +1,102 @@
+{#
+  Incremental builds by month of the event time.
+  The var changed_months lists the months ("YYYY-MM") of properties_time changed since the last build
+  (passed by the run_dbt flow, e.g. --vars '{"changed_months": ["2023-05", "2023-06"]}').
+  With it, an incremental model reads only these months of its source (partition-pruned predicates)
+  and replaces these monthly partitions of its table: insert_overwrite with static partitions on BigQuery,
+  delete+insert by unique_key on DuckDB (which has no partition to overwrite).
+  Without it, the models are merged with the records updated since the last build.
+#}
+
+{% macro changed_months() %}
+  {%- set months = var('changed_months', none) -%}
+  {%- if months is none -%}
+    {{ return(none) }}
+  {%- endif -%}
+  {%- if months is string -%}
+    {%- set months = months.split(',') if months.strip() else [] -%}
+  {%- endif -%}
+  {%- set result = [] -%}
+  {%- for month in months -%}
+    {#- a YAML date (e.g. 2023-05-01) is a month too -#}
+    {%- do result.append((month | string | trim)[:7]) -%}
+  {%- endfor -%}
+  {{ return(result | unique | sort | list) }}
+{% endmacro %}
+
+
+{% macro incremental_strategy() %}
+  {%- if changed_months() is not none and target.type == 'bigquery' -%}
+    {{ return('insert_overwrite') }}
+  {%- endif -%}
+  {{ return(none) }}
+{% endmacro %}
+
+
+{# the partitions to replace (insert_overwrite), the monthly partitions of a timestamp column #}
+{% macro changed_partitions() %}
+  {%- set months = changed_months() -%}
+  {%- if months is none -%}
+    {{ return(none) }}
+  {%- endif -%}
+  {%- set partitions = [] -%}
+  {%- for month in months -%}
+    {%- do partitions.append("timestamp('" ~ month ~ "-01')") -%}
+  {%- endfor -%}
+  {{ return(partitions) }}
+{% endmacro %}
+
+
+{# [start, end) of the runs of consecutive changed months, as dates #}
+{% macro changed_month_ranges() %}
+  {%- set ranges = [] -%}
+  {%- for month in changed_months() -%}
+    {%- set year = month[:4] | int -%}
+    {%- set month_number = month[5:7] | int -%}
+    {%- set start = modules.datetime.date(year, month_number, 1) -%}
+    {%- set end = modules.datetime.date(year + 1, 1, 1) if month_number == 12
+                  else modules.datetime.date(year, month_number + 1, 1) -%}
+    {%- if ranges and ranges[-1][1] == start -%}
+      {%- do ranges.append((ranges.pop()[0], end)) -%}
+    {%- else -%}
+      {%- do ranges.append((start, end)) -%}
+    {%- endif -%}
+  {%- endfor -%}
+  {{ return(ranges) }}
+{% endmacro %}
+
+
+{#
+  Predicate of the changed months on a column with constant bounds (so that the partitions are pruned):
+  a timestamp, or epoch milliseconds with epoch_millis=true (the properties_time of the raw table).
+#}
+{% macro in_changed_months(column, epoch_millis=false) -%}
+  {%- set ranges = changed_month_ranges() -%}
+  {%- if not ranges -%}
+    FALSE
+  {%- else -%}
+    {%- set epoch = modules.datetime.date(1970, 1, 1) -%}
+    (
+    {%- for start, end in ranges %}
+      {% if not loop.first %}OR {% endif -%}
+      {%- if epoch_millis -%}
+      ({{ column }} >= {{ (start - epoch).days * 86400000 }} AND {{ column }} < {{ (end - epoch).days * 86400000 }})
+      {%- else -%}
+      ({{ column }} >= TIMESTAMP '{{ start }}' AND {{ column }} < TIMESTAMP '{{ end }}')
+      {%- endif -%}
+    {%- endfor %}
+    )
+  {%- endif -%}
+{%- endmacro %}
+
+
+{#
+  The strategy of the models replacing whole months (the rollups): insert_overwrite on BigQuery, with the
+  changed_partitions() or else the partitions of the batch, delete+insert by a unique_key of the month on DuckDB.
+#}
+{% macro month_overwrite_strategy() %}
+  {%- if target.type == 'bigquery' -%}
+    {{ return('insert_overwrite') }}
+  {%- endif -%}
+  {{ return(none) }}
+{% endmacro %}
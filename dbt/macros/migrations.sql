@@ -0,0 +1,19 @@
+{#
+  Migrations of the existing tables of the incremental models, run as their pre-hooks,
+  so that a new column doesn't need a --full-refresh (their builds have on_schema_change='fail').
+#}
+
+{# Add the column to the table of the model if it exists without it, and fill it with expression (of the table's columns) #}
+{% macro add_column(column, data_type, expression) %}
+  {%- if execute and not flags.FULL_REFRESH -%}
+    {%- set relation = adapter.get_relation(this.database, this.schema, this.identifier) -%}
+    {%- if relation is not none -%}
+      {%- set columns = adapter.get_columns_in_relation(relation) | map(attribute='name') | map('lower') | list -%}
+      {%- if column | lower not in columns -%}
+        {{ log("adding the column " ~ column ~ " to " ~ relation, info=true) }}
+        {%- do run_query("ALTER TABLE " ~ relation ~ " ADD COLUMN " ~ column ~ " " ~ data_type) -%}
+        {%- do run_query("UPDATE " ~ relation ~ " SET " ~ column ~ " = " ~ expression ~ " WHERE TRUE") -%}
+      {%- endif -%}
+    {%- endif -%}
+  {%- endif -%}
+{% endmacro %}
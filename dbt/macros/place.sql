@@ -0,0 +1,32 @@
+{#
+  Place names of the USGS events, see prefect/flows/utils/place.py for the same rules in Python (keep them in sync).
+  place_orig: the lower-case part after the first comma of properties_place (usually the country or the state).
+  normalize_place: the region of a place_orig, computed once per distinct place_orig by dim_place.
+#}
+
+{% macro place_orig(expression) -%}
+  {% set country_pattern %},\s(.*?)${% endset %}
+  CASE
+    WHEN {{ contains_substr(expression, ',') }} THEN {{ regexp_extract('LOWER(' ~ expression ~ ')', country_pattern) }}
+  ELSE
+    LOWER({{ expression }})
+  END
+{%- endmacro %}
+
+
+{% macro normalize_place(expression) -%}
+  {% set island_pattern %}of (?:the )?(\w+ ?\w+) island{% endset %}
+  {% set direction_pattern %}(off|near)?\s?(the)?\s?\b(bay|coast|central|south|north|east|west|southeast|southwest|northwest|northeast|southeastern)( coast)? of\s?\b(south|north|west|east|southern|northern|western|eastern|central|southeastern)?\s?{% endset %}
+  {% set sea_pattern %}sea of (\w+){% endset %}
+  {% set region_pattern %}([\w\s-]+?)(?: border)?\sregion{% endset %}
+  CASE
+    WHEN {{ regexp_contains(expression, island_pattern) }} THEN {{ regexp_extract(expression, island_pattern) }}
+    WHEN {{ regexp_contains(expression, direction_pattern) }} THEN {{ regexp_replace(expression, direction_pattern, '') }}
+    WHEN {{ regexp_contains(expression, sea_pattern) }} THEN {{ regexp_extract(expression, sea_pattern) }}
+    WHEN {{ contains_substr(expression, 'region') }} THEN {{ regexp_extract(expression, region_pattern) }}
+    WHEN {{ expression }} = '1960 great chilean earthquake (valdivia earthquake)' THEN 'chile'
+    WHEN {{ expression }} = 'ca' THEN 'california'
+  ELSE
+    {{ expression }}
+  END
+{%- endmacro %}
@@ -0,0 +1,49 @@
+{{ config(
+  materialized='incremental',
+  unique_key='place_orig',
+  on_schema_change='fail',
+  merge_behavior='upsert')
+}}
+{#
+  Normalized place of every distinct place_orig (see macros/place.sql).
+  An incremental run only parses the place_orig seen for the first time, the others keep their place.
+#}
+WITH batch AS (
+  SELECT
+    {{ place_orig('properties_place') }} AS place_orig,
+    MAX(properties_updated) AS updated
+  FROM
+    {{ ref('dwh_usgs') }}
+  WHERE
+    properties_place IS NOT NULL
+  {% if is_incremental() %}
+    {% if changed_months() is not none %}
+    AND {{ in_changed_months('properties_time') }}
+    {% else %}
+    AND properties_updated > (select max(updated) from {{ this }})
+    {% endif %}
+  {% endif %}
+  GROUP BY 1
+)
+
+SELECT
+  batch.place_orig,
+{% if is_incremental() %}
+  CASE
+    WHEN existing.place_orig IS NOT NULL THEN existing.place
+  ELSE
+    {{ normalize_place('batch.place_orig') }}
+  END
+  AS place,
+{% else %}
+  {{ normalize_place('batch.place_orig') }} AS place,
+{% endif %}
+  batch.updated
+FROM
+  batch
+{% if is_incremental() %}
+  LEFT JOIN {{ this }} AS existing
+  ON existing.place_orig = batch.place_orig
+{% endif %}
+WHERE
+  batch.place_orig IS NOT NULL
@@ -3,27 +3,28 @@
   unique_key='id',
   on_schema_change='fail',
   merge_behavior='upsert',
+  incremental_strategy=incremental_strategy(),
+  partitions=changed_partitions(),
   partition_by = {
      'field': 'properties_time', 
      'data_type': 'timestamp',
      'granularity': 'month'
-   }) 
+   },
+  cluster_by=['id'])
 }}
 SELECT 
-  *
-  EXCEPT (
-    is_valid,
-    valid_from,
-    valid_to,
-    hash_value
-  )
+  {{ star_except(['is_valid', 'valid_from', 'valid_to', 'hash_value']) }}
 FROM
   {{ ref('stg_usgs') }}
 WHERE
   is_valid is true
 
 {% if is_incremental() %}
+  {% if changed_months() is not none %}
+  AND {{ in_changed_months('properties_time') }}
+  {% else %}
   AND properties_updated > (select max(properties_updated) from {{ this }})
+  {% endif %}
 {% endif %}
 {% if var('is_test_run', default=true) %}
 
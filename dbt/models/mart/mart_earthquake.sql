@@ -3,13 +3,21 @@
   unique_key='id',
   on_schema_change='fail',
   merge_behavior='upsert',
+  incremental_strategy=incremental_strategy(),
+  partitions=changed_partitions(),
   partition_by = {
      'field': 'time', 
      'data_type': 'timestamp',
      'granularity': 'month'
-   }) 
+   },
+  cluster_by=['mag_type', 'place', 'mag_floor'],
+  pre_hook="{{ add_column('mag_floor', 'INT64', 'CAST(FLOOR(mag) AS INT64)') }}")
 }}
-
+{#
+  clustered by the filters of the dashboard (see analyses/), in the order that scans the fewest bytes over
+  the dashboard queries in prefect/benchmarks/bench_clustering.py (see "Clustering" in the README);
+  a new clustering only applies to the existing table after a full refresh
+#}
 SELECT
   id,
   time AS time,
@@ -19,28 +27,18 @@ SELECT
   EXTRACT(MONTH
   FROM
     time) AS month,
-  EXTRACT(DAYOFWEEK
-  FROM
-    time) AS day_of_week,
-  updated,  
+  {{ day_of_week('time') }} AS day_of_week,
+  events.updated,
   type,
   latitude,
   longitude,
   altitude,
   mag,
+  {# mag can't be clustered (FLOAT64), filter on mag_floor too to prune the blocks by magnitude #}
+  CAST(FLOOR(mag) AS INT64) AS mag_floor,
   mag_type,
-  CASE
-    WHEN REGEXP_CONTAINS(place_orig, r'of (?:the )?(\w+ ?\w+) island') THEN REGEXP_EXTRACT(place_orig, r'of (?:the )?(\w+ ?\w+) island')
-    WHEN REGEXP_CONTAINS(place_orig, r'(off|near)?\s?(the)?\s?\b(bay|coast|central|south|north|east|west|southeast|southwest|northwest|northeast|southeastern)( coast)? of\s?\b(south|north|west|east|southern|northern|western|eastern|central|southeastern)?\s?') THEN REGEXP_REPLACE(place_orig, r'(off|near)?\s?(the)?\s?\b(bay|coast|central|south|north|east|west|southeast|southwest|northwest|northeast|southeastern)( coast)? of\s?\b(south|north|west|east|southern|northern|western|eastern|central|southeastern)?\s?', '')
-    WHEN REGEXP_CONTAINS(place_orig, r'sea of (\w+)') THEN REGEXP_EXTRACT(place_orig, r'sea of (\w+)')
-    WHEN CONTAINS_SUBSTR(place_orig, "region") THEN REGEXP_EXTRACT(place_orig, r'([\w\s-]+?)(?: border)?\sregion',1)
-    WHEN place_orig = "1960 great chilean earthquake (valdivia earthquake)" THEN "chile"
-    WHEN place_orig = "ca" THEN "california"
-  ELSE
-  place_orig
-  END
-  AS place,
-  place_orig
+  dim_place.place,
+  events.place_orig
 FROM (
   SELECT
     id,
@@ -52,22 +50,22 @@ FROM (
     geometry_altitude AS altitude,
     properties_mag AS mag,
     properties_mag_type AS mag_type,
-    (
-      CASE
-        WHEN CONTAINS_SUBSTR(properties_place, ",") THEN REGEXP_EXTRACT(LOWER(properties_place), r',\s(.*?)$',1)
-      ELSE
-      LOWER(properties_place)
-    END
-      ) AS place_orig
+    {{ place_orig('properties_place') }} AS place_orig
   FROM
     {{ ref('dwh_usgs') }}
   WHERE
-    properties_time >= "1950-01-01"  
-)
-
-{% if is_incremental() %}
-  WHERE updated > (select max(updated) from {{ this }})
-{% endif %}
+    properties_time >= '1950-01-01'  
+  {% if is_incremental() %}
+    {% if changed_months() is not none %}
+    AND {{ in_changed_months('properties_time') }}
+    {% else %}
+    AND properties_updated > (select max(updated) from {{ this }})
+    {% endif %}
+  {% endif %}
+) AS events
+{# the place is parsed once per distinct place_orig, see dim_place #}
+LEFT JOIN {{ ref('dim_place') }} AS dim_place
+ON dim_place.place_orig = events.place_orig
 {% if var('is_test_run', default=true) %}
 
   limit 100
@@ -0,0 +1,63 @@
+{{ config(
+  materialized='incremental',
+  unique_key='month_start',
+  on_schema_change='fail',
+  incremental_strategy=month_overwrite_strategy(),
+  partitions=changed_partitions(),
+  partition_by = {
+     'field': 'month_start',
+     'data_type': 'timestamp',
+     'granularity': 'month'
+   },
+  cluster_by=['mag_type', 'geohash'])
+}}
+{#
+  The events of mart_earthquake counted by month, geohash cell (macros/geo.sql), magnitude bin and mag_type,
+  for the dashboard. An incremental run replaces the months changed since the last build:
+  the changed_months, or else the months of the events updated since then.
+#}
+{%- set precision = var('rollup_geohash_precision') -%}
+WITH events AS (
+  SELECT
+    {{ month_start('time') }} AS month_start,
+    year,
+    month,
+    {{ geohash_lat_index('latitude', precision) }} AS lat_index,
+    {{ geohash_lon_index('longitude', precision) }} AS lon_index,
+    {{ mag_bin('mag', var('rollup_mag_bin_size')) }} AS mag_bin,
+    mag_type,
+    mag,
+    updated
+  FROM
+    {{ ref('mart_earthquake') }}
+  {% if is_incremental() %}
+  WHERE
+    {% if changed_months() is not none %}
+    {{ in_changed_months('time') }}
+    {% else %}
+    {{ month_start('time') }} IN (
+      SELECT DISTINCT {{ month_start('time') }}
+      FROM {{ ref('mart_earthquake') }}
+      WHERE updated > (select max(max_updated) from {{ this }}))
+    {% endif %}
+  {% endif %}
+)
+SELECT
+  month_start,
+  year,
+  month,
+  {{ geohash_from_index('lat_index', 'lon_index', precision) }} AS geohash,
+  {{ geohash_cell_latitude('lat_index', precision) }} AS cell_latitude,
+  {{ geohash_cell_longitude('lon_index', precision) }} AS cell_longitude,
+  mag_bin,
+  mag_type,
+  COUNT(*) AS event_count,
+  COUNT(mag) AS mag_count,
+  SUM(mag) AS sum_mag,
+  MAX(mag) AS max_mag,
+  AVG(mag) AS avg_mag,
+  MAX(updated) AS max_updated
+FROM
+  events
+GROUP BY
+  month_start, year, month, lat_index, lon_index, mag_bin, mag_type
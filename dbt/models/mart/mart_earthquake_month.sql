@@ -0,0 +1,44 @@
+{{ config(
+  materialized='incremental',
+  unique_key='month_start',
+  on_schema_change='fail',
+  incremental_strategy=month_overwrite_strategy(),
+  partitions=changed_partitions(),
+  partition_by = {
+     'field': 'month_start',
+     'data_type': 'timestamp',
+     'granularity': 'month'
+   },
+  cluster_by=['mag_type'])
+}}
+{#
+  mart_earthquake_cell_month summed over the cells: the events by month, magnitude bin and mag_type
+  (the time series of the dashboard). Replaces the same months as mart_earthquake_cell_month.
+#}
+SELECT
+  month_start,
+  year,
+  month,
+  mag_bin,
+  mag_type,
+  SUM(event_count) AS event_count,
+  SUM(mag_count) AS mag_count,
+  SUM(sum_mag) AS sum_mag,
+  MAX(max_mag) AS max_mag,
+  SUM(sum_mag) / NULLIF(SUM(mag_count), 0) AS avg_mag,
+  MAX(max_updated) AS max_updated
+FROM
+  {{ ref('mart_earthquake_cell_month') }}
+{% if is_incremental() %}
+WHERE
+  {% if changed_months() is not none %}
+  {{ in_changed_months('month_start') }}
+  {% else %}
+  month_start IN (
+    SELECT DISTINCT month_start
+    FROM {{ ref('mart_earthquake_cell_month') }}
+    WHERE max_updated > (select max(max_updated) from {{ this }}))
+  {% endif %}
+{% endif %}
+GROUP BY
+  month_start, year, month, mag_bin, mag_type
@@ -3,6 +3,8 @@
   unique_key='id',
   on_schema_change='fail',
   merge_behavior='upsert',
+  incremental_strategy=incremental_strategy(),
+  partitions=changed_partitions(),
   partition_by = {
      'field': 'properties_time', 
      'data_type': 'timestamp',
@@ -14,8 +16,8 @@ SELECT
   type,
   properties_mag,
   properties_place,
-  TIMESTAMP_MILLIS(properties_time) AS properties_time,
-  TIMESTAMP_MILLIS(properties_updated) AS properties_updated,
+  {{ timestamp_millis('properties_time') }} AS properties_time,
+  {{ timestamp_millis('properties_updated') }} AS properties_updated,
   properties_tz,
   properties_url,
   properties_detail,
@@ -49,7 +51,12 @@ SELECT
 FROM 
   {{ source('earthquake_raw','usgs_data') }} 
 {% if is_incremental() %}
-  WHERE TIMESTAMP_MILLIS(properties_updated) > (select max(properties_updated) from {{ this }})
+  {% if changed_months() is not none %}
+  {# all the records of the changed months, see macros/incremental.sql #}
+  WHERE {{ in_changed_months('properties_time', epoch_millis=true) }}
+  {% else %}
+  WHERE {{ timestamp_millis('properties_updated') }} > (select max(properties_updated) from {{ this }})
+  {% endif %}
 {% endif %}
 {% if var('is_test_run', default=true) %}
 
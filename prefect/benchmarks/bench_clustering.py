@@ -0,0 +1,207 @@
+"""
+Measure the bytes scanned by the dashboard queries (dbt/analyses/*.sql) with each clustering of the dbt models.
+
+For every model queried by the analyses, copies of the model of the dbt target are created with the same monthly
+partitions and each candidate clustering of CLUSTERINGS (the first one is the clustering of the model,
+the unclustered copy is the baseline). Every analysis then runs against every copy of its model without the
+query cache, and the bytes processed and billed are reported, with the reduction compared to the unclustered copy.
+The copies are deleted afterwards.
+
+DuckDB doesn't report the bytes it scans, so with WORLD_EARTHQUAKE_WAREHOUSE=duckdb (e.g. the database of
+benchmarks.bench_pipeline after `dbt build`) the scans are estimated instead: the rows of every monthly partition
+are sorted by the clustering (by the partition column without clustering, the load order) and cut in blocks of
+--block-rows rows, and a block is read unless the min/max of its columns rule out one of the filters of the analysis
+(ANDed comparisons of a column with a literal), as BigQuery prunes the blocks of a clustered table. The bytes of a
+block are the bytes of the columns of the analysis in BigQuery (8 per number or timestamp, 2 + the length per
+string, 0 per NULL).
+BigQuery doesn't document its block size: the estimates depend on --block-rows and overestimate the reduction
+if BigQuery reads a small partition as one block.
+
+Usage (working directory is `prefect`, environment variables loaded, after `dbt build`):
+    python -m benchmarks.bench_clustering
+    python -m benchmarks.bench_clustering --schema earthquake_prod --analyses dashboard_place dashboard_mag_type
+    WORLD_EARTHQUAKE_WAREHOUSE=duckdb python -m benchmarks.bench_clustering --schema earthquake_dev --block-rows 1000
+"""
+import argparse
+import os
+import re
+from pathlib import Path
+
+from google.cloud import bigquery
+
+from flows.utils.clients import get_bigquery_client, DUCKDB_PATH, PROJECT_ID, WAREHOUSE
+from flows.utils.duckdb_warehouse import DuckDBClient
+
+ANALYSES_DIR = Path(__file__).parents[2] / "dbt" / "analyses"
+# the dataset (suffix of the schema) and the partition column of the models
+MODELS = {
+    "mart_earthquake": ("mart", "time"),
+    "dwh_usgs": ("dwh", "properties_time"),
+}
+# the candidate clusterings of the models, the first one is the cluster_by of the model
+CLUSTERINGS = {
+    "mart_earthquake": [
+        ["mag_type", "place", "mag_floor"],
+        ["mag_type", "mag_floor", "place"],
+        ["place", "mag_type", "mag_floor"],
+        ["place", "mag_floor", "mag_type"],
+        ["mag_floor", "place", "mag_type"],
+        ["mag_floor", "mag_type", "place"],
+        [],
+    ],
+    "dwh_usgs": [["id"], []],
+}
+REF_PATTERN = re.compile(r"\{\{\s*ref\('(\w+)'\)\s*\}\}")
+COMMENT_PATTERN = re.compile(r"\{#.*?#\}", re.DOTALL)
+VALUE = r"(?:TIMESTAMP\s+)?'[^']*'|-?[\d.]+"
+FILTER_PATTERN = re.compile(
+    rf"\b(\w+)\s+BETWEEN\s+({VALUE})\s+AND\s+({VALUE})|\b(\w+)\s*(>=|<=|=|>|<)\s*({VALUE})", re.IGNORECASE)
+WHERE_PATTERN = re.compile(r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|$)", re.IGNORECASE | re.DOTALL)
+
+
+def get_analyses(names: list = None) -> dict:
+    """The SQL of the analyses by name, all of them if names is None."""
+    paths = sorted(ANALYSES_DIR.glob("*.sql"))
+    return {path.stem: path.read_text() for path in paths if names is None or path.stem in names}
+
+
+def render(sql: str, tables: dict) -> str:
+    """The analysis with its refs replaced by the tables (model: table_ref), it may only use ref and comments."""
+    sql = COMMENT_PATTERN.sub("", sql)
+    return REF_PATTERN.sub(lambda match: f"`{tables[match.group(1)]}`", sql)
+
+
+def get_copy_query(table_ref: str, copy_ref: str, partition_column: str, cluster_columns: list) -> str:
+    cluster_by = f"CLUSTER BY {', '.join(cluster_columns)}" if cluster_columns else ""
+    return f"""
+    CREATE OR REPLACE TABLE `{copy_ref}`
+    PARTITION BY TIMESTAMP_TRUNC({partition_column}, MONTH)
+    {cluster_by}
+    AS SELECT * FROM `{table_ref}`
+    """
+
+
+def get_filters(sql: str) -> list:
+    """The filters (column, operator, values) of the WHERE clause of a query, operator is BETWEEN or a comparison."""
+    match = WHERE_PATTERN.search(sql)
+    if not match:
+        return []
+    filters = []
+    for column, low, high, compared, operator, value in FILTER_PATTERN.findall(match.group(1)):
+        filters.append((column, "BETWEEN", (low, high)) if column else (compared, operator, (value,)))
+    return filters
+
+
+def get_block_condition(column: str, operator: str, values: tuple) -> str:
+    """The condition on the min/max of a block of column which is true if the block may have rows of the filter."""
+    if operator == "BETWEEN":
+        return f"max_{column} >= {values[0]} AND min_{column} <= {values[1]}"
+    if operator == "=":
+        return f"min_{column} <= {values[0]} AND max_{column} >= {values[0]}"
+    if operator in (">", ">="):
+        return f"max_{column} {operator} {values[0]}"
+    return f"min_{column} {operator} {values[0]}"
+
+
+def estimate(client, sql: str, table_ref: str, partition_column: str, cluster_columns: list,
+             block_rows: int) -> dict:
+    """The blocks and the bytes of table_ref an analysis reads with a clustering (see the module docstring)."""
+    types = {row["column_name"]: row["column_type"]
+             for row in client.query(f"DESCRIBE SELECT * FROM `{table_ref}`").result()}
+    columns = [column for column in types if re.search(rf"\b{column}\b", sql)]
+    sizes = [f"COALESCE(strlen({column}) + 2, 0)" if types[column] == "VARCHAR"
+             else f"CASE WHEN {column} IS NULL THEN 0 ELSE 8 END" for column in columns]
+    filters = [f for f in get_filters(sql) if f[0] in [partition_column] + cluster_columns]
+    ranges = [f"MIN({column}) AS min_{column}, MAX({column}) AS max_{column}"
+              for column in sorted({f[0] for f in filters})]
+    order_by = ", ".join(cluster_columns or [partition_column])
+    query = f"""
+    SELECT COUNT(*) AS blocks, COALESCE(SUM(bytes), 0) AS bytes
+    FROM (
+    SELECT {", ".join(ranges + [f"SUM({' + '.join(sizes) or '0'}) AS bytes"])}
+    FROM (
+    SELECT *,
+    DATE_TRUNC('month', {partition_column}) AS partition_month,
+    (ROW_NUMBER() OVER (PARTITION BY DATE_TRUNC('month', {partition_column}) ORDER BY {order_by}) - 1)
+    // {block_rows} AS block
+    FROM `{table_ref}`
+    )
+    GROUP BY partition_month, block
+    )
+    WHERE {" AND ".join(get_block_condition(*f) for f in filters) or "TRUE"}
+    """
+    row = client.query(query).result()[0]
+    return {"blocks": row["blocks"], "bytes_processed": int(row["bytes"])}
+
+
+def main_duckdb(schema: str, names: list = None, block_rows: int = 1000) -> None:
+    # the files of the data lake aren't read
+    client = DuckDBClient(DUCKDB_PATH)
+    analyses = get_analyses(names)
+    print(f"{'analysis':<24}{'clustering':<32}{'blocks read':>14}{'bytes (est.)':>16}{'reduction':>12}")
+    for name, sql in analyses.items():
+        model = REF_PATTERN.findall(sql)[0]
+        dataset, partition_column = MODELS[model]
+        table_ref = f"{PROJECT_ID}.{schema}_{dataset}.{model}"
+        sql = COMMENT_PATTERN.sub("", sql)
+        results = [(cluster_columns, estimate(client, sql, table_ref, partition_column, cluster_columns, block_rows))
+                   for cluster_columns in CLUSTERINGS[model]]
+        baseline = next(stats for cluster_columns, stats in results if not cluster_columns)
+        for cluster_columns, stats in results:
+            reduction = 1 - stats["bytes_processed"] / max(1, baseline["bytes_processed"])
+            print(f"{name:<24}{', '.join(cluster_columns) or '(none)':<32}"
+                  f"{stats['blocks']:>14}{stats['bytes_processed']:>16}{reduction:>12.1%}")
+
+
+def run(client, query: str) -> dict:
+    job = client.query(query, job_config=bigquery.QueryJobConfig(use_query_cache=False))
+    job.result()
+    return {"bytes_processed": job.total_bytes_processed or 0, "bytes_billed": job.total_bytes_billed or 0}
+
+
+def main(schema: str, names: list = None) -> None:
+    client = get_bigquery_client()
+    analyses = get_analyses(names)
+    models = sorted({model for sql in analyses.values() for model in REF_PATTERN.findall(sql)})
+
+    copies = {}  # (model, index of the clustering): copy_ref
+    try:
+        for model in models:
+            dataset, partition_column = MODELS[model]
+            table_ref = f"{PROJECT_ID}.{schema}_{dataset}.{model}"
+            for index, cluster_columns in enumerate(CLUSTERINGS[model]):
+                copy_ref = f"{PROJECT_ID}.{schema}_{dataset}.bench_clustering_{model}_{index}"
+                client.query(get_copy_query(table_ref, copy_ref, partition_column, cluster_columns)).result()
+                copies[model, index] = copy_ref
+
+        print(f"{'analysis':<24}{'clustering':<32}{'bytes processed':>18}{'bytes billed':>16}{'reduction':>12}")
+        for name, sql in analyses.items():
+            # the analyses query one model (the other refs use the tables of the target)
+            model = REF_PATTERN.findall(sql)[0]
+            results = []
+            for index, cluster_columns in enumerate(CLUSTERINGS[model]):
+                tables = {other: f"{PROJECT_ID}.{schema}_{MODELS[other][0]}.{other}" for other in models}
+                tables[model] = copies[model, index]
+                results.append((cluster_columns, run(client, render(sql, tables))))
+            baseline = next(stats for cluster_columns, stats in results if not cluster_columns)
+            for cluster_columns, stats in results:
+                reduction = 1 - stats["bytes_processed"] / max(1, baseline["bytes_processed"])
+                print(f"{name:<24}{', '.join(cluster_columns) or '(none)':<32}"
+                      f"{stats['bytes_processed']:>18}{stats['bytes_billed']:>16}{reduction:>12.1%}")
+    finally:
+        for copy_ref in copies.values():
+            client.delete_table(copy_ref, not_found_ok=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schema", default=f"earthquake_{os.environ.get('ENV')}",
+                        help="schema of the dbt target (the datasets are <schema>_dwh, <schema>_mart)")
+    parser.add_argument("--analyses", nargs="+", help="names of the analyses to run (default: all)")
+    parser.add_argument("--block-rows", type=int, default=1000, help="rows per block of the DuckDB estimates")
+
+    args = parser.parse_args()
+    if WAREHOUSE == "duckdb":
+        main_duckdb(args.schema, args.analyses, args.block_rows)
+    else:
+        main(args.schema, args.analyses)
@@ -0,0 +1,79 @@
+"""
+Compare the flattening of an NDJSON file of GeoJSON features
+with json.loads + pd.json_normalize + astype (the former "dataframe" load path)
+and with pyarrow.json + columnar flattening (read_ndjson_table).
+
+The file is generated in memory with `--rows` features, no GCS or BigQuery access is needed.
+
+Usage (working directory is `prefect`):
+    python -m benchmarks.bench_flatten --rows 20000 --repeat 5
+"""
+import argparse
+import io
+import json
+import random
+import time
+import pandas as pd
+
+from flows.utils.gcs_to_bq import get_dataframe_schema, get_schema_field_names
+from flows.utils.flatten import read_ndjson_table
+
+
+def make_feature(i: int) -> dict:
+    time_ms = 1672531200000 + i * 60000
+    return {
+        "type": "Feature",
+        "properties": {
+            "mag": round(random.uniform(-1, 8), 2), "place": f"{i % 100} km S of Somewhere, Japan",
+            "time": time_ms, "updated": time_ms + 3600000, "tz": None, "url": f"https://example.com/{i}",
+            "detail": f"https://example.com/{i}.geojson", "felt": None, "cdi": None, "mmi": None, "alert": None,
+            "status": "reviewed", "tsunami": 0, "sig": random.randint(0, 1000), "net": "us", "code": str(i),
+            "ids": f",us{i},", "sources": ",us,", "types": ",origin,phase-data,", "nst": random.randint(0, 200),
+            "dmin": random.random(), "rms": random.random(), "gap": random.uniform(0, 360), "magType": "mb",
+            "type": "earthquake", "title": f"M 4.5 - {i % 100} km S of Somewhere, Japan"
+        },
+        "geometry": {"type": "Point", "coordinates": [random.uniform(-180, 180), random.uniform(-90, 90), 10.0]},
+        "id": f"us{i}"
+    }
+
+
+def flatten_legacy(file_obj) -> pd.DataFrame:
+    data = [json.loads(line) for line in file_obj]
+    df = pd.json_normalize(data, sep="_")
+    df[["geometry_longitude", "geometry_latitude", "geometry_altitude"]] = pd.DataFrame(
+        df["geometry_coordinates"].to_list())
+    df.drop(columns=["geometry_coordinates"], inplace=True)
+    df = df.reindex(columns=get_schema_field_names())
+    return df.astype(get_dataframe_schema())
+
+
+def flatten_arrow(file_obj):
+    return read_ndjson_table(file_obj)
+
+
+def bench(name, fn, data: bytes, repeat: int) -> None:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(io.BytesIO(data))
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"{name:8s} best={best * 1000:8.1f} ms  median={sorted(timings)[len(timings) // 2] * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="number of features (USGS returns up to 20000)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    data = "".join(json.dumps(make_feature(i)) + "\n" for i in range(args.rows)).encode()
+    print(f"{args.rows} features, {len(data) / 1024 / 1024:.1f} MiB of NDJSON")
+
+    bench("legacy", flatten_legacy, data, args.repeat)
+    bench("arrow", flatten_arrow, data, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
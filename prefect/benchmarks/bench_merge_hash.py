@@ -0,0 +1,120 @@
+"""
+Compare the slot time of the merge with the hash values calculated in the merge (the former UPDATE + INSERT)
+and with the hash values calculated once at load time (get_hash_query + get_merge_query).
+
+Both merges run against zero-copy clones of usgs_data with the same new data:
+the valid records of the last `--days` days, `--update-ratio` of them with a changed properties_updated.
+
+Usage (working directory is `prefect`, environment variables loaded):
+    python -m benchmarks.bench_merge_hash --days 30
+"""
+import argparse
+
+from flows.utils.clients import get_bigquery_client
+from flows.utils.gcs_to_bq import (PROJECT_ID, RAW_DATASET, USGS_TABLE,
+                                   get_schema_field_names, get_hash_columns, get_hash_expr,
+                                   get_hash_query, get_merge_query)
+
+
+BENCH_PREFIX = f"{PROJECT_ID}.{RAW_DATASET}.bench_merge_hash"
+
+
+def get_inline_hash_query(temp_ref, table_ref, columns) -> str:
+    """The merge with the hash values calculated in the statements (before they were calculated at load time)."""
+    columns_str = ", ".join(columns)
+    farm_fingerprint_expr = get_hash_expr(columns)
+
+    return f"""
+    UPDATE `{table_ref}` AS t2
+    SET
+    is_valid = FALSE,
+    valid_to = CURRENT_TIMESTAMP()
+    WHERE
+    is_valid = TRUE
+    AND EXISTS (
+        SELECT 1
+        FROM `{temp_ref}` AS t1
+        WHERE t1.id = t2.id
+        AND NOT {farm_fingerprint_expr} = t2.hash_value
+    );
+
+    INSERT INTO `{table_ref}` (id, {columns_str}, is_valid, valid_from, valid_to, hash_value)
+    SELECT
+    id,
+    {columns_str},
+    TRUE AS is_valid,
+    CURRENT_TIMESTAMP() AS valid_from,
+    NULL AS valid_to,
+    {farm_fingerprint_expr} AS hash_value
+    FROM
+    `{temp_ref}` AS t1
+    WHERE
+    NOT EXISTS (
+        SELECT 1
+        FROM `{table_ref}` AS t2
+        WHERE t2.id = t1.id
+        AND t2.is_valid = TRUE
+        AND {farm_fingerprint_expr} = t2.hash_value
+    );
+    """
+
+
+def run(client, query) -> dict:
+    """Run a query (or a script) and return the stats summed over its child jobs."""
+    job = client.query(query)
+    job.result()
+
+    jobs = list(client.list_jobs(parent_job=job.job_id)) or [job]
+    return {
+        "slot_ms": sum(child.slot_millis or 0 for child in jobs),
+        "bytes_processed": sum(child.total_bytes_processed or 0 for child in jobs),
+        "elapsed_s": (job.ended - job.started).total_seconds(),
+    }
+
+
+def main(days: int, update_ratio: float) -> None:
+    client = get_bigquery_client()
+
+    temp_ref = f"{BENCH_PREFIX}_temp"
+    hashed_ref = f"{BENCH_PREFIX}_temp_hashed"
+    inline_ref = f"{BENCH_PREFIX}_inline"
+    precomputed_ref = f"{BENCH_PREFIX}_precomputed"
+    columns = get_hash_columns()
+    fields = [field for field in get_schema_field_names() if field != "properties_updated"]
+
+    setup = f"""
+    CREATE OR REPLACE TABLE `{inline_ref}` CLONE `{USGS_TABLE}`;
+    CREATE OR REPLACE TABLE `{precomputed_ref}` CLONE `{USGS_TABLE}`;
+
+    CREATE OR REPLACE TABLE `{temp_ref}` AS
+    SELECT
+    {", ".join(fields)},
+    IF(RAND() < {update_ratio}, properties_updated + 1, properties_updated) AS properties_updated
+    FROM `{USGS_TABLE}`
+    WHERE is_valid = TRUE
+    AND properties_time >= UNIX_MILLIS(TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY));
+    """
+    client.query(setup).result()
+
+    try:
+        results = {
+            "inline": run(client, get_inline_hash_query(temp_ref, inline_ref, columns)),
+            "precomputed (hash at load)": run(client, get_hash_query(f"`{temp_ref}`", hashed_ref)),
+            "precomputed (merge)": run(client, get_merge_query(hashed_ref, columns, table_ref=precomputed_ref)),
+        }
+    finally:
+        for table_ref in [temp_ref, hashed_ref, inline_ref, precomputed_ref]:
+            client.delete_table(table_ref, not_found_ok=True)
+
+    print(f"{'variant':<28}{'slot ms':>12}{'bytes processed':>18}{'elapsed s':>12}")
+    for name, stats in results.items():
+        print(f"{name:<28}{stats['slot_ms']:>12}{stats['bytes_processed']:>18}{stats['elapsed_s']:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=30, help="days of new data to merge")
+    parser.add_argument("--update-ratio", type=float, default=0.1, help="ratio of updated records")
+    args = parser.parse_args()
+
+    main(args.days, args.update_ratio)
@@ -0,0 +1,124 @@
+"""
+Run the whole web_to_gcs_to_bq flow offline and report its throughput, peak memory and latency by stage.
+
+USGS, GCS and BigQuery are replaced by the local stand-ins of benchmarks/offline:
+a synthetic FDSN event service (`--events-per-day` events every day) in a separate process,
+a local directory as the bucket and a DuckDB database (the duckdb warehouse backend) as the BigQuery dataset.
+Everything else (planner, USGS client and token bucket, streaming, serialization, loaders, hash and merge SQL)
+is the code of the pipeline. The flow runs with the Prefect API of the environment
+(an ephemeral local one if PREFECT_API_URL is not set). The BigQuery statistics (bytes processed, slot time)
+are not available, the DuckDB statements are run one at a time.
+
+Usage (working directory is `prefect`):
+    python -m benchmarks.bench_pipeline --days 365 --events-per-day 500 --max-workers 4
+    python -m benchmarks.bench_pipeline --days 365 --fetch-engine async --max-workers 8 --batch-size 10
+"""
+import argparse
+import os
+import resource
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+import flows.utils.async_fetch as async_fetch
+import flows.utils.web_to_gcs as web_to_gcs
+import flows.utils.web_to_gcs_to_bq as web_to_gcs_to_bq
+from benchmarks.offline.fake_gcs import FakeBucket, FakeGCSFileSystem
+from benchmarks.offline.fake_usgs import start_server
+from flows.utils.clients import set_clients, clear_clients
+from flows.utils.duckdb_warehouse import DuckDBClient
+from flows.utils.gcs_to_bq import USGS_TABLE
+from flows.utils.usgs_client import get_client
+
+
+def use_stand_ins(work_dir: str, events_per_day: int, rate: float):
+    """Point the pipeline to the local stand-ins, returns the USGS server process and the DuckDB client."""
+    process, base_url = start_server(events_per_day)
+    web_to_gcs.USGS_QUERY_URL = f"{base_url}/query"
+    async_fetch.USGS_QUERY_URL = f"{base_url}/query"
+    web_to_gcs_to_bq.USGS_COUNT_URL = f"{base_url}/count"
+
+    # the limit of the real USGS doesn't apply
+    get_client().bucket.rate = rate
+    get_client().bucket.capacity = max(1, int(rate))
+
+    bucket = FakeBucket(os.path.join(work_dir, "lake"))
+    fs = FakeGCSFileSystem(bucket.root)
+    client = DuckDBClient(os.path.join(work_dir, "warehouse.duckdb"), fs)
+    set_clients(bucket=bucket, gcs_bucket=bucket.get_block(), gcsfs=fs, bigquery_client=client)
+    return process, client
+
+
+def percentile(values: list, q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def print_report(records: list, rows: int, elapsed: float) -> None:
+    # ru_maxrss is in KiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{rows} events in {elapsed:.1f} s: {rows / elapsed:.0f} events/s, peak RSS {peak_rss:.0f} MiB")
+
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+
+    print(f"{'stage':<12}{'chunks':>8}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}{'rows':>12}{'MiB':>10}")
+    for stage, stage_records in stages.items():
+        seconds = [record.get("seconds", 0) for record in stage_records]
+        print(f"{stage:<12}{len(stage_records):>8}"
+              f"{percentile(seconds, 50) * 1000:>10.1f}{percentile(seconds, 95) * 1000:>10.1f}"
+              f"{sum(seconds):>10.1f}"
+              f"{sum(record.get('rows', 0) for record in stage_records):>12}"
+              f"{sum(record.get('bytes', 0) for record in stage_records) / 1024 / 1024:>10.1f}")
+
+
+def main(args) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        process, client = use_stand_ins(work_dir, args.events_per_day, args.rate)
+
+        # keep the records emitted at the end of the flow run
+        records = []
+        emit_metrics = web_to_gcs_to_bq.emit_metrics
+        web_to_gcs_to_bq.emit_metrics = lambda logger=None: records.extend(emit_metrics(logger)) or records
+
+        try:
+            start = time.perf_counter()
+            web_to_gcs_to_bq.web_to_gcs_to_bq(
+                args.start_date, args.start_date + timedelta(days=args.days),
+                max_workers=args.max_workers,
+                compress=args.compress,
+                file_format=args.file_format,
+                load_mode=args.load_mode,
+                batch_size=args.batch_size,
+                fetch_engine=args.fetch_engine)
+            elapsed = time.perf_counter() - start
+
+            rows = client.query(f"SELECT COUNT(*) AS rows FROM `{USGS_TABLE}` WHERE is_valid").result()[0]["rows"]
+            print_report(records, rows, elapsed)
+        finally:
+            web_to_gcs_to_bq.emit_metrics = emit_metrics
+            clear_clients()
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date(2023, 1, 1))
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--events-per-day", type=int, default=500)
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--fetch-engine", choices=web_to_gcs_to_bq.FETCH_ENGINES, default="threads")
+    parser.add_argument("--file-format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--compress", action="store_true", help="gzip the NDJSON files")
+    parser.add_argument("--load-mode", choices=["dataframe", "native"], default="dataframe")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second to the local USGS")
+    parser.add_argument("--work-dir", help="directory of the bucket and the DuckDB database (temporary by default), "
+                                           "e.g. to run dbt on the database afterwards")
+
+    main(parser.parse_args())
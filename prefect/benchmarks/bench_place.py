@@ -0,0 +1,59 @@
+"""
+Check and benchmark the place normalization of dim_place (dbt/macros/place.sql).
+
+Reads dwh_usgs and dim_place of the dbt target from the warehouse (BigQuery, or DuckDB with
+WORLD_EARTHQUAKE_WAREHOUSE=duckdb) and reports:
+- how many place expressions the former mart evaluated (one per row) and dim_place does (one per distinct place_orig)
+- the time of the Python normalizer (flows/utils/place.py) per row and per distinct place_orig
+- the place_orig for which the SQL and the Python normalizer disagree (they should be kept in sync)
+
+Usage (working directory is `prefect`, environment variables loaded, after `dbt build`):
+    python -m benchmarks.bench_place
+    python -m benchmarks.bench_place --schema earthquake_prod --limit 1000000
+"""
+import argparse
+import os
+import time
+
+from flows.utils.clients import get_bigquery_client, PROJECT_ID
+from flows.utils.place import get_place_orig, normalize_place
+
+
+def timed(fn, values) -> float:
+    start = time.perf_counter()
+    for value in values:
+        fn(value)
+    return time.perf_counter() - start
+
+
+def main(schema: str, limit: int) -> None:
+    client = get_bigquery_client()
+    places = [row["properties_place"] for row in client.query(
+        f"SELECT properties_place FROM `{PROJECT_ID}.{schema}_dwh.dwh_usgs` LIMIT {limit}").result()]
+    dim_place = {row["place_orig"]: row["place"] for row in client.query(
+        f"SELECT place_orig, place FROM `{PROJECT_ID}.{schema}_dwh.dim_place`").result()}
+
+    places_orig = [get_place_orig(place) for place in places]
+    distinct = sorted({place_orig for place_orig in places_orig if place_orig is not None})
+    print(f"{len(places)} rows, {len(distinct)} distinct place_orig: "
+          f"{len(places) / max(1, len(distinct)):.0f}x fewer place expressions to evaluate")
+
+    per_row = timed(normalize_place.__wrapped__, places_orig)
+    per_distinct = timed(normalize_place.__wrapped__, distinct)
+    print(f"python normalizer: {per_row:.3f} s for every row, {per_distinct:.3f} s for the distinct place_orig")
+
+    mismatches = [(place_orig, dim_place.get(place_orig), normalize_place(place_orig))
+                  for place_orig in distinct if dim_place.get(place_orig) != normalize_place(place_orig)]
+    print(f"{len(mismatches)} place_orig differ between dim_place and the python normalizer")
+    for place_orig, sql_place, python_place in mismatches[:20]:
+        print(f"  {place_orig!r}: sql={sql_place!r} python={python_place!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schema", default=f"earthquake_{os.environ.get('ENV')}",
+                        help="schema of the dbt target (the datasets are <schema>_dwh, <schema>_mart)")
+    parser.add_argument("--limit", type=int, default=1000000, help="rows of dwh_usgs to read")
+
+    args = parser.parse_args()
+    main(args.schema, args.limit)
@@ -0,0 +1,4 @@
+"""
+Local stand-ins for USGS (HTTP server) and GCS (local directory), with the DuckDB warehouse in place of BigQuery,
+to run the pipeline end to end without cloud access, see benchmarks/bench_pipeline.py.
+"""
@@ -0,0 +1,93 @@
+"""
+Local stand-in for the GCS bucket of the data lake: the objects are files under a local directory.
+It implements what the pipeline uses of google.cloud.storage (Bucket.blob/copy_blob,
+Blob.open/exists/upload_from_string/delete/reload/crc32c), of the GcsBucket block (.bucket)
+and of gcsfs (an fsspec file system of gs:// URIs, which the DuckDB warehouse reads too).
+"""
+import base64
+import os
+import shutil
+from types import SimpleNamespace
+
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+from google.cloud.exceptions import NotFound
+from google_crc32c import Checksum
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.crc32c = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.bucket.path, self.name)
+
+    def open(self, mode: str = "rb", chunk_size: int = None, ignore_flush: bool = False, content_type: str = None,
+             **kwargs):
+        if "w" in mode:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.crc32c = None
+        return open(self.path, mode)
+
+    def exists(self, **kwargs) -> bool:
+        return os.path.exists(self.path)
+
+    def upload_from_string(self, data, content_type: str = None, **kwargs) -> None:
+        with self.open("wb") as file:
+            file.write(data.encode() if isinstance(data, str) else data)
+
+    def delete(self, **kwargs) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def reload(self, **kwargs) -> None:
+        if not self.exists():
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        checksum = Checksum()
+        with open(self.path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                checksum.update(chunk)
+        self.crc32c = base64.b64encode(checksum.digest()).decode()
+
+
+class FakeBucket:
+    """The bucket `name` is the directory root/name."""
+
+    def __init__(self, root: str, name: str = "offline-bucket"):
+        self.root = root
+        self.name = name
+        self.path = os.path.join(root, name)
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def copy_blob(self, blob: FakeBlob, destination_bucket: "FakeBucket", new_name: str = None, **kwargs) -> FakeBlob:
+        new_blob = destination_bucket.blob(new_name or blob.name)
+        if not blob.exists():
+            raise NotFound(f"No such object: {self.name}/{blob.name}")
+        os.makedirs(os.path.dirname(new_blob.path), exist_ok=True)
+        shutil.copyfile(blob.path, new_blob.path)
+        return new_blob
+
+    def get_block(self):
+        """The GcsBucket block of this bucket (only its bucket name is used)."""
+        return SimpleNamespace(bucket=self.name)
+
+
+class FakeGCSFileSystem(DirFileSystem):
+    """gs://<bucket>/<path> URIs mapped to root/<bucket>/<path>."""
+
+    protocol = "gs"
+
+    def __init__(self, root: str, **kwargs):
+        super().__init__(path=root, fs=LocalFileSystem(auto_mkdir=True), **kwargs)
+
+    def _join(self, path):
+        if isinstance(path, str):
+            path = path.split("://", 1)[-1]
+        return super()._join(path)
@@ -0,0 +1,155 @@
+"""
+Local stand-in for the USGS FDSN event web service (/count and /query?format=geojson).
+
+Events are synthetic and deterministic: `events_per_day` events evenly spaced in time from EPOCH_START,
+every event has all the properties of a real USGS feature with values derived from its index.
+Their places, magnitudes and magnitude types are distributed roughly like the USGS catalog (see REGIONS).
+Like USGS, a query of more than LIMIT events fails with 400.
+"""
+import gzip
+import json
+import math
+import multiprocessing
+import random
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LIMIT = 20000
+DAY_MS = 24 * 60 * 60 * 1000
+EPOCH_START = datetime(1950, 1, 1, tzinfo=timezone.utc)
+# (weight, region, towns, magnitude type of the small events, minimum magnitude):
+# mostly small events of the US regional networks, the M4+ events of the world (magnitudes of
+# Gutenberg-Richter with b = 1 above the minimum, mww from GLOBAL_MWW_MAG on, from US_MWW_MAG on in the US)
+REGIONS = [
+    (33, "CA", ["Ridgecrest", "The Geysers", "Cobb", "Anza", "Petrolia"], "md", 0.0),
+    (30, "Alaska", ["Anchorage", "Willow", "Sand Point", "Nikiski", "Adak"], "ml", 0.5),
+    (6, "Nevada", ["Mina", "Tonopah", "Dayton"], "ml", 0.0),
+    (5, "Hawaii", ["Pahala", "Volcano", "Naalehu"], "md", 1.0),
+    (4, "Puerto Rico", ["Tallaboa", "Guanica", "Indios"], "md", 1.5),
+    (3, "Utah", ["Magna", "Beaver"], "ml", 0.5),
+    (3, "Washington", ["Mount St. Helens", "Entiat"], "ml", 0.0),
+    (2, "Oklahoma", ["Perry", "Guthrie"], "ml", 1.5),
+    (3, "Japan", ["Tokyo", "Miyako", "Namie"], "mb", 4.0),
+    (3, "Indonesia", ["Sinabang", "Abepura", "Tobelo"], "mb", 4.0),
+    (2, "Chile", ["Ovalle", "Iquique"], "mb", 4.0),
+    (2, "Tonga", ["Pangai", "Neiafu"], "mb", 4.0),
+    (2, "Papua New Guinea", ["Kokopo", "Kimbe"], "mb", 4.0),
+    (2, "Philippines", ["Sarangani", "Burias"], "mb", 4.0),
+]
+US_MWW_MAG = 4.5
+GLOBAL_MWW_MAG = 5.5
+
+
+def parse_time(value: str) -> int:
+    """USGS time parameter (date or ISO 8601 datetime, UTC) to epoch milliseconds."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+class EventSource:
+    def __init__(self, events_per_day: int, updated_lag_ms: int = 3600000):
+        self.interval_ms = DAY_MS / events_per_day
+        self.epoch_ms = int(EPOCH_START.timestamp() * 1000)
+        self.updated_lag_ms = updated_lag_ms
+
+    def first_index(self, time_ms: int) -> int:
+        """Index of the first event with time >= time_ms."""
+        return max(0, math.ceil((time_ms - self.epoch_ms) / self.interval_ms))
+
+    def index_range(self, start_ms: int, end_ms: int, updated_after_ms: int = None) -> range:
+        """Indexes of the events with start_ms <= time < end_ms (and updated > updated_after_ms)."""
+        first = self.first_index(start_ms)
+        if updated_after_ms is not None:
+            first = max(first, self.first_index(updated_after_ms - self.updated_lag_ms + 1))
+        return range(first, max(first, self.first_index(end_ms)))
+
+    def feature(self, i: int) -> dict:
+        rng = random.Random(i)
+        time_ms = self.epoch_ms + int(i * self.interval_ms)
+        _, region, towns, small_mag_type, min_mag = rng.choices(REGIONS, weights=[r[0] for r in REGIONS])[0]
+        mag = round(min(9.5, min_mag + rng.expovariate(math.log(10))), 2)
+        mww_mag = GLOBAL_MWW_MAG if small_mag_type == "mb" else US_MWW_MAG
+        mag_type = "mww" if mag >= mww_mag else small_mag_type
+        place = f"{rng.randint(1, 300)} km {rng.choice('NSEW')} of {rng.choice(towns)}, {region}"
+        code = f"{i:010d}"
+        return {
+            "type": "Feature",
+            "properties": {
+                "mag": mag, "place": place, "time": time_ms, "updated": time_ms + self.updated_lag_ms,
+                "tz": None, "url": f"https://earthquake.usgs.gov/earthquakes/eventpage/fk{code}",
+                "detail": f"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=fk{code}&format=geojson",
+                "felt": None, "cdi": None, "mmi": None, "alert": None, "status": "reviewed", "tsunami": 0,
+                "sig": rng.randint(0, 1000), "net": "fk", "code": code, "ids": f",fk{code},", "sources": ",fk,",
+                "types": ",origin,phase-data,", "nst": rng.randint(0, 200), "dmin": round(rng.random(), 4),
+                "rms": round(rng.random(), 2), "gap": round(rng.uniform(0, 360), 1),
+                "magType": mag_type, "type": "earthquake", "title": f"M {mag} - {place}"
+            },
+            "geometry": {"type": "Point", "coordinates": [round(rng.uniform(-180, 180), 4),
+                                                          round(rng.uniform(-90, 90), 4),
+                                                          round(rng.uniform(0, 700), 2)]},
+            "id": f"fk{code}"
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    source: EventSource = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str) -> None:
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_response(status)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            updated_after = parse_time(params["updatedafter"]) if "updatedafter" in params else None
+            indexes = self.source.index_range(parse_time(params["starttime"]), parse_time(params["endtime"]),
+                                              updated_after)
+        except (KeyError, ValueError) as e:
+            self.send_body(400, f"Bad Request: {e}".encode(), "text/plain")
+            return
+
+        if url.path.endswith("/count"):
+            self.send_body(200, str(len(indexes)).encode(), "text/plain")
+        elif url.path.endswith("/query"):
+            if len(indexes) > LIMIT:
+                self.send_body(400, f"Bad Request: {len(indexes)} matching events exceeds search limit of {LIMIT}."
+                               .encode(), "text/plain")
+                return
+            features = ",".join(json.dumps(self.source.feature(i)) for i in indexes)
+            body = f'{{"type":"FeatureCollection","metadata":{{"count":{len(indexes)}}},"features":[{features}]}}'
+            self.send_body(200, body.encode(), "application/json")
+        else:
+            self.send_body(404, b"Not Found", "text/plain")
+
+
+def serve(events_per_day: int, port: int = 0, ready=None) -> None:
+    Handler.source = EventSource(events_per_day)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(events_per_day: int):
+    """Start the server in a separate process (not to count it in the RSS and the GIL of the pipeline)."""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(events_per_day, 0, ready), daemon=True)
+    process.start()
+    port = ready.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}/fdsnws/event/1"
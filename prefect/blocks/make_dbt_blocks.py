@@ -1,6 +1,9 @@
 import os
 from prefect_gcp.credentials import GcpCredentials
 from prefect_dbt.cli import BigQueryTargetConfigs, DbtCliProfile
+from prefect_dbt.cli.configs import TargetConfigs
+
+from flows.utils.clients import DUCKDB_PATH, WAREHOUSE
 
 
 BASE_NAME = "world-earthquake-pipeline"
@@ -10,13 +13,21 @@ BLOCK_NAME = f"{BASE_NAME}-{ENV}"
 SCHEMA_NAME = f"earthquake_{ENV}"
 DBT_PROFILE_NAME = "world_earthquake_pipeline"
 
-credentials = GcpCredentials.load(BLOCK_NAME)
-target_configs = BigQueryTargetConfigs(
-    schema=SCHEMA_NAME,
-    project=PROJECT_ID,
-    location="EU",
-    credentials=credentials,
-)
+if WAREHOUSE == "duckdb":
+    # the database file written by the flows
+    target_configs = TargetConfigs(
+        type="duckdb",
+        schema=SCHEMA_NAME,
+        extras={"path": DUCKDB_PATH},
+    )
+else:
+    credentials = GcpCredentials.load(BLOCK_NAME)
+    target_configs = BigQueryTargetConfigs(
+        schema=SCHEMA_NAME,
+        project=PROJECT_ID,
+        location="EU",
+        credentials=credentials,
+    )
 target_configs.save(BLOCK_NAME, overwrite=True)
 
 dbt_cli_profile = DbtCliProfile(
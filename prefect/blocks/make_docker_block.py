@@ -1,5 +1,5 @@
 import os
-from prefect.infrastructure.docker import DockerContainer
+from prefect.infrastructure.container import DockerContainer
 
 WORLD_EARTHQUAKE_FLOWS_DOCKER_IMAGE = os.environ.get("WORLD_EARTHQUAKE_FLOWS_DOCKER_IMAGE")
 BASE_NAME = "world-earthquake-pipeline"
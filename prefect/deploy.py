@@ -4,7 +4,8 @@ from flows.web_to_gcs_to_bq_with_params import web_to_gcs_to_bq_with_params
 from flows.web_to_gcs_to_bq_all import web_to_gcs_to_bq_all
 from flows.web_to_gcs_to_bq_daily import web_to_gcs_to_bq_daily
 from flows.run_dbt import run_dbt
-from prefect.infrastructure.docker import DockerContainer
+from flows.migrate_usgs_table import migrate_usgs_table
+from prefect.infrastructure.container import DockerContainer
 from prefect.server.schemas.schedules import CronSchedule
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -14,6 +15,7 @@ PROJECT_ID = os.environ.get("WORLD_EARTHQUAKE_PROJECT_ID")
 ENV = os.environ.get("ENV")
 BLOCK_NAME = f"{BASE_NAME}-{ENV}"
 WORK_POOL_NAME = os.environ.get("WORK_POOL_NAME")
+MANIFEST_PATH = os.environ.get("WORLD_EARTHQUAKE_MANIFEST_PATH", "")
 
 
 docker_block = DockerContainer.load(BLOCK_NAME)
@@ -23,7 +25,8 @@ docker_dep_web_to_gcs_to_bq_with_params = Deployment.build_from_flow(
     name="deploy",
     infrastructure=docker_block,
     infra_overrides={
-        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV},
+        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV,
+        "env.WORLD_EARTHQUAKE_MANIFEST_PATH": MANIFEST_PATH},
     tags=[BASE_NAME, ENV],
     work_pool_name=WORK_POOL_NAME
 )
@@ -33,7 +36,8 @@ docker_dep_web_to_gcs_to_bq_all = Deployment.build_from_flow(
     name="deploy",
     infrastructure=docker_block,
     infra_overrides={
-        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV},
+        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV,
+        "env.WORLD_EARTHQUAKE_MANIFEST_PATH": MANIFEST_PATH},
     tags=[BASE_NAME, ENV],
     work_pool_name=WORK_POOL_NAME
 )
@@ -43,22 +47,49 @@ docker_dep_web_to_gcs_to_bq_daily = Deployment.build_from_flow(
     name="deploy",
     infrastructure=docker_block,
     infra_overrides={
-        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV},
+        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV,
+        "env.WORLD_EARTHQUAKE_MANIFEST_PATH": MANIFEST_PATH},
     tags=[BASE_NAME, ENV],
     work_pool_name=WORK_POOL_NAME,
     schedule=(CronSchedule(cron="0 5 * * *", timezone="UTC"))
 )
 
 
+# not scheduled: web_to_gcs_to_bq_daily runs it when its ingest is done (for the months which changed)
 docker_dep_run_dbt = Deployment.build_from_flow(
     flow=run_dbt,
     name="deploy",
     infrastructure=docker_block,
     infra_overrides={
-        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV},
+        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV,
+        "env.WORLD_EARTHQUAKE_MANIFEST_PATH": MANIFEST_PATH},
+    tags=[BASE_NAME, ENV],
+    work_pool_name=WORK_POOL_NAME
+)
+
+# weekly catch-up: builds the months the daily runs didn't build (e.g. after a failed dbt build)
+docker_dep_run_dbt_catch_up = Deployment.build_from_flow(
+    flow=run_dbt,
+    name="catch-up",
+    infrastructure=docker_block,
+    infra_overrides={
+        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV,
+        "env.WORLD_EARTHQUAKE_MANIFEST_PATH": MANIFEST_PATH},
     tags=[BASE_NAME, ENV],
     work_pool_name=WORK_POOL_NAME,
-    schedule=(CronSchedule(cron="5 5 * * *", timezone="UTC"))
+    parameters={"catch_up": True},
+    schedule=(CronSchedule(cron="0 6 * * 0", timezone="UTC"))
+)
+
+# not scheduled: run it once from the UI after upgrading, before the next ingest (its steps are idempotent)
+docker_dep_migrate_usgs_table = Deployment.build_from_flow(
+    flow=migrate_usgs_table,
+    name="deploy",
+    infrastructure=docker_block,
+    infra_overrides={
+        "env.WORLD_EARTHQUAKE_PROJECT_ID": PROJECT_ID, "env.ENV": ENV},
+    tags=[BASE_NAME, ENV],
+    work_pool_name=WORK_POOL_NAME
 )
 
 
@@ -67,3 +98,5 @@ if __name__ == "__main__":
     docker_dep_web_to_gcs_to_bq_all.apply()
     docker_dep_web_to_gcs_to_bq_daily.apply()
     docker_dep_run_dbt.apply()
+    docker_dep_run_dbt_catch_up.apply()
+    docker_dep_migrate_usgs_table.apply()
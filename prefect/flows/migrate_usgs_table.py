@@ -0,0 +1,61 @@
+from datetime import datetime
+from prefect import flow, get_run_logger
+
+from flows.utils.clients import get_bigquery_client
+from flows.utils.gcs_to_bq import USGS_TABLE, get_usgs_table, get_missing_strings_query
+
+
+@flow(name="world-earthquake-pipeline: migrate_usgs_table")
+def migrate_usgs_table() -> None:
+    """
+    Migrate an existing USGS table:
+    - if it was created before partitioning, to the partitioned and clustered table (partition_usgs_table)
+    - the missing strings stored as "nan" or "None" by the former pandas load path to NULL (with their hash value)
+    Each step does nothing if it was already done.
+    """
+    partition_usgs_table()
+
+    logger = get_run_logger()
+    job = get_bigquery_client().query(get_missing_strings_query())
+    job.result()
+    logger.info(f"missing strings set to NULL: {job.num_dml_affected_rows or 0} records")
+
+
+def partition_usgs_table() -> None:
+    """
+    Copy the data to a new partitioned and clustered table, keep the old table as usgs_data_backup_YYYYMMDD
+    and rename the new table to usgs_data.
+    Please delete the backup table manually after checking the new table.
+    """
+    logger = get_run_logger()
+
+    client = get_bigquery_client()
+
+    table = client.get_table(USGS_TABLE)
+    if table.range_partitioning and table.clustering_fields:
+        logger.info(f"already partitioned: {USGS_TABLE}")
+        return
+
+    table_name = USGS_TABLE.split(".")[-1]
+    new_table_ref = f"{USGS_TABLE}_partitioned"
+    backup_table_name = f"{table_name}_backup_{datetime.now():%Y%m%d}"
+
+    logger.info(f"create table: {new_table_ref}")
+    client.delete_table(new_table_ref, not_found_ok=True)
+    client.create_table(get_usgs_table(new_table_ref, table.schema))
+
+    query = f"""
+    INSERT INTO `{new_table_ref}`
+    SELECT * FROM `{USGS_TABLE}`;
+
+    ALTER TABLE `{USGS_TABLE}` RENAME TO `{backup_table_name}`;
+
+    ALTER TABLE `{new_table_ref}` RENAME TO `{table_name}`;
+    """
+    client.query(query).result()
+
+    logger.info(f"migrated: {USGS_TABLE} (backup: {backup_table_name})")
+
+
+if __name__ == "__main__":
+    migrate_usgs_table()
@@ -1,6 +1,12 @@
+import json
 import os
-from prefect import flow
+from prefect import flow, get_run_logger
 from prefect_dbt.cli.commands import DbtCoreOperation, DbtCliProfile
+from google.cloud.exceptions import NotFound
+
+from flows.utils.clients import clear_clients, get_bigquery_client, WAREHOUSE
+from flows.utils.gcs_to_bq import get_months, DAY_MILLIS, USGS_TABLE
+from flows.utils.manifest import get_manifest, save_manifest, now
 
 BASE_NAME = "world-earthquake-pipeline"
 PROJECT_ID = os.environ.get("WORLD_EARTHQUAKE_PROJECT_ID")
@@ -8,21 +14,131 @@ ENV = os.environ.get("ENV")
 BLOCK_NAME = f"{BASE_NAME}-{ENV}"
 DBT_DIR = "../dbt"
 DBT_PROFILES_DIR = "../dbt"  # we don't use ~/.dbt
+# the watermark of the manifest: when the last successful run_dbt started
+DBT_WATERMARK = "dbt"
+# the last model built from the USGS table and its first time (1950-01-01), compared to it by get_unbuilt_query
+MART_TABLE = f"{PROJECT_ID}.earthquake_{ENV}_mart.mart_earthquake"
+MART_START_MILLIS = -631152000000
+
+
+# the models built from the USGS table (all models which may change when it changes), see get_dbt_command
+DBT_SELECTOR = "source:earthquake_raw.usgs_data+"
+
+
+def get_changed_months(changed_months: list = None, manifest=None):
+    """
+    The months to build: changed_months plus the months of the files merged since the last run_dbt
+    according to the manifest (if used and run_dbt already recorded its watermark).
+    None if they aren't known (every model is built incrementally from the records updated since the last build).
+    """
+    if manifest is None:
+        return changed_months
+    watermark = manifest.get_watermark(DBT_WATERMARK)
+    if watermark is None:
+        return changed_months
+    recorded = manifest.get_changed_months(watermark)
+    if recorded is None:
+        return None
+    return sorted(set(recorded) | set(changed_months or []))
+
+
+def get_unbuilt_query(table_ref=USGS_TABLE, mart_ref=MART_TABLE) -> str:
+    """
+    Get the query of the days (days since the epoch) whose valid records of table_ref differ from the events
+    of mart_ref in number or in the sum of their update times: the days merged since their last successful build
+    (mart_ref is built last, after dwh_usgs and dim_place). Only the time and update time columns are scanned.
+    """
+    return f"""
+    WITH raw AS (
+    SELECT
+    CAST(FLOOR(properties_time / {DAY_MILLIS}) AS INT64) AS day,
+    COUNT(*) AS events,
+    SUM(properties_updated) AS updated
+    FROM `{table_ref}`
+    WHERE is_valid = TRUE AND properties_time >= {MART_START_MILLIS}
+    GROUP BY day
+    ), mart AS (
+    SELECT
+    CAST(FLOOR(UNIX_MILLIS(time) / {DAY_MILLIS}) AS INT64) AS day,
+    COUNT(*) AS events,
+    SUM(UNIX_MILLIS(updated)) AS updated
+    FROM `{mart_ref}`
+    GROUP BY day
+    )
+    SELECT COALESCE(raw.day, mart.day) AS day
+    FROM raw FULL OUTER JOIN mart ON raw.day = mart.day
+    WHERE raw.events IS DISTINCT FROM mart.events OR raw.updated IS DISTINCT FROM mart.updated
+    """
+
+
+def get_unbuilt_months(client, table_ref=USGS_TABLE, mart_ref=MART_TABLE):
+    """The months ("YYYY-MM") of the days of get_unbuilt_query, None if mart_ref wasn't built yet."""
+    try:
+        client.get_table(mart_ref)
+    except NotFound:
+        return None
+    rows = client.query(get_unbuilt_query(table_ref, mart_ref)).result()
+    return get_months([row["day"] for row in rows], margin=0)
+
+
+def get_dbt_command(full_refresh: bool = False, changed_months: list = None) -> str:
+    dbt_vars = {"is_test_run": False}
+    if full_refresh:
+        return f"dbt build --target {ENV} --vars '{json.dumps(dbt_vars)}' --full-refresh"
+    if changed_months is None:
+        return f"dbt build --target {ENV} --vars '{json.dumps(dbt_vars)}'"
+    dbt_vars["changed_months"] = changed_months
+    return f"dbt build --target {ENV} --select {DBT_SELECTOR} --vars '{json.dumps(dbt_vars)}'"
 
 
 @flow(name="world-earthquake-pipeline: run_dbt")
-def run_dbt(full_refresh: bool = False) -> str:
+def run_dbt(full_refresh: bool = False, changed_months: list = None, catch_up: bool = False) -> str:
+    """
+    Build the dbt models.
+    With changed_months (the months "YYYY-MM" of properties_time changed since the last build, e.g. passed by
+    web_to_gcs_to_bq_daily when its ingest is done), only the models built from the USGS table are built,
+    only these monthly partitions of them are rebuilt and only these partitions of their sources are read.
+    The months of the files merged since the last run_dbt are added from the manifest (WORLD_EARTHQUAKE_MANIFEST_PATH).
+    With catch_up (the weekly deployment), the months whose valid records differ from mart_earthquake are added
+    (see get_unbuilt_query), e.g. the months of a failed build, which are lost without the manifest.
+    They are known without changed_months and without the manifest, unless mart_earthquake wasn't built yet.
+    Nothing is built if no month changed. If the months aren't known (no changed_months and no manifest),
+    every model is merged with the records updated since the last build.
+    """
+    logger = get_run_logger()
+    started_at = now()
+
+    manifest = get_manifest()
+    if not full_refresh:
+        changed_months = get_changed_months(changed_months, manifest)
+        if catch_up:
+            # the comparison finds every month the merges changed, the months known before are added to it
+            unbuilt_months = get_unbuilt_months(get_bigquery_client())
+            logger.info(f"unbuilt months: {unbuilt_months if unbuilt_months is not None else 'unknown'}")
+            changed_months = (None if unbuilt_months is None
+                              else sorted(set(changed_months or []) | set(unbuilt_months)))
+        logger.info(f"changed months: {changed_months if changed_months is not None else 'unknown'}")
+        if changed_months == []:
+            logger.info("nothing changed since the last build, nothing to do")
+            return None
 
-    command = f"dbt build --target {ENV} --vars 'is_test_run: false'{' --full-refresh' if full_refresh else ''}"
+    if WAREHOUSE == "duckdb":
+        # dbt opens the database file in another process, close the connection of this one
+        clear_clients()
 
     result = DbtCoreOperation(
-        commands=[command],
+        commands=[get_dbt_command(full_refresh, changed_months)],
         project_dir=DBT_DIR,
         profiles_dir=DBT_PROFILES_DIR,
         dbt_cli_profile=DbtCliProfile.load(BLOCK_NAME),
         overwrite_profiles=True
     ).run()
 
+    if manifest:
+        # the files merged during this run are built again by the next one
+        manifest.set_watermark(DBT_WATERMARK, started_at)
+        save_manifest()
+
     return result
 
 
@@ -0,0 +1,179 @@
+import asyncio
+import contextvars
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import IO, Iterator
+
+import httpx
+
+from flows.utils.geojson_stream import iter_features
+from flows.utils.manifest import record_failure
+from flows.utils.metrics import get_chunk_metrics, ChunkMetrics
+from flows.utils.usgs_client import (get_client, get_backoff, get_retry_after, USGS_QUERY_URL, RETRY_STATUSES,
+                                     MAX_RETRIES)
+from flows.utils.web_to_gcs import (get_file_path, get_query_params, if_file_exists, record_upload,
+                                    write_features_to_gcs, DOWNLOAD_CHUNK_SIZE)
+
+# requests to USGS in flight (the downloads wait for a slot of the token bucket too)
+MAX_FETCHES = 16
+# conversions and uploads to GCS in flight, each of them runs in a thread
+MAX_UPLOADS = 8
+# a response body is kept in memory up to SPOOL_SIZE bytes, then spooled to a temporary file
+SPOOL_SIZE = 8 * 1024 * 1024
+TIMEOUT = httpx.Timeout(120, connect=10)
+
+
+def iter_file(file_obj: IO[bytes], chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    file_obj.seek(0)
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class AsyncFetchEngine:
+    """
+    Fetch many ranges of USGS events concurrently from a single thread:
+    fetch (httpx) -> NDJSON/Parquet (geojson_stream/parquet) -> upload to GCS, like web_to_gcs.
+    At most max_fetches requests to USGS and max_uploads uploads to GCS are in flight.
+    The requests share the token bucket of the USGS client of the process and are retried like it.
+    """
+
+    def __init__(self,
+                 max_fetches: int = MAX_FETCHES,
+                 max_uploads: int = MAX_UPLOADS,
+                 max_retries: int = MAX_RETRIES,
+                 transport: httpx.AsyncBaseTransport = None,
+                 logger: logging.Logger = None):
+        self.max_fetches = max_fetches
+        self.max_uploads = max_uploads
+        self.max_retries = max_retries
+        self.transport = transport
+        self.logger = logger or logging.getLogger(__name__)
+        self.bucket = get_client().bucket
+
+    async def download(self,
+                       client: httpx.AsyncClient,
+                       params: dict,
+                       fetch_semaphore: asyncio.Semaphore,
+                       metrics: ChunkMetrics) -> IO[bytes]:
+        """Download the GeoJSON of params to a spooled temporary file (the "fetch" stage of metrics)."""
+        async with fetch_semaphore:
+            with metrics.stage("fetch"):
+                return await self._download(client, params)
+
+    async def _download(self, client: httpx.AsyncClient, params: dict) -> IO[bytes]:
+        attempt = 0
+        while True:
+            await self.bucket.acquire_async()
+            try:
+                async with client.stream("GET", USGS_QUERY_URL, params=params) as response:
+                    if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                        retry_after = get_retry_after(response)
+                    else:
+                        response.raise_for_status()
+                        file_obj = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                        try:
+                            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                file_obj.write(chunk)
+                        except BaseException:
+                            file_obj.close()
+                            raise
+                        return file_obj
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+
+            if retry_after is not None:
+                self.bucket.pause(retry_after)
+            else:
+                await asyncio.sleep(get_backoff(attempt))
+            attempt += 1
+
+    async def fetch_to_gcs(self,
+                           client: httpx.AsyncClient,
+                           start_date,
+                           end_date,
+                           file_path: str,
+                           replace: bool,
+                           updated_after: datetime,
+                           fetch_semaphore: asyncio.Semaphore,
+                           upload_semaphore: asyncio.Semaphore) -> str:
+        if not replace and await asyncio.to_thread(if_file_exists.fn, file_path):
+            self.logger.info(f"file already exists, nothing to do: {file_path}")
+            return file_path
+
+        params = {"format": "geojson", **get_query_params(start_date, end_date, updated_after)}
+        metrics = get_chunk_metrics(file_path)
+        with record_failure([file_path], "upload"):
+            file_obj = await self.download(client, params, fetch_semaphore, metrics)
+            with file_obj:
+                metrics.add("fetch", "bytes", file_obj.tell())
+                async with upload_semaphore:
+                    features = iter_features(iter_file(file_obj))
+                    blob, count = await asyncio.to_thread(write_features_to_gcs, features, file_path, None, metrics)
+        await asyncio.to_thread(record_upload, blob, file_path, start_date, end_date, count)
+
+        self.logger.info(f"uploaded {count} features: {file_path}")
+        return file_path
+
+    async def run(self,
+                  chunks: list,
+                  replace: bool,
+                  split_time: bool,
+                  compress: bool = False,
+                  file_format: str = "ndjson",
+                  updated_after: datetime = None) -> list:
+        """
+        Fetch all chunks to GCS and return their file paths in the same order as chunks.
+        If some chunks failed, the other chunks are still fetched and
+        the error of the first failed chunk (in chunk order) is raised at the end.
+        """
+        fetch_semaphore = asyncio.Semaphore(self.max_fetches)
+        upload_semaphore = asyncio.Semaphore(self.max_uploads)
+        file_paths = [get_file_path(start, end, split_time, compress, file_format, updated_after)
+                      for start, end in chunks]
+
+        limits = httpx.Limits(max_connections=self.max_fetches, max_keepalive_connections=self.max_fetches)
+        async with httpx.AsyncClient(timeout=TIMEOUT, limits=limits, transport=self.transport,
+                                     headers={"User-Agent": "world-earthquake-pipeline"}) as client:
+            results = await asyncio.gather(
+                *[self.fetch_to_gcs(client, start, end, file_path, replace, updated_after,
+                                    fetch_semaphore, upload_semaphore)
+                  for (start, end), file_path in zip(chunks, file_paths)],
+                return_exceptions=True)
+
+        errors = []
+        for (start, end), result in zip(chunks, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"chunk failed: start={start}, end={end}: {result}")
+                errors.append(result)
+        if errors:
+            raise errors[0]
+
+        return file_paths
+
+
+def run_coroutine(coroutine):
+    """Run a coroutine to completion from sync code, even if an event loop is already running in this thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
+
+
+def fetch_chunks_async(chunks: list,
+                       replace: bool,
+                       split_time: bool,
+                       max_fetches: int = MAX_FETCHES,
+                       logger: logging.Logger = None,
+                       **options) -> list:
+    """Fetch all chunks to GCS with an AsyncFetchEngine, see AsyncFetchEngine.run for options."""
+    engine = AsyncFetchEngine(max_fetches=max_fetches, max_uploads=min(max_fetches, MAX_UPLOADS), logger=logger)
+    return run_coroutine(engine.run(chunks, replace, split_time, **options))
@@ -0,0 +1,108 @@
+import atexit
+import os
+import threading
+import gcsfs
+from prefect_gcp.cloud_storage import GcsBucket
+from prefect_gcp.bigquery import GcpCredentials, BigQueryWarehouse
+
+
+BASE_NAME = "world-earthquake-pipeline"
+PROJECT_ID = os.environ.get("WORLD_EARTHQUAKE_PROJECT_ID")
+ENV = os.environ.get("ENV")
+BLOCK_NAME = f"{BASE_NAME}-{ENV}"
+# where the USGS table (and the dbt models) live: "bigquery" or "duckdb" (a local database file, see duckdb_warehouse)
+WAREHOUSE = os.environ.get("WORLD_EARTHQUAKE_WAREHOUSE", "bigquery")
+WAREHOUSES = ("bigquery", "duckdb")
+# the database file of the duckdb warehouse, absolute because dbt runs it from the dbt directory
+DUCKDB_PATH = os.path.abspath(os.environ.get("WORLD_EARTHQUAKE_DUCKDB_PATH", "world_earthquake.duckdb"))
+
+# Blocks and clients of this process, keyed by (pid, name) so that a forked process builds its own
+# (the HTTP connections of the clients can't be shared between processes).
+_cache = {}
+# reentrant because a client is built from other cached objects (e.g. the credentials)
+_lock = threading.RLock()
+
+
+def _get(name: str, factory):
+    key = (os.getpid(), name)
+    with _lock:
+        if key not in _cache:
+            _cache[key] = factory()
+        return _cache[key]
+
+
+def get_gcp_credentials() -> GcpCredentials:
+    return _get("gcp_credentials", lambda: GcpCredentials.load(BLOCK_NAME))
+
+
+def get_gcs_bucket() -> GcsBucket:
+    return _get("gcs_bucket", lambda: GcsBucket.load(BLOCK_NAME))
+
+
+def get_bucket():
+    """Get the google.cloud.storage Bucket of the data lake (GcsBucket.get_bucket() builds a new client every time)."""
+    return _get("bucket", lambda: get_gcs_bucket().get_bucket())
+
+
+def get_duckdb_client():
+    # optional dependency, only needed by the duckdb warehouse
+    from flows.utils.duckdb_warehouse import DuckDBClient
+    return DuckDBClient(DUCKDB_PATH, get_gcsfs())
+
+
+def get_bigquery_client():
+    """
+    Get the client of the warehouse: a google.cloud.bigquery.Client,
+    or a DuckDBClient (the same interface) if WAREHOUSE is "duckdb".
+    """
+    if WAREHOUSE not in WAREHOUSES:
+        raise ValueError(f"unsupported warehouse: {WAREHOUSE}")
+    if WAREHOUSE == "duckdb":
+        return _get("bigquery_client", get_duckdb_client)
+    return _get("bigquery_client", lambda: get_gcp_credentials().get_bigquery_client())
+
+
+def get_gcsfs() -> gcsfs.GCSFileSystem:
+    return _get("gcsfs", lambda: gcsfs.GCSFileSystem(
+        project=PROJECT_ID, token=get_gcp_credentials().get_credentials_from_service_account()))
+
+
+def get_warehouse() -> BigQueryWarehouse:
+    """
+    Get the BigQueryWarehouse block, to execute statements.
+    Don't close it (e.g. with a with statement), it is closed by clear_clients().
+    """
+    return _get("warehouse", lambda: BigQueryWarehouse.load(BLOCK_NAME))
+
+
+def set_clients(**objects) -> None:
+    """
+    Use the given objects instead of the blocks and clients of this process, by name:
+    gcp_credentials, gcs_bucket, bucket, bigquery_client, gcsfs or warehouse
+    (e.g. local stand-ins for the offline benchmarks).
+    """
+    pid = os.getpid()
+    with _lock:
+        for name, obj in objects.items():
+            _cache[(pid, name)] = obj
+
+
+def clear_clients() -> None:
+    """Close and forget the blocks and clients of this process (they are built again when needed)."""
+    pid = os.getpid()
+    with _lock:
+        keys = [key for key in _cache if key[0] == pid]
+        objects = [_cache.pop(key) for key in keys]
+        # the objects of other processes were copied by a fork, don't close their connections
+        _cache.clear()
+
+    for obj in objects:
+        close = getattr(obj, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+
+atexit.register(clear_clients)
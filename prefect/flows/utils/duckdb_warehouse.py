@@ -0,0 +1,213 @@
+"""
+DuckDB warehouse backend: a local DuckDB database file in place of the BigQuery datasets.
+
+DuckDBClient implements what the pipeline uses of google.cloud.bigquery.Client (query, load_table_from_uri,
+load_table_from_file, get_table, create_table, delete_table) and of its jobs (result and some statistics),
+so that the loaders and the SCD2 merge of gcs_to_bq run unchanged: their SQL is translated to DuckDB by translate().
+The gs:// files of the data lake are read directly by DuckDB through an fsspec file system (e.g. gcsfs).
+
+`project.dataset.table` references are mapped to the "dataset"."table" tables of the DuckDB database,
+the same schemas as the dbt sources and models of the duckdb target.
+The statements are run one at a time (the DuckDB connection is shared by the threads of the pipeline)
+and a database file can be opened by one process at a time.
+FARM_FINGERPRINT is replaced by the hash function of DuckDB, the hash values differ from BigQuery
+but they are deterministic too, which is what the merge needs.
+"""
+import re
+import threading
+
+import duckdb
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+DUCKDB_TYPES = {
+    "STRING": "VARCHAR",
+    "FLOAT": "DOUBLE",
+    "FLOAT64": "DOUBLE",
+    "INTEGER": "BIGINT",
+    "INT64": "BIGINT",
+    "BOOL": "BOOLEAN",
+    "BOOLEAN": "BOOLEAN",
+    "TIMESTAMP": "TIMESTAMPTZ",
+}
+DML_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "MERGE")
+
+TABLE_REF_PATTERN = re.compile(r"`([^`]+)`")
+REPLACEMENTS = [
+    (re.compile(r"\bFARM_FINGERPRINT\("), "farm_fingerprint("),
+    (re.compile(r"\bCURRENT_TIMESTAMP\(\)"), "CURRENT_TIMESTAMP"),
+    (re.compile(r"\[SAFE_OFFSET\((\d+)\)\]"), lambda match: f"[{int(match.group(1)) + 1}]"),
+    (re.compile(r"\bSAFE_CAST\("), "TRY_CAST("),
+    (re.compile(r"\bCOUNTIF\("), "count_if("),
+    (re.compile(r"\bUNIX_MILLIS\("), "epoch_ms("),
+    (re.compile(r"^(\s*)MERGE\s+(?!INTO\b)"), r"\1MERGE INTO "),
+]
+
+
+def split_table_ref(table_ref: str) -> tuple:
+    """project.dataset.table (or dataset.table) to (dataset, table)."""
+    parts = str(table_ref).split(".")
+    if len(parts) < 2:
+        raise ValueError(f"invalid table reference: {table_ref}")
+    return parts[-2], parts[-1]
+
+
+def quote_table_ref(table_ref: str) -> str:
+    dataset, table = split_table_ref(table_ref)
+    return f'"{dataset}"."{table}"'
+
+
+def strip_options(sql: str) -> str:
+    """Remove the OPTIONS (...) clauses (table options have no DuckDB counterpart)."""
+    while True:
+        match = re.search(r"\bOPTIONS\s*\(", sql)
+        if not match:
+            return sql
+        depth = 0
+        for i in range(match.end() - 1, len(sql)):
+            if sql[i] == "(":
+                depth += 1
+            elif sql[i] == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+        sql = sql[:match.start()] + sql[i + 1:]
+
+
+def translate(sql: str) -> str:
+    """Translate a BigQuery statement of the pipeline to DuckDB."""
+    sql = TABLE_REF_PATTERN.sub(lambda match: quote_table_ref(match.group(1)), sql)
+    sql = strip_options(sql)
+    for pattern, replacement in REPLACEMENTS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def get_column_type(field: bigquery.SchemaField) -> str:
+    if field.field_type in ("RECORD", "STRUCT"):
+        column_type = f"STRUCT({', '.join(f'{f.name} {get_column_type(f)}' for f in field.fields)})"
+    else:
+        column_type = DUCKDB_TYPES[field.field_type]
+    return f"{column_type}[]" if field.mode == "REPEATED" else column_type
+
+
+def get_columns(schema: list) -> dict:
+    return {field.name: get_column_type(field) for field in schema}
+
+
+class DuckDBJob:
+    """A finished job with the statistics the pipeline reads (None for the statistics DuckDB doesn't have)."""
+
+    def __init__(self, rows: list = None, output_rows: int = None, num_dml_affected_rows: int = None):
+        self.rows = rows or []
+        self.output_rows = output_rows
+        self.num_dml_affected_rows = num_dml_affected_rows
+        self.total_bytes_processed = None
+        self.slot_millis = None
+
+    def result(self, **kwargs) -> list:
+        return self.rows
+
+
+class DuckDBClient:
+    def __init__(self, database: str = ":memory:", fs=None):
+        """fs: the fsspec file system of the gs:// URIs to load (e.g. gcsfs.GCSFileSystem)."""
+        self.connection = duckdb.connect(database)
+        self.connection.execute(
+            "CREATE OR REPLACE TEMP MACRO farm_fingerprint(value) AS CAST(hash(value) >> 1 AS BIGINT)")
+        if fs is not None:
+            self.connection.register_filesystem(fs)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, parameters=None):
+        # the dataset of a table is created with it
+        for match in TABLE_REF_PATTERN.finditer(sql):
+            dataset, _ = split_table_ref(match.group(1))
+            self.connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{dataset}"')
+        return self.connection.execute(translate(sql), parameters)
+
+    def query(self, query: str, **kwargs) -> DuckDBJob:
+        with self._lock:
+            cursor = self._execute(query)
+            if query.lstrip().upper().startswith(DML_STATEMENTS):
+                return DuckDBJob(num_dml_affected_rows=cursor.fetchone()[0])
+            if cursor.description is None:
+                return DuckDBJob()
+            names = [column[0] for column in cursor.description]
+            return DuckDBJob(rows=[dict(zip(names, row)) for row in cursor.fetchall()])
+
+    def _load(self, source_sql: str, table_ref: str, job_config: bigquery.LoadJobConfig) -> DuckDBJob:
+        """Load the rows of source_sql (with the columns of the schema of job_config) into table_ref."""
+        table = quote_table_ref(table_ref)
+        self.connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{split_table_ref(table_ref)[0]}"')
+        if job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+            self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        columns = ", ".join(f'"{name}" {column_type}' for name, column_type in get_columns(job_config.schema).items())
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        output_rows = self.connection.execute(f"INSERT INTO {table} BY NAME {source_sql}").fetchone()[0]
+        return DuckDBJob(output_rows=output_rows)
+
+    def load_table_from_uri(self, source_uris, destination: str, job_config: bigquery.LoadJobConfig = None,
+                            **kwargs) -> DuckDBJob:
+        uris = [source_uris] if isinstance(source_uris, str) else list(source_uris)
+
+        if job_config.source_format == bigquery.SourceFormat.PARQUET:
+            source_sql = f"SELECT * FROM read_parquet({uris!r})"
+        elif job_config.source_format == bigquery.SourceFormat.NEWLINE_DELIMITED_JSON:
+            # the keys which are not in the schema are ignored, like ignore_unknown_values
+            source_sql = (f"SELECT * FROM read_json({uris!r}, format = 'newline_delimited', "
+                          f"columns = {get_columns(job_config.schema)!r})")
+        else:
+            raise ValueError(f"unsupported source format: {job_config.source_format}")
+
+        with self._lock:
+            return self._load(source_sql, destination, job_config)
+
+    def load_table_from_file(self, file_obj, destination: str, job_config: bigquery.LoadJobConfig = None,
+                             **kwargs) -> DuckDBJob:
+        if job_config.source_format != bigquery.SourceFormat.PARQUET:
+            raise ValueError(f"unsupported source format: {job_config.source_format}")
+        arrow_table = pq.read_table(file_obj)
+        with self._lock:
+            self.connection.register("load_source", arrow_table)
+            try:
+                return self._load("SELECT * FROM load_source", destination, job_config)
+            finally:
+                self.connection.unregister("load_source")
+
+    def get_table(self, table_ref: str):
+        dataset, table = split_table_ref(table_ref)
+        with self._lock:
+            found = self.connection.execute(
+                "SELECT 1 FROM information_schema.tables WHERE table_schema = ? AND table_name = ?",
+                [dataset, table]).fetchone()
+        if not found:
+            raise NotFound(f"Not found: Table {table_ref}")
+        return bigquery.Table(table_ref)
+
+    def create_table(self, table: bigquery.Table, exists_ok: bool = False, **kwargs) -> bigquery.Table:
+        """Create the table with its schema (partitioning and clustering are ignored)."""
+        columns = ", ".join(
+            f'"{field.name}" {get_column_type(field)}{" NOT NULL" if field.mode == "REQUIRED" else ""}'
+            for field in table.schema)
+        with self._lock:
+            self.connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{table.dataset_id}"')
+            self.connection.execute(
+                f'CREATE TABLE {"IF NOT EXISTS " if exists_ok else ""}"{table.dataset_id}"."{table.table_id}" '
+                f"({columns})")
+        return table
+
+    def delete_table(self, table_ref: str, not_found_ok: bool = False, **kwargs) -> None:
+        try:
+            self.get_table(table_ref)
+        except NotFound:
+            if not_found_ok:
+                return
+            raise
+        with self._lock:
+            self.connection.execute(f"DROP TABLE {quote_table_ref(table_ref)}")
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
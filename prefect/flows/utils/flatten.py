@@ -0,0 +1,87 @@
+from typing import IO
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+
+from flows.utils.schema import get_arrow_schema
+
+
+BLOCK_SIZE = 16 * 1024 * 1024  # bytes of NDJSON parsed at a time
+COORDINATES = ["geometry_longitude", "geometry_latitude", "geometry_altitude"]
+
+
+def get_parse_schema() -> pa.Schema:
+    """
+    Get the nested arrow schema used to parse the GeoJSON features.
+    Only the numeric properties are declared: the string columns of get_schema() are inferred and cast afterwards
+    because some of them are numbers in GeoJSON (e.g. properties_tz), which the JSON reader can't convert to strings.
+    The integer columns are parsed as float64 (exact up to 2^53, e.g. epoch milliseconds) and cast afterwards
+    because the JSON reader can't parse a number like 12.0 as int64.
+    """
+    properties = [
+        pa.field(field.name[len("properties_"):], pa.float64())
+        for field in get_arrow_schema()
+        if field.name.startswith("properties_") and not pa.types.is_string(field.type)
+    ]
+
+    return pa.schema([
+        pa.field("properties", pa.struct(properties)),
+        pa.field("geometry", pa.struct([pa.field("coordinates", pa.list_(pa.float64()))])),
+    ])
+
+
+def read_features(file_obj: IO[bytes], block_size: int = BLOCK_SIZE) -> pa.Table:
+    """Parse NDJSON GeoJSON features in bulk into a nested arrow table (no Python objects per feature)."""
+    return pj.read_json(
+        file_obj,
+        read_options=pj.ReadOptions(block_size=block_size),
+        parse_options=pj.ParseOptions(explicit_schema=get_parse_schema(), unexpected_field_behavior="infer"))
+
+
+def get_list_element(lists: pa.ListArray, index: int) -> pa.Array:
+    """lists[i][index] for every list, null if the list is null or shorter."""
+    lengths = pc.list_value_length(lists)
+    positions = pc.add(lists.offsets[:-1], index)
+    positions = pc.if_else(pc.greater(lengths, index), positions, pa.scalar(None, positions.type))
+    return pc.take(lists.values, positions)
+
+
+def flatten_features(table: pa.Table) -> pa.Table:
+    """Flatten a table of read_features() to the columns and types of get_schema(), one array per column."""
+    table = table.combine_chunks()
+    columns = {}
+    for name in ("id", "type"):
+        if name in table.column_names:
+            columns[name] = table.column(name).chunk(0) if table.num_rows else None
+
+    if "properties" in table.column_names and table.num_rows:
+        properties = table.column("properties").chunk(0)
+        for field in properties.type:
+            columns[f"properties_{field.name}"] = pc.struct_field(properties, field.name)
+
+    if "geometry" in table.column_names and table.num_rows:
+        geometry = table.column("geometry").chunk(0)
+        if geometry.type.get_field_index("type") >= 0:
+            columns["geometry_type"] = pc.struct_field(geometry, "type")
+        coordinates = pc.struct_field(geometry, "coordinates")
+        for index, name in enumerate(COORDINATES):
+            columns[name] = get_list_element(coordinates, index)
+
+    schema = get_arrow_schema()
+    arrays = []
+    for field in schema:
+        array = columns.get(field.name)
+        if array is None:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+        else:
+            arrays.append(pc.cast(array, field.type))
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def read_ndjson_table(file_obj: IO[bytes], block_size: int = BLOCK_SIZE) -> pa.Table:
+    """Read an NDJSON file of GeoJSON features as a flat arrow table of get_schema(), empty if there is no feature."""
+    if not file_obj.read(1):
+        return get_arrow_schema().empty_table()
+    file_obj.seek(0)
+    return flatten_features(read_features(file_obj, block_size))
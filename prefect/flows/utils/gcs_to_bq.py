@@ -1,15 +1,21 @@
+import io
+import math
 import os
-import json
-import gcsfs
 import re
-import pandas as pd
-from datetime import datetime, timezone
+import threading
+import pyarrow.parquet as pq
+from datetime import date, datetime, timedelta, timezone
 from prefect import flow, task, get_run_logger
-from prefect_gcp.cloud_storage import GcsBucket
-from prefect_gcp.bigquery import GcpCredentials, BigQueryWarehouse
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 
+from flows.utils.clients import get_bigquery_client, get_gcs_bucket, get_gcsfs, WAREHOUSE
+from flows.utils.manifest import get_manifest, checkpoint, record_failure
+from flows.utils.metrics import get_chunk_metrics
+from flows.utils.schema import (get_schema, get_dataframe_schema, get_arrow_schema, get_raw_schema,  # noqa: F401
+                                get_schema_field_names, get_hash_columns, get_usgs_table_schema)
+from flows.utils.flatten import read_ndjson_table
+
 BASE_NAME = "world-earthquake-pipeline"
 PROJECT_ID = os.environ.get("WORLD_EARTHQUAKE_PROJECT_ID")
 ENV = os.environ.get("ENV")
@@ -17,87 +23,69 @@ BLOCK_NAME = f"{BASE_NAME}-{ENV}"
 RAW_DATASET = "earthquake_raw"
 USGS_TABLE = f"{PROJECT_ID}.{RAW_DATASET}.usgs_data"
 
+# USGS_TABLE is partitioned by properties_time (epoch milliseconds) in ranges of 30 days
+# (events before PARTITION_START are in the __UNPARTITIONED__ partition)
+# and clustered by CLUSTERING_FIELDS.
+PARTITION_START = -631152000000  # 1950-01-01
+PARTITION_END = 4102444800000  # 2100-01-01
+PARTITION_INTERVAL = 30 * 24 * 60 * 60 * 1000
+CLUSTERING_FIELDS = ["id", "is_valid"]
+# margin added to the time range of a merge, so that records whose time was slightly revised are still found
+# (the records revised further are found by get_moved_query)
+MERGE_TIME_MARGIN = 24 * 60 * 60 * 1000
+# the ids looked up out of the time range of a merge are listed in the query (constants prune the blocks of the
+# clustering by id, a subquery doesn't), up to this number
+MOVED_QUERY_MAX_IDS = 10000
+DAY_MILLIS = 24 * 60 * 60 * 1000
+# the texts stored for missing strings by the former pandas load path (astype(str) of NaN and None)
+MISSING_STRINGS = ("nan", "None")
+EPOCH_DATE = date(1970, 1, 1)
+
+
+def fetch_one(query):
+    """Run a query and return its first row (None if there is no row)."""
+    return next(iter(get_bigquery_client().query(query).result()), None)
+
 
 @task
 def get_last_datetime() -> datetime:
     """
     Get the latest datetime from the BigQuery table.
+    Only the latest partition is scanned if the table is partitioned (BigQuery only).
+    """
+    partition_query = f"""
+    SELECT MAX(SAFE_CAST(partition_id AS INT64)) AS partition_start
+    FROM `{PROJECT_ID}.{RAW_DATASET}.INFORMATION_SCHEMA.PARTITIONS`
+    WHERE table_name = '{USGS_TABLE.split(".")[-1]}'
+    AND total_rows > 0
     """
     query = f"SELECT MAX(properties_time) as last_datetime FROM `{USGS_TABLE}`"
 
-    with BigQueryWarehouse.load(BLOCK_NAME) as warehouse:
-        result = warehouse.fetch_one(query)
-        if result:
-            last_datetime = datetime.fromtimestamp(result['last_datetime'] / 1000, tz=timezone.utc)
-        else:
-            return None
+    result = fetch_one(partition_query) if WAREHOUSE == "bigquery" else None
+    if result and result['partition_start'] is not None:
+        query += f" WHERE properties_time >= {result['partition_start']}"
 
-    return last_datetime
-
-
-def get_schema() -> list:
-    return [
-        bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
-        bigquery.SchemaField("type", "STRING"),
-        bigquery.SchemaField("properties_mag", "FLOAT"),
-        bigquery.SchemaField("properties_place", "STRING"),
-        bigquery.SchemaField("properties_time", "INTEGER"),
-        bigquery.SchemaField("properties_updated", "INTEGER"),
-        bigquery.SchemaField("properties_tz", "STRING"),
-        bigquery.SchemaField("properties_url", "STRING"),
-        bigquery.SchemaField("properties_detail", "STRING"),
-        bigquery.SchemaField("properties_felt", "INTEGER"),
-        bigquery.SchemaField("properties_cdi", "FLOAT"),
-        bigquery.SchemaField("properties_mmi", "FLOAT"),
-        bigquery.SchemaField("properties_alert", "STRING"),
-        bigquery.SchemaField("properties_status", "STRING"),
-        bigquery.SchemaField("properties_tsunami", "INTEGER"),
-        bigquery.SchemaField("properties_sig", "INTEGER"),
-        bigquery.SchemaField("properties_net", "STRING"),
-        bigquery.SchemaField("properties_code", "STRING"),
-        bigquery.SchemaField("properties_ids", "STRING"),
-        bigquery.SchemaField("properties_sources", "STRING"),
-        bigquery.SchemaField("properties_types", "STRING"),
-        bigquery.SchemaField("properties_nst", "INTEGER"),
-        bigquery.SchemaField("properties_dmin", "FLOAT"),
-        bigquery.SchemaField("properties_rms", "FLOAT"),
-        bigquery.SchemaField("properties_gap", "FLOAT"),
-        bigquery.SchemaField("properties_magType", "STRING"),
-        bigquery.SchemaField("properties_type", "STRING"),
-        bigquery.SchemaField("properties_title", "STRING"),
-        bigquery.SchemaField("geometry_type", "STRING"),
-        bigquery.SchemaField("geometry_longitude", "FLOAT"),
-        bigquery.SchemaField("geometry_latitude", "FLOAT"),
-        bigquery.SchemaField("geometry_altitude", "FLOAT")
-    ]
-
-
-def get_dataframe_schema():
-    bq_schema = get_schema()
-    schema = {}
-
-    for field in bq_schema:
-        field_type = field.field_type
-        field_name = field.name
-
-        dtype = None
-        if field_type == "STRING":
-            dtype = "str"
-        elif field_type == "FLOAT":
-            dtype = "float"
-        elif field_type == "INTEGER":
-            dtype = "Int64"
-        else:
-            dtype = "object"
+    result = fetch_one(query)
+    if result and result['last_datetime'] is not None:
+        last_datetime = datetime.fromtimestamp(result['last_datetime'] / 1000, tz=timezone.utc)
+    else:
+        return None
 
-        schema[field_name] = dtype
+    return last_datetime
 
-    return schema
 
+@task
+def get_last_updated() -> datetime:
+    """
+    Get the latest properties_updated from the BigQuery table,
+    i.e. the watermark of the revisions already loaded.
+    """
+    query = f"SELECT MAX(properties_updated) as last_updated FROM `{USGS_TABLE}`"
 
-def get_schema_field_names():
-    schema = get_schema()
-    return [field.name for field in schema]
+    result = fetch_one(query)
+    if result and result['last_updated'] is not None:
+        return datetime.fromtimestamp(result['last_updated'] / 1000, tz=timezone.utc)
+    return None
 
 
 def if_table_exists(client, table_ref):
@@ -108,6 +96,10 @@ def if_table_exists(client, table_ref):
         return False
 
 
+def get_file_format(file_path) -> str:
+    return "parquet" if file_path.endswith(".parquet") else "ndjson"
+
+
 def get_temp_table_ref(file_path) -> str:
     file_name = os.path.basename(file_path)
     pattern = r"\d{4}-\d{2}-\d{2}_\d{4}-\d{2}-\d{2}"
@@ -121,153 +113,607 @@ def get_temp_table_ref(file_path) -> str:
         raise ValueError("file name is invalid!")
 
 
+def get_batch_table_ref(file_paths) -> str:
+    """Get the temp table for a batch of files, named after the whole date range of the files."""
+    pattern = r"(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})"
+    matches = [re.search(pattern, os.path.basename(file_path)) for file_path in file_paths]
+
+    if matches and all(matches):
+        start_date = min(match.group(1) for match in matches)
+        end_date = max(match.group(2) for match in matches)
+        return f"{PROJECT_ID}.{RAW_DATASET}.usgs_temp_batch_{start_date}_{end_date}"
+    else:
+        raise ValueError("file name is invalid!")
+
+
+def load_parquet_to_temp_table(client, gcs_uri, table_ref, append=False, metrics=None) -> str:
+    """
+    Load Parquet files (a gs:// URI or a list of them) to the temp table with a BigQuery load job,
+    the data doesn't go through the worker.
+    The records are added to the temp table if append is True.
+    The jobs are added to the "load" and "hash" stages of metrics.
+    """
+    metrics = metrics or get_chunk_metrics(table_ref)
+    raw_ref = f"{table_ref}_raw"
+
+    job_config = bigquery.LoadJobConfig(
+        schema=get_schema(),
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    with metrics.stage("load"):
+        job = client.load_table_from_uri(gcs_uri, raw_ref, job_config=job_config)
+        job.result()
+    metrics.add_job("load", job)
+
+    if job.output_rows == 0:
+        delete_temp_table(raw_ref)
+        return None
+
+    with metrics.stage("hash"):
+        job = client.query(get_hash_query(f"`{raw_ref}`", table_ref, append))
+        job.result()
+    metrics.add_job("hash", job)
+    delete_temp_table(raw_ref)
+
+    return table_ref
+
+
+def get_hash_expr(columns) -> str:
+    farm_fingerprint_arg = ', '.join(
+        [f"IFNULL(CAST({field} AS STRING), '')" for field in columns])
+    return f"FARM_FINGERPRINT(CONCAT({farm_fingerprint_arg}))"
+
+
+def get_missing_strings_query(table_ref=USGS_TABLE) -> str:
+    """
+    Get the query to replace the texts MISSING_STRINGS, which the former pandas load path stored for missing
+    strings, by NULL in the string columns of table_ref, and to recompute the hash value of these records,
+    so that they don't get a new version when they are merged again (missing strings are loaded as NULL).
+    """
+    columns = [field.name for field in get_schema() if field.field_type == "STRING" and field.name != "id"]
+    missing = ", ".join(f"'{text}'" for text in MISSING_STRINGS)
+    normalized = {column: f"IF({column} IN ({missing}), NULL, {column})" for column in columns}
+    assignments = [f"{column} = {expression}" for column, expression in normalized.items()]
+    hash_expr = get_hash_expr([normalized.get(column, column) for column in get_hash_columns()])
+    return f"""
+    UPDATE `{table_ref}`
+    SET
+    {", ".join(assignments)},
+    hash_value = {hash_expr}
+    WHERE
+    {" OR ".join(f"{column} IN ({missing})" for column in columns)}
+    """
+
+
+def get_hash_query(source, table_ref, append=False) -> str:
+    """
+    Get the query to write the records of source (a table or a subquery with the columns of get_schema())
+    to the temp table with their hash value, so that the hash value is calculated only once per record.
+    """
+    select = f"""SELECT
+    *,
+    {get_hash_expr(get_hash_columns())} AS hash_value
+    FROM
+    {source}
+    """
+
+    if append:
+        return f"""
+    INSERT INTO `{table_ref}`
+    {select}"""
+
+    return f"""
+    CREATE OR REPLACE TABLE `{table_ref}`
+    OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY))
+    AS
+    {select}"""
+
+
+def get_flatten_query(raw_ref, table_ref, append=False) -> str:
+    """
+    Get the query to flatten the raw GeoJSON features in raw_ref into table_ref
+    with the columns of get_schema() and the hash value.
+    """
+    coordinates = ["geometry_longitude", "geometry_latitude", "geometry_altitude"]
+    columns = []
+    for field in get_schema_field_names():
+        if field in coordinates:
+            columns.append(f"geometry.coordinates[SAFE_OFFSET({coordinates.index(field)})] AS {field}")
+        elif field.startswith("properties_"):
+            columns.append(f"properties.{field[len('properties_'):]} AS {field}")
+        elif field.startswith("geometry_"):
+            columns.append(f"geometry.{field[len('geometry_'):]} AS {field}")
+        else:
+            columns.append(field)
+    columns_str = ",\n        ".join(columns)
+
+    source = f"""(
+        SELECT
+        {columns_str}
+        FROM
+        `{raw_ref}`
+    )"""
+
+    return get_hash_query(source, table_ref, append)
+
+
+def load_ndjson_to_temp_table(client, gcs_uri, table_ref, append=False, metrics=None) -> str:
+    """
+    Load NDJSON files (a gs:// URI or a list of them, optionally gzipped) to the temp table
+    with a BigQuery load job and flatten it in BigQuery, the data doesn't go through the worker.
+    The records are added to the temp table if append is True.
+    The jobs are added to the "load" and "hash" stages of metrics.
+    """
+    metrics = metrics or get_chunk_metrics(table_ref)
+    raw_ref = f"{table_ref}_raw"
+
+    job_config = bigquery.LoadJobConfig(
+        schema=get_raw_schema(),
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        ignore_unknown_values=True,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    with metrics.stage("load"):
+        job = client.load_table_from_uri(gcs_uri, raw_ref, job_config=job_config)
+        job.result()
+    metrics.add_job("load", job)
+
+    if job.output_rows == 0:
+        delete_temp_table(raw_ref)
+        return None
+
+    with metrics.stage("hash"):
+        job = client.query(get_flatten_query(raw_ref, table_ref, append))
+        job.result()
+    metrics.add_job("hash", job)
+    delete_temp_table(raw_ref)
+
+    return table_ref
+
+
 @task(retries=1, log_prints=True)
-def load_data_from_gcs_to_temp_table(file_path) -> str:
+def load_data_from_gcs_to_temp_table(file_path, load_mode="dataframe") -> str:
+    """
+    Load a file on GCS to a temp table.
+    load_mode:
+    - "dataframe": read and flatten the NDJSON file in this process (columnar, see flatten.py) and upload it
+    - "native": let BigQuery load the file from its gs:// URI and flatten it with SQL
+    Parquet files are always loaded natively.
+    """
     logger = get_run_logger()
     logger.info(f"load_data_from_gcs_to_temp_table: {file_path}")
 
-    gcp_credentials = GcpCredentials.load(BLOCK_NAME)
-    client = gcp_credentials.get_bigquery_client()
+    client = get_bigquery_client()
+    bucket_name = get_gcs_bucket().bucket
+    gsc_file_path = f"gs://{bucket_name}/{file_path}"
+    metrics = get_chunk_metrics(file_path)
+
+    if get_file_format(file_path) == "parquet":
+        return load_parquet_to_temp_table(client, gsc_file_path, get_temp_table_ref(file_path), metrics=metrics)
+    if load_mode == "native":
+        return load_ndjson_to_temp_table(client, gsc_file_path, get_temp_table_ref(file_path), metrics=metrics)
+    if load_mode != "dataframe":
+        raise ValueError(f"unsupported load mode: {load_mode}")
+
+    with metrics.stage("parse"), get_gcsfs().open(gsc_file_path, compression="infer") as file:
+        arrow_table = read_ndjson_table(file)
+        metrics.add("parse", "bytes", file.tell())
+    metrics.add("parse", "rows", arrow_table.num_rows)
+    if arrow_table.num_rows == 0:
+        return None
 
-    fs = gcsfs.GCSFileSystem(
-        project=PROJECT_ID, token=gcp_credentials.get_credentials_from_service_account())
+    # delete table if exists
+    table_ref = get_temp_table_ref(file_path)
+    raw_ref = f"{table_ref}_raw"
+    if if_table_exists(client, raw_ref):
+        delete_temp_table(raw_ref)
+
+    # upload the columns as they are (as a Parquet file), without converting them to a DataFrame
+    buffer = io.BytesIO()
+    pq.write_table(arrow_table, buffer)
+    buffer.seek(0)
+    job_config = bigquery.LoadJobConfig(schema=get_schema(), source_format=bigquery.SourceFormat.PARQUET)
+    with metrics.stage("load"):
+        job = client.load_table_from_file(buffer, raw_ref, job_config=job_config)
+        job.result()
+    metrics.add_job("load", job)
+
+    # add the hash values
+    with metrics.stage("hash"):
+        job = client.query(get_hash_query(f"`{raw_ref}`", table_ref))
+        job.result()
+    metrics.add_job("hash", job)
+    delete_temp_table(raw_ref)
 
-    gcs_block = GcsBucket.load(BLOCK_NAME)
-    bucket_name = gcs_block.bucket
-    gsc_file_path = f"gs://{bucket_name}/{file_path}"
+    return table_ref
 
-    with fs.open(gsc_file_path) as file:
-        data = [json.loads(line) for line in file]
-        if len(data) == 0:
-            return None
 
-        df = pd.json_normalize(data, sep="_")
+def get_usgs_table(table_ref=USGS_TABLE, schema=None) -> bigquery.Table:
+    """Get the definition of the (partitioned and clustered) USGS table."""
+    table = bigquery.Table(table_ref, schema=schema or get_usgs_table_schema())
+    table.range_partitioning = bigquery.RangePartitioning(
+        field="properties_time",
+        range_=bigquery.PartitionRange(start=PARTITION_START, end=PARTITION_END, interval=PARTITION_INTERVAL))
+    table.clustering_fields = CLUSTERING_FIELDS
+    return table
 
-        df[["geometry_longitude", "geometry_latitude", "geometry_altitude"]] = pd.DataFrame(
-            df["geometry_coordinates"].to_list())
-        df.drop(columns=["geometry_coordinates"], inplace=True)
-        df = df.reindex(columns=get_schema_field_names())
-        schema_data_types = get_dataframe_schema()
-        df = df.astype(schema_data_types)
 
-    # delete table if exists
-    table_ref = get_temp_table_ref(file_path)
-    if if_table_exists(client, table_ref):
-        delete_temp_table(table_ref)
+def get_merge_query(temp_ref, columns, time_range=None, table_ref=USGS_TABLE) -> str:
+    """
+    Get the query to merge the records in temp_ref into table_ref as a slowly changing dimension (type 2)
+    in a single MERGE statement:
+    - the valid record of an id is invalidated if the hash value of the new record is different
+    - the new record is inserted if there is no valid record with the same hash value
+    If temp_ref has several records of the same id (e.g. from several files), only the last updated one is used.
+    The hash values are not calculated here, temp_ref already has them (see get_hash_query).
+    With time_range (the min and max properties_time of temp_ref), only the partitions of table_ref
+    in the range (plus MERGE_TIME_MARGIN) are scanned.
+    """
+    t2_filter = ""
+    t3_filter = ""
+    if time_range:
+        start = time_range[0] - MERGE_TIME_MARGIN
+        end = time_range[1] + MERGE_TIME_MARGIN
+        t2_filter = f"AND t2.properties_time BETWEEN {start} AND {end}"
+        t3_filter = f"AND t3.properties_time BETWEEN {start} AND {end}"
 
-    schema = get_schema()
-    table = bigquery.Table(table_ref, schema=schema)
-    table.temporary = True
+    columns_str = ", ".join(columns)
+    t1_columns_str = ", ".join([f"t1.{column}" for column in columns])
+
+    return f"""
+    MERGE `{table_ref}` AS t2
+    USING (
+        WITH source AS (
+            SELECT
+            *
+            FROM
+            `{temp_ref}`
+            WHERE
+            TRUE
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY properties_updated DESC) = 1
+        )
+        -- records to invalidate current data (or to insert if the id is new)
+        SELECT id AS merge_key, * FROM source
+        UNION ALL
+        -- records to insert as the new valid data of updated ids
+        SELECT NULL AS merge_key, source.*
+        FROM source
+        JOIN `{table_ref}` AS t3
+        ON t3.id = source.id
+        AND t3.is_valid = TRUE
+        AND t3.hash_value != source.hash_value
+        {t3_filter}
+    ) AS t1
+    ON t2.id = t1.merge_key
+    AND t2.is_valid = TRUE
+    {t2_filter}
 
-    job_config = bigquery.LoadJobConfig(schema=schema)
-    job = client.load_table_from_dataframe(df, table, job_config=job_config)
-    job.result()
+    -- invalidate current data if there are some updates
+    WHEN MATCHED AND t2.hash_value != t1.hash_value THEN
+    UPDATE SET
+    is_valid = FALSE,
+    valid_to = CURRENT_TIMESTAMP()
+
+    -- add new data or update data from t1
+    WHEN NOT MATCHED THEN
+    INSERT (id, {columns_str}, is_valid, valid_from, valid_to, hash_value)
+    VALUES (t1.id, {t1_columns_str}, TRUE, CURRENT_TIMESTAMP(), NULL, t1.hash_value)
+    """
+
+
+def get_unmatched_ids_query(temp_ref, time_range, table_ref=USGS_TABLE) -> str:
+    """
+    Get the query of the ids of temp_ref without a valid record of table_ref in the time range scanned by the merge
+    (see get_merge_query): new events, or events whose time was revised by more than MERGE_TIME_MARGIN.
+    Only the partitions of the time range of table_ref are scanned.
+    """
+    start = time_range[0] - MERGE_TIME_MARGIN
+    end = time_range[1] + MERGE_TIME_MARGIN
+    return f"""
+    SELECT DISTINCT
+    t1.id
+    FROM `{temp_ref}` AS t1
+    LEFT JOIN (
+        SELECT id
+        FROM `{table_ref}`
+        WHERE
+        is_valid = TRUE
+        AND properties_time BETWEEN {start} AND {end}
+    ) AS t2
+    ON t2.id = t1.id
+    WHERE
+    t2.id IS NULL
+    """
+
+
+def get_moved_query(temp_ref, time_range, ids=None, table_ref=USGS_TABLE) -> str:
+    """
+    Get the query of the days (days since the epoch, NULL if no time) of the valid records of table_ref
+    with the ids of temp_ref which are out of the time range scanned by the merge (see get_merge_query):
+    events whose time was revised by more than MERGE_TIME_MARGIN, which the pruned merge wouldn't match.
+    Only the id, is_valid and properties_time columns of table_ref are scanned, in every partition.
+    With ids (e.g. the ids of get_unmatched_ids_query, at most MOVED_QUERY_MAX_IDS), only these ids are looked up,
+    and only the blocks of the clustering by id which may have them are read.
+    """
+    start = time_range[0] - MERGE_TIME_MARGIN
+    end = time_range[1] + MERGE_TIME_MARGIN
+    if ids is None:
+        ids_filter = f"t2.id IN (SELECT id FROM `{temp_ref}`)"
+    else:
+        ids_filter = "t2.id IN ({})".format(", ".join(f"'{id_}'" for id_ in ids))
+    return f"""
+    SELECT DISTINCT
+    CAST(FLOOR(t2.properties_time / {DAY_MILLIS}) AS INT64) AS day
+    FROM `{table_ref}` AS t2
+    WHERE
+    t2.is_valid = TRUE
+    AND {ids_filter}
+    AND (t2.properties_time IS NULL OR t2.properties_time NOT BETWEEN {start} AND {end})
+    """
 
-    return table_ref
+
+def is_plain_id(id_) -> bool:
+    """Whether id_ can be written in a query as is (the USGS ids are letters and digits)."""
+    return re.fullmatch(r"[\w.-]+", id_) is not None
+
+
+@task(retries=1, log_prints=True)
+def load_files_from_gcs_to_temp_table(file_paths) -> str:
+    """
+    Load many files on GCS to one temp table natively,
+    with one load job per file format (a load job can take up to 10000 URIs).
+    """
+    logger = get_run_logger()
+    logger.info(f"load_files_from_gcs_to_temp_table: {len(file_paths)} files")
+
+    client = get_bigquery_client()
+    bucket_name = get_gcs_bucket().bucket
+    table_ref = get_batch_table_ref(file_paths)
+    delete_temp_table(table_ref)
+
+    ndjson_uris = [f"gs://{bucket_name}/{path}" for path in file_paths if get_file_format(path) == "ndjson"]
+    parquet_uris = [f"gs://{bucket_name}/{path}" for path in file_paths if get_file_format(path) == "parquet"]
+
+    loaded = False
+    if ndjson_uris:
+        loaded = load_ndjson_to_temp_table(client, ndjson_uris, table_ref) is not None
+    if parquet_uris:
+        loaded = load_parquet_to_temp_table(client, parquet_uris, table_ref, append=loaded) is not None or loaded
+
+    return table_ref if loaded else None
+
+
+def get_months(days, margin=MERGE_TIME_MARGIN) -> list:
+    """The months ("YYYY-MM") of the days (days since the epoch), each day extended by margin (milliseconds)."""
+    margin_days = math.ceil(margin / DAY_MILLIS)
+    months = set()
+    for day in days:
+        start = EPOCH_DATE + timedelta(days=day - margin_days)
+        end = EPOCH_DATE + timedelta(days=day + margin_days)
+        months.update(month_range(f"{start:%Y-%m}", f"{end:%Y-%m}"))
+    return sorted(months)
+
+
+def month_range(start_month: str, end_month: str) -> list:
+    """The months from start_month to end_month ("YYYY-MM", both included)."""
+    months = []
+    year, month = int(start_month[:4]), int(start_month[5:7])
+    while f"{year:04d}-{month:02d}" <= end_month:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
 
 
 @task(retries=1, log_prints=True)
-def update_bigquery_table(temp_ref):
+def update_bigquery_table(temp_ref, metrics_key=None):
+    """
+    Merge temp_ref into the USGS table and delete it.
+    The time and the job statistics are added to the "merge" stage of the metrics of metrics_key (temp_ref by default).
+    Returns the months ("YYYY-MM") of properties_time the merge may have changed (the months of the records
+    of temp_ref plus MERGE_TIME_MARGIN, and the months of their former records if their time moved out of it),
+    or None if some records have no time (any month may have changed).
+    The merge only scans the partitions of the time range of temp_ref (plus MERGE_TIME_MARGIN), unless some ids
+    of temp_ref have a valid record out of it (see get_moved_query): then it scans the whole table.
+    Looking these records up reads the id, is_valid and properties_time columns of the partitions of the time range
+    (get_unmatched_ids_query), and for the ids not found there (new events and moved ones), the blocks of every
+    partition which may have them (one block per small partition at least).
+    """
     logger = get_run_logger()
     logger.info("update_bigquery_table")
+    metrics = get_chunk_metrics(metrics_key or temp_ref)
 
-    gcp_credentials = GcpCredentials.load(BLOCK_NAME)
-    client = gcp_credentials.get_bigquery_client()
+    client = get_bigquery_client()
 
     # create table if not exists
     if not if_table_exists(client, USGS_TABLE):
         logger = get_run_logger()
         logger.info(f"create table: {USGS_TABLE}")
 
-        schema = get_schema()
-        schema.extend([
-            bigquery.SchemaField("is_valid", "BOOL", mode="REQUIRED",
-                                 description="Indicates whether the record is currently valid."),
-            bigquery.SchemaField("valid_from", "TIMESTAMP", mode="REQUIRED",
-                                 description="Timestamp when the record became valid."),
-            bigquery.SchemaField("valid_to", "TIMESTAMP",
-                                 description="Timestamp when the record became invalid. NULL if the record is valid."),
-            bigquery.SchemaField("hash_value", "INT64", mode="REQUIRED",
-                                 description="Hash value of the record calculated using FARM_FINGERPRINT.")
-        ])
-
-        table = bigquery.Table(USGS_TABLE, schema=schema)
-        client.create_table(table, exists_ok=True)
-
-    # update table
-    tmp_schema = client.get_table(temp_ref).schema
-    schema = client.get_table(USGS_TABLE).schema
-
-    tmp_columns = [f.name for f in tmp_schema if f.name != "id"]
-    columns = [f.name for f in schema if f.name not in [
-        "id", "is_valid", "valid_from", "valid_to", "hash_value"]]
-
-    tmp_columns_str = ", ".join(tmp_columns)
-    columns_str = ", ".join(columns)
+        client.create_table(get_usgs_table(), exists_ok=True)
 
-    farm_fingerprint_arg = ', '.join(
-        [f"IFNULL(CAST({field} AS STRING), '')" for field in columns])
-    farm_fingerprint_expr = f"FARM_FINGERPRINT(CONCAT({farm_fingerprint_arg}))"
-
-    query = f"""
-
-    -- invalidate current data if there are some updates
-    UPDATE `{USGS_TABLE}` AS t2
-    SET
-    is_valid = FALSE,
-    valid_to = CURRENT_TIMESTAMP()
-    WHERE
-    is_valid = TRUE
-    AND EXISTS (
-        SELECT 1
-        FROM `{temp_ref}` AS t1
-        WHERE t1.id = t2.id
-        AND NOT {farm_fingerprint_expr} = t2.hash_value
-    );
+    # update table (all columns of the loader except id, the same columns as the hash value)
+    columns = get_hash_columns()
 
-    -- add new data or update data from t1
-    INSERT INTO `{USGS_TABLE}` (id, {columns_str}, is_valid, valid_from, valid_to, hash_value)
+    # restrict the merge to the partitions of the new data (records without time may be in any partition)
+    time_range_query = f"""
     SELECT
-    id,
-    {tmp_columns_str},
-    TRUE AS is_valid,
-    CURRENT_TIMESTAMP() AS valid_from,
-    NULL AS valid_to,
-    {farm_fingerprint_expr} AS hash_value
-    FROM
-    `{temp_ref}` AS t1
-    WHERE
-    NOT EXISTS (
-        SELECT 1
-        FROM `{USGS_TABLE}` AS t2
-        WHERE t2.id = t1.id
-        AND t2.is_valid = TRUE
-        AND {farm_fingerprint_expr} = t2.hash_value
-    );
+    MIN(properties_time) AS min_time,
+    MAX(properties_time) AS max_time,
+    COUNTIF(properties_time IS NULL) AS null_count
+    FROM `{temp_ref}`
     """
+    # the days of the new data, to know which months the merge changes (the months of the dbt partitions)
+    days_query = f"""
+    SELECT DISTINCT
+    CAST(FLOOR(properties_time / {DAY_MILLIS}) AS INT64) AS day
+    FROM `{temp_ref}`
+    """
+    with metrics.stage("merge"):
+        job = client.query(time_range_query)
+        time_range = next(iter(job.result()))
+        metrics.add("merge", "bq_bytes_processed", job.total_bytes_processed)
+        metrics.add("merge", "bq_slot_ms", job.slot_millis)
+        if time_range["min_time"] is not None and time_range["null_count"] == 0:
+            query = get_merge_query(temp_ref, columns, (time_range["min_time"], time_range["max_time"]))
+            job = client.query(days_query)
+            months = get_months(row["day"] for row in job.result())
+            metrics.add("merge", "bq_bytes_processed", job.total_bytes_processed)
+            metrics.add("merge", "bq_slot_ms", job.slot_millis)
+
+            # the valid records out of the range would not be matched (and a second valid record inserted):
+            # look them up for the ids without a valid record in the range only
+            job = client.query(get_unmatched_ids_query(temp_ref, (time_range["min_time"], time_range["max_time"])))
+            ids = sorted(row["id"] for row in job.result())
+            metrics.add("merge", "bq_bytes_processed", job.total_bytes_processed)
+            metrics.add("merge", "bq_slot_ms", job.slot_millis)
+            moved_days = []
+            if ids:
+                if len(ids) > MOVED_QUERY_MAX_IDS or not all(is_plain_id(id_) for id_ in ids):
+                    ids = None
+                job = client.query(get_moved_query(temp_ref, (time_range["min_time"], time_range["max_time"]), ids))
+                moved_days = [row["day"] for row in job.result()]
+                metrics.add("merge", "bq_bytes_processed", job.total_bytes_processed)
+                metrics.add("merge", "bq_slot_ms", job.slot_millis)
+            if moved_days:
+                logger.info(f"records out of the time range of the merge on {len(moved_days)} days, "
+                            f"merge without partition pruning")
+                query = get_merge_query(temp_ref, columns)
+                # the months of the former records change too
+                months = None if None in moved_days else sorted(set(months) | set(get_months(moved_days)))
+        else:
+            query = get_merge_query(temp_ref, columns)
+            months = [] if time_range["min_time"] is None and time_range["null_count"] == 0 else None
 
-    with BigQueryWarehouse.load(BLOCK_NAME) as warehouse:
-        warehouse.execute(query)
+        # run the merge as a query job (not through the warehouse block) to get its statistics
+        job = client.query(query)
+        job.result()
+    metrics.add_job("merge", job)
 
     delete_temp_table(temp_ref)
+    return months
 
 
 def delete_temp_table(table_ref):
     logger = get_run_logger()
     logger.info(f"delete_temp_table: {table_ref}")
 
-    gcp_credentials = GcpCredentials.load(BLOCK_NAME)
-    client = gcp_credentials.get_bigquery_client()
-    client.delete_table(table_ref, not_found_ok=True)
+    get_bigquery_client().delete_table(table_ref, not_found_ok=True)
+
+
+def record_status(file_paths, status, **fields) -> None:
+    """Record the status of files in the manifest (if used), see manifest.FILE_STATUSES."""
+    manifest = get_manifest()
+    if manifest:
+        for file_path in file_paths:
+            manifest.set_status(file_path, status, **fields)
+        checkpoint()
+
+
+# months changed by the merges of this process by file path (see get_merged_months)
+_merged_months = {}
+_merged_months_lock = threading.Lock()
+
+
+def record_merged(file_paths, months) -> None:
+    """Record that the files were merged and changed months (None if unknown), in the manifest and in this process."""
+    with _merged_months_lock:
+        for file_path in file_paths:
+            _merged_months[file_path] = months
+    record_status(file_paths, "merged", months=months)
+
+
+def get_merged_months(file_paths):
+    """
+    Get the months ("YYYY-MM") changed by the merges of file_paths in this process, e.g. to build the dbt models
+    after an ingest (the files which weren't merged by this process, e.g. already merged, changed nothing).
+    None if some of them are unknown (records without time).
+    """
+    months = set()
+    with _merged_months_lock:
+        for file_path in file_paths:
+            if file_path not in _merged_months:
+                continue
+            if _merged_months[file_path] is None:
+                return None
+            months.update(_merged_months[file_path])
+    return sorted(months)
+
+
+def get_loaded_temp_ref(file_paths):
+    """
+    Get the temp table the files were loaded to by a previous (failed) run, if it still exists,
+    so that it can be merged without loading the files again. None otherwise.
+    """
+    manifest = get_manifest()
+    if not manifest or not all(manifest.get_status(file_path) == "loaded" for file_path in file_paths):
+        return None
+    temp_refs = {manifest.get_file(file_path).get("temp_ref") for file_path in file_paths}
+    if len(temp_refs) != 1:
+        return None
+    temp_ref = temp_refs.pop()
+    # the temp tables expire after a day
+    return temp_ref if temp_ref and if_table_exists(get_bigquery_client(), temp_ref) else None
+
+
+def get_unmerged_files(file_paths) -> list:
+    """The files which are not merged into the BigQuery table yet (all of them if the manifest is not used)."""
+    manifest = get_manifest()
+    if not manifest:
+        return list(file_paths)
+    return [file_path for file_path in file_paths if not manifest.has_status(file_path, "merged")]
+
+
+@flow(name="world-earthquake-pipeline: gcs_to_bq_batch")
+def gcs_to_bq_batch(file_paths) -> None:
+    """
+    update data BigQuery table with many files in one merge
+    (the files already merged are skipped, the temp table of a previous run is merged again if it still exists)
+    """
+
+    logger = get_run_logger()
+    logger.info(f"gcs_to_bq_batch: {len(file_paths)} files")
+
+    file_paths = get_unmerged_files(file_paths)
+    if not file_paths:
+        logger.info("all files are already merged, nothing to do")
+        return
+
+    temp_ref = get_loaded_temp_ref(file_paths)
+    if temp_ref is None:
+        with record_failure(file_paths, "load"):
+            temp_ref = load_files_from_gcs_to_temp_table(file_paths)
+        if temp_ref:
+            record_status(file_paths, "loaded", temp_ref=temp_ref)
+    months = []
+    if temp_ref:
+        with record_failure(file_paths, "merge"):
+            months = update_bigquery_table(temp_ref)
+
+    record_merged(file_paths, months)
 
 
 @flow(name="world-earthquake-pipeline: gcs_to_bq")
-def gcs_to_bq(file_path) -> None:
-    """update data BigQuery table"""
+def gcs_to_bq(file_path, load_mode="dataframe") -> None:
+    """
+    update data BigQuery table
+    (nothing to do if the file is already merged, the temp table of a previous run is merged again if it still exists)
+    """
 
     logger = get_run_logger()
     logger.info(f"gcs_to_bq: {file_path}")
 
-    temp_ref = load_data_from_gcs_to_temp_table(file_path)
+    if not get_unmerged_files([file_path]):
+        logger.info(f"file already merged, nothing to do: {file_path}")
+        return
+
+    temp_ref = get_loaded_temp_ref([file_path])
+    if temp_ref is None:
+        with record_failure([file_path], "load"):
+            temp_ref = load_data_from_gcs_to_temp_table(file_path, load_mode)
+        if temp_ref:
+            record_status([file_path], "loaded", temp_ref=temp_ref)
+    months = []
     if temp_ref:
-        update_bigquery_table(temp_ref)
+        with record_failure([file_path], "merge"):
+            months = update_bigquery_table(temp_ref, file_path)
+
+    record_merged([file_path], months)
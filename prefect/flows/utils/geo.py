@@ -0,0 +1,80 @@
+"""
+Grid keys of the rollups, the same as the dbt macros (dbt/macros/geo.sql, keep them in sync) and the vars
+rollup_geohash_precision and rollup_mag_bin_size (dbt/dbt_project.yml), e.g. to look up the rollup rows of a
+location offline. The cells are geohash cells: (lat_index, lon_index) is the row and the column of the cell in a
+grid of 2^lat_bits x 2^lon_bits, the geohash interleaves their bits (longitude first) in base 32.
+"""
+import math
+from typing import Optional, Tuple
+
+GEOHASH_PRECISION = 3
+MAG_BIN_SIZE = 0.5
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def get_bits(precision: int = GEOHASH_PRECISION) -> Tuple[int, int]:
+    """(lat_bits, lon_bits) of a geohash of precision characters."""
+    bits = precision * 5
+    return bits // 2, (bits + 1) // 2
+
+
+def get_index(value: float, low: float, high: float, bits: int) -> int:
+    # the cell of value in [low, high] split in 2^bits, the values out of range in the first or last cell
+    index = int(math.floor((value - low) / (high - low) * 2 ** bits))
+    return min(max(index, 0), 2 ** bits - 1)
+
+
+def get_cell(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> Tuple[int, int]:
+    """(lat_index, lon_index) of the cell of a location."""
+    lat_bits, lon_bits = get_bits(precision)
+    return get_index(latitude, -90, 90, lat_bits), get_index(longitude, -180, 180, lon_bits)
+
+
+def encode_cell(lat_index: int, lon_index: int, precision: int = GEOHASH_PRECISION) -> str:
+    """The geohash of a cell."""
+    lat_bits, lon_bits = get_bits(precision)
+    value = 0
+    for n in range(precision * 5):
+        # the even bits are the bits of the longitude, the odd bits the bits of the latitude, most significant first
+        if n % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - n // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - n // 2)) & 1
+        value = value << 1 | bit
+    return "".join(BASE32[(value >> 5 * (precision - 1 - i)) & 31] for i in range(precision))
+
+
+def decode_cell(geohash: str) -> Tuple[int, int]:
+    """(lat_index, lon_index) of a geohash, its precision is its length."""
+    precision = len(geohash)
+    lat_bits, lon_bits = get_bits(precision)
+    lat_index = lon_index = 0
+    for n in range(precision * 5):
+        bit = (BASE32.index(geohash[n // 5].lower()) >> (4 - n % 5)) & 1
+        if n % 2 == 0:
+            lon_index = lon_index << 1 | bit
+        else:
+            lat_index = lat_index << 1 | bit
+    return lat_index, lon_index
+
+
+def geohash(latitude: Optional[float], longitude: Optional[float],
+            precision: int = GEOHASH_PRECISION) -> Optional[str]:
+    """The geohash of the cell of a location (the geohash column of mart_earthquake_cell_month), None without it."""
+    if latitude is None or longitude is None:
+        return None
+    return encode_cell(*get_cell(latitude, longitude, precision), precision)
+
+
+def get_cell_center(geohash: str) -> Tuple[float, float]:
+    """(latitude, longitude) of the center of a cell (cell_latitude, cell_longitude of the rollup)."""
+    lat_bits, lon_bits = get_bits(len(geohash))
+    lat_index, lon_index = decode_cell(geohash)
+    return -90 + (lat_index + 0.5) * 180 / 2 ** lat_bits, -180 + (lon_index + 0.5) * 360 / 2 ** lon_bits
+
+
+def mag_bin(mag: Optional[float], bin_size: float = MAG_BIN_SIZE) -> Optional[float]:
+    """The lower bound of the magnitude bin of mag, e.g. 4.5 for 4.7, None without it."""
+    if mag is None:
+        return None
+    return math.floor(mag / bin_size) * bin_size
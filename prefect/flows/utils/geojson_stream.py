@@ -0,0 +1,72 @@
+import codecs
+import gzip
+import json
+import re
+from typing import IO, Iterable, Iterator
+
+
+FEATURES_PATTERN = re.compile(r'"features"\s*:\s*\[')
+WHITESPACE_PATTERN = re.compile(r'[\s,]*')
+
+
+def iter_features(chunks: Iterable[bytes]) -> Iterator[dict]:
+    """
+    Parse the features of a GeoJSON FeatureCollection incrementally.
+    Only the current feature (and the unparsed rest of the current chunk) is kept in memory,
+    so the memory usage doesn't depend on the number of features.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    in_features = False
+    done = False
+
+    for chunk in chunks:
+        if done:
+            continue
+        buffer += text_decoder.decode(chunk)
+
+        if not in_features:
+            match = FEATURES_PATTERN.search(buffer)
+            if not match:
+                # keep the tail in case the key is split between chunks
+                buffer = buffer[-32:]
+                continue
+            in_features = True
+            buffer = buffer[match.end():]
+
+        pos = 0
+        while True:
+            pos = WHITESPACE_PATTERN.match(buffer, pos).end()
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                done = True
+                break
+            try:
+                feature, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # incomplete feature, wait for the next chunk
+                break
+            yield feature
+        buffer = buffer[pos:]
+
+    if not in_features:
+        raise ValueError("no features found in the GeoJSON response")
+    if not done:
+        raise ValueError("unexpected end of the GeoJSON response")
+
+
+def write_ndjson(features: Iterable[dict], file_obj: IO[bytes], compress: bool = False) -> int:
+    """Write the features to a binary file object as NDJSON (optionally gzipped) and return the count."""
+    count = 0
+    out = gzip.GzipFile(fileobj=file_obj, mode="wb") if compress else file_obj
+    try:
+        for feature in features:
+            out.write(json.dumps(feature).encode("utf-8") + b"\n")
+            count += 1
+    finally:
+        if compress:
+            # only flushes the gzip trailer, file_obj stays open
+            out.close()
+    return count
@@ -0,0 +1,247 @@
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from flows.utils.clients import get_gcsfs
+
+# e.g. gs://<bucket>/usgs/_manifest.jsonl or a local path, the manifest is not used if not set
+MANIFEST_PATH = os.environ.get("WORLD_EARTHQUAKE_MANIFEST_PATH")
+# counts of ranges which ended less than COUNT_TTL ago are not reused because USGS still adds events
+COUNT_TTL = timedelta(days=30)
+# statuses of a file, in order: uploaded to the data lake, loaded to its temp table, merged into the USGS table
+# (the events are fetched while they are uploaded, a file is uploaded completely or not at all)
+FILE_STATUSES = ("uploaded", "loaded", "merged")
+# the manifest is saved at most every CHECKPOINT_INTERVAL seconds during a flow run (see checkpoint)
+CHECKPOINT_INTERVAL = 30
+
+
+def now() -> str:
+    # microseconds: a run planned right after another one must not see its files as merged since its plan
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+class Manifest:
+    """
+    Ingestion manifest: what has already been counted, uploaded, loaded and merged.
+    It is kept in memory and saved as JSON lines with four kinds of records:
+    - {"kind": "count", "start_date", "end_date", "count", "checked_at"}: result of a USGS count request
+    - {"kind": "file", "file_path", "start_date", "end_date", "count", "checksum", "status", "temp_ref", "months",
+      "failed_stage", "error", "updated_at"}: a file of the data lake (a chunk), status is one of FILE_STATUSES,
+      temp_ref is its temp table once loaded, months are the months ("YYYY-MM") its merge changed
+      (None if unknown), failed_stage and error are set by its last failure
+    - {"kind": "plan", "key", "chunks", "planned_at", "completed_at"}: the chunks of a run, to resume it
+      until it completes (see get_plan)
+    - {"kind": "watermark", "name", "value"}: e.g. when the dbt models were last built (see get_changed_months)
+    The methods are thread-safe. Concurrent flow runs saving the same manifest overwrite each other (last one wins).
+    """
+
+    def __init__(self, path: str, records: list = None):
+        self.path = path
+        self._counts = {}
+        self._files = {}
+        self._plans = {}
+        self._watermarks = {}
+        self._lock = threading.Lock()
+        for record in records or []:
+            self._add(record)
+
+    def _add(self, record: dict) -> None:
+        if record.get("kind") == "count":
+            self._counts[(record["start_date"], record["end_date"])] = record
+        elif record.get("kind") == "file":
+            self._files[record["file_path"]] = record
+        elif record.get("kind") == "plan":
+            self._plans[record["key"]] = record
+        elif record.get("kind") == "watermark":
+            self._watermarks[record["name"]] = record
+
+    def records(self) -> list:
+        with self._lock:
+            return (list(self._counts.values()) + list(self._files.values()) + list(self._plans.values())
+                    + list(self._watermarks.values()))
+
+    def get_count(self, start_date: date, end_date: date, today: date = None) -> Optional[int]:
+        """Get the recorded count of [start_date, end_date) if the range is old enough to be final."""
+        today = today or datetime.now(timezone.utc).date()
+        if end_date > today - COUNT_TTL:
+            return None
+        with self._lock:
+            record = self._counts.get((str(start_date), str(end_date)))
+        return record["count"] if record else None
+
+    def set_count(self, start_date: date, end_date: date, count: int) -> None:
+        self._add_record({"kind": "count", "start_date": str(start_date), "end_date": str(end_date),
+                          "count": count, "checked_at": now()})
+
+    def get_file(self, file_path: str) -> Optional[dict]:
+        with self._lock:
+            record = self._files.get(file_path)
+        return dict(record) if record else None
+
+    def update_file(self, file_path: str, **fields) -> None:
+        with self._lock:
+            record = dict(self._files.get(file_path) or {"kind": "file", "file_path": file_path})
+        record.update({key: str(value) if isinstance(value, date) else value for key, value in fields.items()})
+        record["updated_at"] = now()
+        self._add_record(record)
+
+    def get_status(self, file_path: str) -> Optional[str]:
+        record = self.get_file(file_path)
+        if not record:
+            return None
+        if record.get("status") == "loaded" and "temp_ref" not in record:
+            # written before the files were recorded as merged, "loaded" meant merged
+            return "merged"
+        return record.get("status")
+
+    def has_status(self, file_path: str, status: str, since: str = None) -> bool:
+        """
+        Whether the file reached status (or a later one of FILE_STATUSES),
+        and was last updated at or after since (an updated_at) if given.
+        """
+        file_status = self.get_status(file_path)
+        if file_status not in FILE_STATUSES or FILE_STATUSES.index(file_status) < FILE_STATUSES.index(status):
+            return False
+        return since is None or self.get_file(file_path)["updated_at"] >= since
+
+    def set_status(self, file_path: str, status: str, **fields) -> None:
+        """Record that the file reached status, which clears its last failure."""
+        if status not in FILE_STATUSES:
+            raise ValueError(f"unknown file status: {status}")
+        self.update_file(file_path, status=status, failed_stage=None, error=None, **fields)
+
+    def set_failed(self, file_path: str, stage: str, error: Exception) -> None:
+        """Record a failure of the file at stage (e.g. "upload", "load", "merge"), its status doesn't change."""
+        self.update_file(file_path, failed_stage=stage, error=f"{type(error).__name__}: {error}"[:1000])
+
+    def get_failed_files(self) -> list:
+        with self._lock:
+            return [file_path for file_path, record in self._files.items() if record.get("failed_stage")]
+
+    def get_plan(self, key: str) -> Optional[Tuple[List[Tuple[date, date]], str]]:
+        """
+        Get the chunks planned for key and when they were planned,
+        None if there is no plan for key or its run completed (a new run plans again).
+        """
+        with self._lock:
+            record = self._plans.get(key)
+        if not record or record.get("completed_at"):
+            return None
+        chunks = [(date.fromisoformat(start), date.fromisoformat(end)) for start, end in record["chunks"]]
+        return chunks, record["planned_at"]
+
+    def set_plan(self, key: str, chunks: list) -> str:
+        """Record the chunks planned for key, returns when they were planned."""
+        record = {"kind": "plan", "key": key, "chunks": [[str(start), str(end)] for start, end in chunks],
+                  "planned_at": now()}
+        self._add_record(record)
+        return record["planned_at"]
+
+    def complete_plan(self, key: str) -> None:
+        """Record that the run of the plan of key completed, so that it isn't resumed."""
+        with self._lock:
+            record = self._plans.get(key)
+        if record:
+            self._add_record({**record, "completed_at": now()})
+
+    def get_watermark(self, name: str) -> Optional[str]:
+        with self._lock:
+            record = self._watermarks.get(name)
+        return record["value"] if record else None
+
+    def set_watermark(self, name: str, value: str) -> None:
+        self._add_record({"kind": "watermark", "name": name, "value": value})
+
+    def get_changed_months(self, since: str) -> Optional[List[str]]:
+        """
+        The months ("YYYY-MM") changed by the files merged at or after since (an updated_at),
+        None if it isn't known (no since, or a file merged without its months).
+        """
+        if since is None:
+            return None
+        with self._lock:
+            records = [record for record in self._files.values()
+                       if record.get("status") == "merged" and record["updated_at"] >= since]
+        months = set()
+        for record in records:
+            if record.get("months") is None:
+                return None
+            months.update(record["months"])
+        return sorted(months)
+
+    def _add_record(self, record: dict) -> None:
+        with self._lock:
+            self._add(record)
+
+    def dumps(self) -> str:
+        return "".join(json.dumps(record) + "\n" for record in self.records())
+
+    @classmethod
+    def loads(cls, path: str, text: str) -> "Manifest":
+        return cls(path, [json.loads(line) for line in text.splitlines() if line.strip()])
+
+
+def open_path(path: str, mode: str = "r"):
+    if path.startswith("gs://"):
+        return get_gcsfs().open(path, mode)
+    return open(path, mode)
+
+
+def load_manifest(path: str) -> Manifest:
+    try:
+        with open_path(path, "r") as file:
+            return Manifest.loads(path, file.read())
+    except FileNotFoundError:
+        return Manifest(path)
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+_saved_at = 0.0
+
+
+def get_manifest() -> Optional[Manifest]:
+    """Get the manifest of this process (loaded once), None if MANIFEST_PATH is not set."""
+    global _manifest
+    if not MANIFEST_PATH:
+        return None
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = load_manifest(MANIFEST_PATH)
+        return _manifest
+
+
+def save_manifest() -> None:
+    global _saved_at
+    with _manifest_lock:
+        if _manifest is not None:
+            with open_path(_manifest.path, "w") as file:
+                file.write(_manifest.dumps())
+            _saved_at = time.monotonic()
+
+
+def checkpoint(force: bool = False) -> None:
+    """
+    Save the manifest if it was last saved more than CHECKPOINT_INTERVAL seconds ago (or if force),
+    so that a run which dies before its end can be resumed from what it recorded.
+    """
+    if force or time.monotonic() - _saved_at >= CHECKPOINT_INTERVAL:
+        save_manifest()
+
+
+@contextmanager
+def record_failure(file_paths: list, stage: str):
+    """Record the exception raised in the block as a failure of file_paths at stage (if the manifest is used)."""
+    try:
+        yield
+    except Exception as e:
+        manifest = get_manifest()
+        if manifest:
+            for file_path in file_paths:
+                manifest.set_failed(file_path, stage, e)
+            checkpoint()
+        raise
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from prefect.artifacts import create_table_artifact
+
+
+# optional: file the metrics are written to at the end of a flow run,
+# JSON lines (appended) if it ends with .jsonl, OpenMetrics text (overwritten) otherwise
+METRICS_PATH = os.environ.get("WORLD_EARTHQUAKE_METRICS_PATH")
+METRIC_PREFIX = "world_earthquake_pipeline"
+ARTIFACT_KEY = "world-earthquake-pipeline-metrics"
+
+
+class ChunkMetrics:
+    """
+    Metrics of a chunk (a file of the data lake) by stage: fetch, serialize, upload, parse, load, hash, merge...
+    Every stage has measures: seconds, rows, bytes and, for BigQuery jobs, bq_bytes_processed and bq_slot_ms.
+    The measures are summed if they are added several times. The methods are thread-safe.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, measure: str, value) -> None:
+        if value is None:
+            return
+        with self._lock:
+            measures = self._stages.setdefault(stage, {})
+            measures[measure] = measures.get(measure, 0) + value
+
+    def get(self, stage: str, measure: str):
+        with self._lock:
+            return self._stages.get(stage, {}).get(measure, 0)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time the block as stage (even if it fails)."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(stage, "seconds", time.perf_counter() - start)
+
+    def add_job(self, stage: str, job) -> None:
+        """Add the statistics of a finished BigQuery job (load or query) to stage."""
+        self.add(stage, "bq_bytes_processed", getattr(job, "total_bytes_processed", None))
+        self.add(stage, "bq_slot_ms", getattr(job, "slot_millis", None))
+        # load jobs
+        self.add(stage, "rows", getattr(job, "output_rows", None))
+        self.add(stage, "bytes", getattr(job, "input_file_bytes", None))
+        # DML query jobs
+        self.add(stage, "rows", getattr(job, "num_dml_affected_rows", None))
+
+    def stages(self) -> dict:
+        with self._lock:
+            return {stage: dict(measures) for stage, measures in self._stages.items()}
+
+
+class TimedIterator:
+    """Iterate over chunks of bytes, adding the time spent waiting for them and their size to stage."""
+
+    def __init__(self, iterable, metrics: ChunkMetrics, stage: str):
+        self._iterator = iter(iterable)
+        self._metrics = metrics
+        self._stage = stage
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            chunk = next(self._iterator)
+        finally:
+            self._metrics.add(self._stage, "seconds", time.perf_counter() - start)
+        self._metrics.add(self._stage, "bytes", len(chunk))
+        return chunk
+
+
+class TimedWriter:
+    """Binary file object adding the time spent in write() and the bytes written to stage."""
+
+    def __init__(self, file_obj, metrics: ChunkMetrics, stage: str):
+        self._file_obj = file_obj
+        self._metrics = metrics
+        self._stage = stage
+
+    def write(self, data) -> int:
+        start = time.perf_counter()
+        try:
+            return self._file_obj.write(data)
+        finally:
+            self._metrics.add(self._stage, "seconds", time.perf_counter() - start)
+            self._metrics.add(self._stage, "bytes", len(data))
+
+    def __getattr__(self, name):
+        return getattr(self._file_obj, name)
+
+
+class MetricsRegistry:
+    """Metrics of the chunks of this process, until they are emitted."""
+
+    def __init__(self):
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> ChunkMetrics:
+        with self._lock:
+            if key not in self._chunks:
+                self._chunks[key] = ChunkMetrics(key)
+            return self._chunks[key]
+
+    def records(self) -> list:
+        """One record per chunk and stage."""
+        with self._lock:
+            chunks = list(self._chunks.values())
+        return [
+            {"chunk": chunk.key, "stage": stage, **measures}
+            for chunk in chunks
+            for stage, measures in chunk.stages().items()
+        ]
+
+    def clear(self) -> list:
+        """Forget the metrics and return their records."""
+        records = self.records()
+        with self._lock:
+            self._chunks.clear()
+        return records
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def to_openmetrics(records: list) -> str:
+    """Format records as OpenMetrics text: one gauge family per measure, labelled by chunk and stage."""
+    families = {}
+    for record in records:
+        labels = f'chunk="{escape_label(record["chunk"])}",stage="{escape_label(record["stage"])}"'
+        for measure, value in record.items():
+            if measure in ("chunk", "stage", "recorded_at"):
+                continue
+            families.setdefault(measure, []).append(f"{METRIC_PREFIX}_{measure}{{{labels}}} {value}")
+
+    lines = []
+    for measure, samples in families.items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_{measure} gauge")
+        lines.extend(samples)
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(records: list, path: str) -> None:
+    if path.endswith(".jsonl"):
+        with open(path, "a") as file:
+            file.write("".join(json.dumps(record) + "\n" for record in records))
+    else:
+        with open(path, "w") as file:
+            file.write(to_openmetrics(records))
+
+
+_metrics = MetricsRegistry()
+
+
+def get_chunk_metrics(key: str) -> ChunkMetrics:
+    """Get the metrics of a chunk (e.g. a file path) for this process."""
+    return _metrics.get(key)
+
+
+def emit_metrics(logger=None) -> list:
+    """
+    Emit the metrics collected so far as a Prefect table artifact (of the flow run, ARTIFACT_KEY)
+    and to METRICS_PATH (if set), then forget them. Returns the records.
+    """
+    recorded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    records = [{**record, "recorded_at": recorded_at} for record in _metrics.clear()]
+    if not records:
+        return records
+
+    try:
+        create_table_artifact(key=ARTIFACT_KEY, table=records, description="Metrics of the chunks by stage")
+    except Exception as e:
+        # e.g. the API can't be reached
+        if logger:
+            logger.warning(f"failed to create the metrics artifact: {e}")
+    if METRICS_PATH:
+        write_metrics(records, METRICS_PATH)
+    if logger:
+        totals = {}
+        for record in records:
+            totals[record["stage"]] = totals.get(record["stage"], 0) + record.get("seconds", 0)
+        logger.info("seconds by stage: " + ", ".join(f"{stage}={seconds:.1f}" for stage, seconds in totals.items()))
+
+    return records
@@ -0,0 +1,73 @@
+from typing import IO, Iterable
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from flows.utils.schema import get_arrow_schema
+
+
+BATCH_SIZE = 5000  # rows per row group
+
+
+def flatten_feature(feature: dict) -> dict:
+    """Flatten a GeoJSON feature to the columns of get_schema()."""
+    properties = feature.get("properties") or {}
+    geometry = feature.get("geometry") or {}
+    coordinates = list(geometry.get("coordinates") or []) + [None] * 3
+
+    row = {
+        "id": feature.get("id"),
+        "type": feature.get("type"),
+        "geometry_type": geometry.get("type"),
+        "geometry_longitude": coordinates[0],
+        "geometry_latitude": coordinates[1],
+        "geometry_altitude": coordinates[2],
+    }
+    for key, value in properties.items():
+        row[f"properties_{key}"] = value
+
+    return row
+
+
+def coerce_value(value, arrow_type: pa.DataType):
+    """Coerce a JSON value to the Python type of the arrow column (e.g. properties_tz is a number in GeoJSON)."""
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return value if isinstance(value, str) else str(value)
+    if pa.types.is_integer(arrow_type):
+        return int(value)
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    return value
+
+
+def to_record_batch(rows: list, schema: pa.Schema) -> pa.RecordBatch:
+    arrays = [
+        pa.array([coerce_value(row.get(field.name), field.type) for row in rows], type=field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(features: Iterable[dict], file_obj: IO[bytes], batch_size: int = BATCH_SIZE) -> int:
+    """
+    Write the features to a binary file object as a typed Parquet file (schema from get_schema())
+    and return the count. Only batch_size rows are kept in memory at a time.
+    """
+    schema = get_arrow_schema()
+    count = 0
+    rows = []
+
+    with pq.ParquetWriter(file_obj, schema, compression="snappy") as writer:
+        for feature in features:
+            rows.append(flatten_feature(feature))
+            if len(rows) >= batch_size:
+                writer.write_batch(to_record_batch(rows, schema))
+                count += len(rows)
+                rows = []
+
+        if rows or count == 0:
+            writer.write_batch(to_record_batch(rows, schema))
+            count += len(rows)
+
+    return count
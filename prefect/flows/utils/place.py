@@ -0,0 +1,55 @@
+"""
+Place names of the USGS events, the same rules as the dbt macros place_orig and normalize_place
+(dbt/macros/place.sql, keep them in sync), e.g. to check or benchmark the mapping of dim_place.
+The regular expressions are ASCII like RE2 (\\w doesn't match accented letters).
+"""
+import re
+from functools import lru_cache
+from typing import Optional
+
+COUNTRY_PATTERN = re.compile(r",\s(.*?)$", re.ASCII)
+ISLAND_PATTERN = re.compile(r"of (?:the )?(\w+ ?\w+) island", re.ASCII)
+DIRECTION_PATTERN = re.compile(
+    r"(off|near)?\s?(the)?\s?\b(bay|coast|central|south|north|east|west|southeast|southwest|northwest|northeast"
+    r"|southeastern)( coast)? of\s?\b(south|north|west|east|southern|northern|western|eastern|central|southeastern)"
+    r"?\s?", re.ASCII)
+SEA_PATTERN = re.compile(r"sea of (\w+)", re.ASCII)
+REGION_PATTERN = re.compile(r"([\w\s-]+?)(?: border)?\sregion", re.ASCII)
+# place_orig which no pattern handles
+PLACE_NAMES = {
+    "1960 great chilean earthquake (valdivia earthquake)": "chile",
+    "ca": "california",
+}
+
+
+def get_place_orig(place: Optional[str]) -> Optional[str]:
+    """The lower-case part after the first comma of properties_place (all of it if there is no comma)."""
+    if place is None:
+        return None
+    place = place.lower()
+    if "," not in place:
+        return place
+    match = COUNTRY_PATTERN.search(place)
+    return match.group(1) if match else None
+
+
+def extract(pattern: re.Pattern, place: str) -> Optional[str]:
+    # like REGEXP_EXTRACT: the first capturing group of the first match, None if no match
+    match = pattern.search(place)
+    return match.group(1) if match else None
+
+
+@lru_cache(maxsize=65536)
+def normalize_place(place_orig: Optional[str]) -> Optional[str]:
+    """The region of a place_orig (see get_place_orig), e.g. "fiji" for "south of the fiji islands"."""
+    if place_orig is None:
+        return None
+    if ISLAND_PATTERN.search(place_orig):
+        return extract(ISLAND_PATTERN, place_orig)
+    if DIRECTION_PATTERN.search(place_orig):
+        return DIRECTION_PATTERN.sub("", place_orig)
+    if SEA_PATTERN.search(place_orig):
+        return extract(SEA_PATTERN, place_orig)
+    if "region" in place_orig.lower():
+        return extract(REGION_PATTERN, place_orig)
+    return PLACE_NAMES.get(place_orig, place_orig)
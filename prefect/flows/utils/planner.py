@@ -0,0 +1,114 @@
+from datetime import date, timedelta
+from typing import Callable, List, NamedTuple
+from dateutil.relativedelta import relativedelta
+
+
+USGS_LIMIT = 20000
+# the calendar units of the plan, from the largest: periods of period_years years, years, months, days
+LEVELS = ("period", "year", "month", "day")
+PERIOD_YEARS = 10
+
+
+class Chunk(NamedTuple):
+    start_date: date
+    end_date: date
+    count: int
+
+
+def get_period_dates(start_date: date, end_date: date, years: int) -> List[date]:
+    """
+    Get the first days of the years which are multiples of `years` within (start_date, end_date),
+    e.g. the decades with years=10.
+    """
+    first_year = (start_date.year // years + 1) * years
+    return [date(year, 1, 1) for year in range(first_year, end_date.year + 1, years)
+            if start_date < date(year, 1, 1) < end_date]
+
+
+def merge_chunks(chunks: List[Chunk], limit: int = USGS_LIMIT) -> List[Chunk]:
+    """Merge adjacent chunks as long as the merged count doesn't exceed the limit."""
+    merged = []
+    for chunk in chunks:
+        if merged and merged[-1].end_date == chunk.start_date and merged[-1].count + chunk.count <= limit:
+            last = merged.pop()
+            chunk = Chunk(last.start_date, chunk.end_date, last.count + chunk.count)
+        merged.append(chunk)
+    return merged
+
+
+def get_unit_end(day: date, level: int, period_years: int = PERIOD_YEARS) -> date:
+    """The end of the calendar unit of the level (see LEVELS) containing day, e.g. the next January 1st for years."""
+    unit = LEVELS[level]
+    if unit == "period":
+        return date((day.year // period_years + 1) * period_years, 1, 1)
+    if unit == "year":
+        return date(day.year + 1, 1, 1)
+    if unit == "month":
+        return day.replace(day=1) + relativedelta(months=1)
+    return day + timedelta(days=1)
+
+
+def get_unit_dates(start_date: date, end_date: date, level: int, period_years: int = PERIOD_YEARS) -> List[date]:
+    """The boundaries of the calendar units of the level within (start_date, end_date)."""
+    dates = []
+    current_date = get_unit_end(start_date, level, period_years)
+    while current_date < end_date:
+        dates.append(current_date)
+        current_date = get_unit_end(current_date, level, period_years)
+    return dates
+
+
+def plan_ranges(start_date: date,
+                end_date: date,
+                count_fn: Callable[[date, date], int],
+                limit: int = USGS_LIMIT,
+                period_years: int = None,
+                anchored: bool = True) -> List[Chunk]:
+    """
+    Plan the ranges to request so that each range has at most `limit` events,
+    with ranges anchored to calendar units so that the same history is always planned in the same ranges
+    (and so saved in the same files) whatever the end date of the run is.
+
+    The period is cut at every period_years years (a decade by default, see get_period_dates),
+    a unit over the limit is cut at its years, a year over the limit at its months and a month over the limit
+    at its days, each part is counted and planned in the same way. The adjacent parts of a complete unit are
+    merged again while their total count is within the limit. So sparse eras end up in a few large ranges,
+    dense eras in small ones, and only the ranges of the last (incomplete) unit change when the end date moves:
+    an incomplete unit is cut at its months even within the limit, and its parts are never merged.
+
+    count_fn(start_date, end_date) returns the number of events in [start_date, end_date).
+    Ranges are never shorter than one day, so a single day over the limit is returned as it is
+    and should be handled by the caller.
+
+    Without anchored (e.g. for the events updated after a time, whose files are named after it and so are never
+    planned again), the whole period is counted first and returned as one range if it is within the limit,
+    otherwise it is cut in the same way but all the parts are merged while their total count is within the limit.
+    """
+    period_years = period_years or PERIOD_YEARS
+
+    def plan(start: date, end: date, count: int, level: int) -> List[Chunk]:
+        # the range ends with its unit (its start only depends on the start date of the run)
+        complete = not anchored or end == get_unit_end(end - timedelta(days=1), level, period_years)
+        if LEVELS[level] == "day" or (count <= limit and (complete or LEVELS[level] == "month")):
+            return [Chunk(start, end, count)]
+
+        split_dates = [start] + get_unit_dates(start, end, level + 1, period_years) + [end]
+        chunks = []
+        for it_start, it_end in zip(split_dates[:-1], split_dates[1:]):
+            it_count = count if (it_start, it_end) == (start, end) else count_fn(it_start, it_end)
+            chunks.extend(plan(it_start, it_end, it_count, level + 1))
+
+        return merge_chunks(chunks, limit) if complete else chunks
+
+    if (end_date - start_date).days < 1:
+        return []
+
+    if not anchored:
+        count = count_fn(start_date, end_date)
+        if count <= limit:
+            return [Chunk(start_date, end_date, count)]
+
+    period_dates = [start_date] + get_period_dates(start_date, end_date, period_years) + [end_date]
+    chunks = [chunk for period_start, period_end in zip(period_dates[:-1], period_dates[1:])
+              for chunk in plan(period_start, period_end, count_fn(period_start, period_end), 0)]
+    return chunks if anchored else merge_chunks(chunks, limit)
@@ -0,0 +1,126 @@
+from functools import lru_cache
+import pyarrow as pa
+from google.cloud import bigquery
+
+
+# Flat columns of a GeoJSON feature (name, BigQuery type, mode), in the order of the BigQuery tables.
+# Everything else (BigQuery, pandas and arrow schemas, field names, nested raw schema) is derived from FIELDS.
+FIELDS = (
+    ("id", "STRING", "REQUIRED"),
+    ("type", "STRING", "NULLABLE"),
+    ("properties_mag", "FLOAT", "NULLABLE"),
+    ("properties_place", "STRING", "NULLABLE"),
+    ("properties_time", "INTEGER", "NULLABLE"),
+    ("properties_updated", "INTEGER", "NULLABLE"),
+    ("properties_tz", "STRING", "NULLABLE"),
+    ("properties_url", "STRING", "NULLABLE"),
+    ("properties_detail", "STRING", "NULLABLE"),
+    ("properties_felt", "INTEGER", "NULLABLE"),
+    ("properties_cdi", "FLOAT", "NULLABLE"),
+    ("properties_mmi", "FLOAT", "NULLABLE"),
+    ("properties_alert", "STRING", "NULLABLE"),
+    ("properties_status", "STRING", "NULLABLE"),
+    ("properties_tsunami", "INTEGER", "NULLABLE"),
+    ("properties_sig", "INTEGER", "NULLABLE"),
+    ("properties_net", "STRING", "NULLABLE"),
+    ("properties_code", "STRING", "NULLABLE"),
+    ("properties_ids", "STRING", "NULLABLE"),
+    ("properties_sources", "STRING", "NULLABLE"),
+    ("properties_types", "STRING", "NULLABLE"),
+    ("properties_nst", "INTEGER", "NULLABLE"),
+    ("properties_dmin", "FLOAT", "NULLABLE"),
+    ("properties_rms", "FLOAT", "NULLABLE"),
+    ("properties_gap", "FLOAT", "NULLABLE"),
+    ("properties_magType", "STRING", "NULLABLE"),
+    ("properties_type", "STRING", "NULLABLE"),
+    ("properties_title", "STRING", "NULLABLE"),
+    ("geometry_type", "STRING", "NULLABLE"),
+    ("geometry_longitude", "FLOAT", "NULLABLE"),
+    ("geometry_latitude", "FLOAT", "NULLABLE"),
+    ("geometry_altitude", "FLOAT", "NULLABLE"),
+)
+
+# Columns added by the slowly changing dimension (type 2) of the USGS table (name, BigQuery type, mode, description)
+SCD2_FIELDS = (
+    ("is_valid", "BOOL", "REQUIRED", "Indicates whether the record is currently valid."),
+    ("valid_from", "TIMESTAMP", "REQUIRED", "Timestamp when the record became valid."),
+    ("valid_to", "TIMESTAMP", "NULLABLE", "Timestamp when the record became invalid. NULL if the record is valid."),
+    ("hash_value", "INT64", "REQUIRED", "Hash value of the record calculated using FARM_FINGERPRINT."),
+)
+
+DATAFRAME_TYPES = {"STRING": "str", "FLOAT": "float", "INTEGER": "Int64"}
+ARROW_TYPES = {"STRING": pa.string(), "FLOAT": pa.float64(), "INTEGER": pa.int64()}
+
+# The artifacts are built once per process. SchemaField and pa.Schema are immutable,
+# the lists and dicts are copied by the getters because the callers may modify them.
+
+
+@lru_cache(maxsize=None)
+def _schema() -> tuple:
+    return tuple(bigquery.SchemaField(name, field_type, mode=mode) for name, field_type, mode in FIELDS)
+
+
+@lru_cache(maxsize=None)
+def _scd2_schema() -> tuple:
+    return tuple(bigquery.SchemaField(name, field_type, mode=mode, description=description)
+                 for name, field_type, mode, description in SCD2_FIELDS)
+
+
+@lru_cache(maxsize=None)
+def _raw_schema() -> tuple:
+    properties = [
+        bigquery.SchemaField(name[len("properties_"):], field_type)
+        for name, field_type, _ in FIELDS if name.startswith("properties_")
+    ]
+
+    return (
+        bigquery.SchemaField("id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("type", "STRING"),
+        bigquery.SchemaField("properties", "RECORD", fields=properties),
+        bigquery.SchemaField("geometry", "RECORD", fields=[
+            bigquery.SchemaField("type", "STRING"),
+            bigquery.SchemaField("coordinates", "FLOAT", mode="REPEATED"),
+        ]),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_arrow_schema() -> pa.Schema:
+    return pa.schema([
+        pa.field(name, ARROW_TYPES[field_type], nullable=mode != "REQUIRED")
+        for name, field_type, mode in FIELDS
+    ])
+
+
+def get_schema() -> list:
+    return list(_schema())
+
+
+def get_usgs_table_schema() -> list:
+    """Get the schema of the USGS table: the columns of get_schema() and the SCD2 columns."""
+    return list(_schema() + _scd2_schema())
+
+
+def get_raw_schema() -> list:
+    """
+    Get the nested schema of the GeoJSON features (one feature per line in the NDJSON files),
+    the counterpart of get_schema() before flattening.
+    """
+    return list(_raw_schema())
+
+
+def get_dataframe_schema() -> dict:
+    return {name: DATAFRAME_TYPES.get(field_type, "object") for name, field_type, _ in FIELDS}
+
+
+def get_schema_field_names() -> list:
+    return [name for name, _, _ in FIELDS]
+
+
+def get_hash_columns() -> list:
+    """Get the columns used for the hash value of a record (all columns except id)."""
+    return [name for name, _, _ in FIELDS if name != "id"]
+
+
+def get_scd2_field_names() -> list:
+    return [name for name, _, _, _ in SCD2_FIELDS]
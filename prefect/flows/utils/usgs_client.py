@@ -0,0 +1,183 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+USGS_BASE_URL = "https://earthquake.usgs.gov/fdsnws/event/1"
+USGS_QUERY_URL = f"{USGS_BASE_URL}/query"
+USGS_COUNT_URL = f"{USGS_BASE_URL}/count"
+
+# requests per second (and burst) allowed to USGS by all threads of this process
+RATE = float(os.environ.get("WORLD_EARTHQUAKE_USGS_RATE", 5))
+BURST = int(os.environ.get("WORLD_EARTHQUAKE_USGS_BURST", 5))
+# (connect, read) timeout in seconds, the read timeout is between two bytes of the body
+TIMEOUT = (10, 120)
+POOL_SIZE = 16
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a request is allowed.
+    pause() stops all threads for a while, e.g. when USGS asks to slow down with Retry-After.
+    """
+
+    def __init__(self, rate: float, capacity: int, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self) -> float:
+        now = self._clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+            if wait <= 0:
+                return
+            # sleep without the lock so that other threads can still check the bucket
+            self._sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """acquire() for coroutines, sharing the same tokens as the threads."""
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds to wait from the Retry-After header (delay in seconds or HTTP date), None if not set or invalid."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_backoff(attempt: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter: a random delay up to base * 2^attempt seconds."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class UsgsClient:
+    """
+    Client of the USGS FDSN event web service.
+    A single keep-alive session (connection pool) is shared by all threads,
+    requests are rate limited by a token bucket, ask for gzip transfers,
+    and are retried on connection errors and RETRY_STATUSES with jittered exponential backoff
+    (or after the delay of Retry-After if USGS sends one).
+    """
+
+    def __init__(self,
+                 rate: float = RATE,
+                 burst: int = BURST,
+                 timeout=TIMEOUT,
+                 max_retries: int = MAX_RETRIES,
+                 pool_size: int = POOL_SIZE):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        # retries are done here, not by urllib3, to honor Retry-After with the rate limit of all threads
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate",
+                                     "User-Agent": "world-earthquake-pipeline"})
+
+    def get(self, url: str, params: dict = None, stream: bool = False) -> requests.Response:
+        """
+        GET url and return the response, raise requests.HTTPError if it fails after the retries.
+        With stream, the body is not read yet: use the response as a context manager to release the connection.
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, params=params, stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(get_backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                retry_after = get_retry_after(response)
+                response.close()
+                if retry_after is not None:
+                    # slow down all threads, not only this one
+                    self.bucket.pause(retry_after)
+                else:
+                    time.sleep(get_backoff(attempt))
+                attempt += 1
+                continue
+
+            try:
+                response.raise_for_status()
+            except requests.HTTPError:
+                response.close()
+                raise
+            return response
+
+    def count(self, params: dict) -> int:
+        response = self.get(USGS_COUNT_URL, params=params)
+        return int(response.json())
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> UsgsClient:
+    """Get the USGS client of this process (created once and shared by all threads)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UsgsClient()
+        return _client
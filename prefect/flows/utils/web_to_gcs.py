@@ -1,27 +1,77 @@
 import os
-import requests
 import json
-from datetime import date
-from io import StringIO
+import time
+from datetime import date, datetime, timedelta, timezone
 from prefect import task, flow, get_run_logger
-from prefect_gcp.cloud_storage import GcsBucket
 from requests.exceptions import RequestException
+from google.cloud.exceptions import NotFound
 
-from flows.utils.gcs_to_bq import gcs_to_bq
+from flows.utils.gcs_to_bq import gcs_to_bq, get_file_format
+from flows.utils.geojson_stream import iter_features, write_ndjson
+from flows.utils.parquet import write_parquet
+from flows.utils.clients import get_bucket
+from flows.utils.manifest import get_manifest, checkpoint, record_failure
+from flows.utils.metrics import get_chunk_metrics, TimedIterator, TimedWriter
+from flows.utils.usgs_client import get_client, USGS_QUERY_URL
 
 
 BASE_NAME = "world-earthquake-pipeline"
 ENV = os.environ.get("ENV")
 BLOCK_NAME = f"{BASE_NAME}-{ENV}"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # bytes, must be a multiple of 256 KiB
+# the temporary object of an upload in progress, see write_features_to_gcs
+UPLOAD_SUFFIX = ".uploading"
 
 
-def get_file_path(start_date: date, end_date: date, split_time=True) -> str:
+def format_usgs_time(value: datetime) -> str:
+    """Format a datetime for USGS query parameters (ISO 8601 in UTC without offset)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="milliseconds")
+
+
+def get_query_params(start_date, end_date, updated_after: datetime = None) -> dict:
+    params = {
+        "starttime": start_date,
+        "endtime": end_date
+    }
+    if updated_after:
+        params["updatedafter"] = format_usgs_time(updated_after)
+    return params
+
+
+def get_file_path(start_date: date,
+                  end_date: date,
+                  split_time=True,
+                  compress=False,
+                  file_format="ndjson",
+                  updated_after: datetime = None) -> str:
+    if file_format == "parquet":
+        # Parquet files are always compressed internally
+        extension = "parquet"
+    elif file_format == "ndjson":
+        extension = "ndjson.gz" if compress else "ndjson"
+    else:
+        raise ValueError(f"unsupported file format: {file_format}")
+
+    if updated_after:
+        # events of any time updated after updated_after, saved under the month of updated_after
+        updated_after_str = f"{updated_after:%Y%m%dT%H%M%S}{updated_after.microsecond // 1000:03d}"
+        return (f"usgs/updated/{updated_after.year}/{updated_after.month:02d}/"
+                f"earthquake_{start_date}_{end_date}_updatedafter_{updated_after_str}.{extension}")
     if split_time:
-        year = start_date.year
-        month = start_date.month
-        return f"usgs/{year}/{month:02d}/earthquake_{start_date}_{end_date}.ndjson"
+        # saved under the month, the year or the years of the chunk (the last day is end_date - 1 day)
+        last_date = end_date - timedelta(days=1)
+        if (start_date.year, start_date.month) == (last_date.year, last_date.month):
+            folder = f"{start_date.year}/{start_date.month:02d}"
+        elif start_date.year == last_date.year:
+            folder = f"{start_date.year}"
+        else:
+            folder = f"{start_date.year}-{last_date.year}"
+        return f"usgs/{folder}/earthquake_{start_date}_{end_date}.{extension}"
     else:
-        return f"usgs/earthquake_{start_date}_{end_date}.ndjson"
+        return f"usgs/earthquake_{start_date}_{end_date}.{extension}"
 
 
 def process_data(start_date: date,
@@ -33,74 +83,183 @@ def process_data(start_date: date,
     gcs_to_bq(file_path)
 
 
+def record_upload(blob, file_path, start_date, end_date, count) -> None:
+    """Record an uploaded file in the manifest (if used)."""
+    manifest = get_manifest()
+    if manifest is None:
+        return
+    if blob.crc32c is None:
+        blob.reload()
+    manifest.set_status(file_path, "uploaded", start_date=start_date, end_date=end_date, count=count,
+                        checksum=f"crc32c:{blob.crc32c}")
+    checkpoint()
+
+
 @task(retries=1, log_prints=True)
 def if_file_exists(file_path) -> bool:
-    gcs_block = GcsBucket.load(BLOCK_NAME)
-    blobs = gcs_block.list_blobs(file_path)
-    return any([blob.name == file_path for blob in blobs])
+    manifest = get_manifest()
+    if manifest and manifest.has_status(file_path, "uploaded"):
+        return True
+
+    return get_bucket().blob(file_path).exists()
 
 
 @task(retries=1, log_prints=True)
-def fetch_earthquake_data(start_date, end_date) -> None:
+def fetch_earthquake_data(start_date, end_date, updated_after=None) -> None:
     """
     Fetch earthquake data from USGS (https://earthquake.usgs.gov/)
     e.g. https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=1568-01-01&endtime=1949-12-31
     limit = 20000
     """
-    url = "https://earthquake.usgs.gov/fdsnws/event/1/query"
+    url = USGS_QUERY_URL
 
     params = {
         "format": "geojson",
-        "starttime": start_date,
-        "endtime": end_date
+        **get_query_params(start_date, end_date, updated_after)
     }
 
     try:
-        response = requests.get(url, params=params)
-
-        if response.status_code == 200:
-            return response.json()
-        else:
-            Exception(f"Error fetching data: {response.status_code}")
+        response = get_client().get(url, params=params)
     except RequestException as e:
-        Exception(f"Error sending request: {e}")
-    except json.JSONDecodeError as e:
-        Exception(f"Error decoding JSON: {e}")
+        raise Exception(f"Error fetching data: {e}") from e
+
+    try:
+        return response.json()
+    except ValueError as e:
+        raise Exception(f"Error decoding JSON: {e}") from e
 
 
 @task(retries=1, log_prints=True)
 def convert_to_ndjson(earthquake_data) -> str:
-    ndjson_data = ""
-    for feature in earthquake_data["features"]:
-        ndjson_data += json.dumps(feature) + "\n"
-    return ndjson_data
+    return "".join(json.dumps(feature) + "\n" for feature in earthquake_data["features"])
 
 
 @task(retries=1, log_prints=True)
 def upload_to_gcs(ndjson_data, file_path) -> None:
     """Upload data to GCS"""
-    gcs_block = GcsBucket.load(BLOCK_NAME)
-    with StringIO(ndjson_data) as file_obj:
-        gcs_block.upload_from_file_object(
-            file_obj,
-            file_path, timeout=120)
+    get_bucket().blob(file_path).upload_from_string(ndjson_data, content_type="application/x-ndjson", timeout=120)
+
+    manifest = get_manifest()
+    if manifest:
+        manifest.set_status(file_path, "uploaded", count=ndjson_data.count("\n"))
+        checkpoint()
     return
 
 
+def get_content_type(file_path) -> str:
+    if get_file_format(file_path) == "parquet":
+        return "application/vnd.apache.parquet"
+    return "application/gzip" if file_path.endswith(".gz") else "application/x-ndjson"
+
+
+def write_features_to_gcs(features, file_path, bucket=None, metrics=None):
+    """
+    Write GeoJSON features to a resumable upload of UPLOAD_CHUNK_SIZE bytes per request.
+    The file format (NDJSON, gzipped NDJSON or Parquet) is decided by the extension of file_path.
+    Returns the blob and the number of features.
+    The features are uploaded to a temporary object (file_path + UPLOAD_SUFFIX) which is copied to file_path
+    once complete: closing the writer of a failed upload finalizes the partial file, and it must not replace
+    the file of a former run (e.g. with replace=True).
+    With metrics, the time spent in the uploads is added to the "upload" stage, the time spent
+    to convert the features to the "serialize" stage (the time spent to fetch them, if they are fetched
+    meanwhile through a TimedIterator of the "fetch" stage, is not counted as "serialize").
+    """
+    bucket = bucket or get_bucket()
+    temp_blob = bucket.blob(file_path + UPLOAD_SUFFIX)
+
+    writer = temp_blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, ignore_flush=True,
+                            content_type=get_content_type(file_path))
+    if metrics:
+        start = time.perf_counter()
+        other_seconds = metrics.get("fetch", "seconds") + metrics.get("upload", "seconds")
+    try:
+        with writer:
+            file_obj = TimedWriter(writer, metrics, "upload") if metrics else writer
+            if get_file_format(file_path) == "parquet":
+                count = write_parquet(features, file_obj)
+            else:
+                count = write_ndjson(features, file_obj, file_path.endswith(".gz"))
+    except Exception:
+        # closing the writer finalizes the upload, don't leave a partial file behind
+        try:
+            temp_blob.delete()
+        except NotFound:
+            pass
+        raise
+
+    if metrics:
+        other_seconds = metrics.get("fetch", "seconds") + metrics.get("upload", "seconds") - other_seconds
+        metrics.add("serialize", "seconds", time.perf_counter() - start - other_seconds)
+        metrics.add("serialize", "rows", count)
+        start = time.perf_counter()
+
+    # a copy within the bucket is a metadata operation (the bytes aren't uploaded again)
+    blob = bucket.copy_blob(temp_blob, bucket, file_path)
+    temp_blob.delete()
+
+    if metrics:
+        metrics.add("upload", "seconds", time.perf_counter() - start)
+    return blob, count
+
+
+@task(retries=1, log_prints=True)
+def stream_to_gcs(start_date, end_date, file_path, updated_after=None) -> int:
+    """
+    Stream earthquake data from USGS to GCS without loading the whole response in memory:
+    the GeoJSON features are parsed incrementally from the HTTP body
+    and written to GCS by write_features_to_gcs.
+    With updated_after, only the events updated after it are fetched.
+    Returns the number of features.
+    """
+    logger = get_run_logger()
+
+    params = {
+        "format": "geojson",
+        **get_query_params(start_date, end_date, updated_after)
+    }
+
+    metrics = get_chunk_metrics(file_path)
+    with metrics.stage("fetch"):
+        response = get_client().get(USGS_QUERY_URL, params=params, stream=True)
+    with response:
+        chunks = TimedIterator(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), metrics, "fetch")
+        blob, count = write_features_to_gcs(iter_features(chunks), file_path, metrics=metrics)
+
+    logger.info(f"uploaded {count} features: {file_path}")
+    record_upload(blob, file_path, start_date, end_date, count)
+
+    return count
+
+
 @flow(name="world-earthquake-pipeline: web_to_gcs")
 def web_to_gcs(start_date: date,
                end_date: date,
                replace: bool,
-               file_path: str
+               file_path: str,
+               stream: bool = True,
+               updated_after: datetime = None
                ) -> None:
 
     logger = get_run_logger()
     file_exists = if_file_exists(file_path)
     if file_exists and not replace:
         logger.info(f"file already exists, nothing to do: {file_path}")
-    else:
-        logger.info(file_path)
-        earthquake_data = fetch_earthquake_data(start_date, end_date)
-        if earthquake_data:
-            ndjson_data = convert_to_ndjson(earthquake_data)
-            upload_to_gcs(ndjson_data, file_path)
+        return
+
+    logger.info(file_path)
+    with record_failure([file_path], "upload"):
+        if stream:
+            stream_to_gcs(start_date, end_date, file_path, updated_after)
+        elif get_file_format(file_path) == "parquet":
+            raise ValueError("Parquet files can only be written with stream=True")
+        else:
+            metrics = get_chunk_metrics(file_path)
+            with metrics.stage("fetch"):
+                earthquake_data = fetch_earthquake_data(start_date, end_date, updated_after)
+            if earthquake_data:
+                with metrics.stage("serialize"):
+                    ndjson_data = convert_to_ndjson(earthquake_data)
+                metrics.add("serialize", "rows", len(earthquake_data["features"]))
+                with metrics.stage("upload"):
+                    upload_to_gcs(ndjson_data, file_path)
+                metrics.add("upload", "bytes", len(ndjson_data.encode()))
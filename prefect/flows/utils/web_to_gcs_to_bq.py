@@ -1,35 +1,54 @@
+import contextvars
 import requests
-from datetime import date, timedelta
-from dateutil.relativedelta import relativedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import partial
 from prefect import task, flow, get_run_logger
 
-from flows.utils.gcs_to_bq import gcs_to_bq
-from flows.utils.web_to_gcs import web_to_gcs, get_file_path
+from flows.utils.gcs_to_bq import gcs_to_bq, gcs_to_bq_batch
+from flows.utils.web_to_gcs import web_to_gcs, get_file_path, get_query_params
+from flows.utils.planner import plan_ranges, USGS_LIMIT
+from flows.utils.manifest import get_manifest, save_manifest, checkpoint
+from flows.utils.metrics import emit_metrics
+from flows.utils.usgs_client import get_client, USGS_COUNT_URL
+from flows.utils.async_fetch import fetch_chunks_async
 
+FETCH_ENGINES = ("threads", "async")
 
-USGS_LIMIT = 20000
+
+def fetch_data(start_date: date,
+               end_date: date,
+               replace: bool,
+               split_time: bool,
+               compress: bool = False,
+               file_format: str = "ndjson",
+               updated_after: datetime = None) -> str:
+    file_path = get_file_path(start_date, end_date, split_time, compress, file_format, updated_after)
+    web_to_gcs(start_date, end_date, replace, file_path, updated_after=updated_after)
+    return file_path
 
 
 def process_data(start_date: date,
                  end_date: date,
                  replace: bool,
-                 split_time: bool) -> None:
-    file_path = get_file_path(start_date, end_date, split_time)
-    web_to_gcs(start_date, end_date, replace, file_path)
-    gcs_to_bq(file_path)
+                 split_time: bool,
+                 compress: bool = False,
+                 file_format: str = "ndjson",
+                 load_mode: str = "dataframe",
+                 updated_after: datetime = None) -> str:
+    file_path = fetch_data(start_date, end_date, replace, split_time, compress, file_format, updated_after)
+    gcs_to_bq(file_path, load_mode)
+    return file_path
 
 
 @task(retries=1, log_prints=True)
-def check_count(start_date: date, end_date: date) -> int:
+def check_count(start_date: date, end_date: date, updated_after: datetime = None) -> int:
     logger = get_run_logger()
 
-    count_url = "https://earthquake.usgs.gov/fdsnws/event/1/count"
-    params = {"starttime": start_date,
-              "endtime": end_date}
+    params = get_query_params(start_date, end_date, updated_after)
 
     try:
-        response = requests.get(count_url, params=params)
-        response.raise_for_status()
+        response = get_client().get(USGS_COUNT_URL, params=params)
     except requests.exceptions.RequestException as e:
         logger.error(f"Request failed: {e}")
         raise
@@ -45,51 +64,286 @@ def check_count(start_date: date, end_date: date) -> int:
     return count
 
 
+def count_events(start_date: date, end_date: date, updated_after: datetime = None) -> int:
+    """check_count with the counts recorded in the manifest (if used)."""
+    if updated_after:
+        # counts of updated events change every day, don't record them
+        return check_count(start_date, end_date, updated_after)
+
+    manifest = get_manifest()
+    if manifest:
+        count = manifest.get_count(start_date, end_date)
+        if count is not None:
+            return count
+
+    count = check_count(start_date, end_date)
+    if manifest:
+        manifest.set_count(start_date, end_date, count)
+    return count
+
+
+def plan_chunks(start_date: date,
+                end_date: date,
+                split_time: bool = True,
+                updated_after: datetime = None,
+                period_years: int = None) -> list:
+    """
+    Plan all (start_date, end_date) chunks of the period up front.
+    The period is split by the counts of events (see plan_ranges)
+    so that each chunk has at most USGS_LIMIT events (updated after updated_after if given).
+    With period_years, no anchored chunk spans more than one period of period_years years (e.g. a decade).
+    The chunks are anchored to calendar units unless updated_after is given: the few events updated
+    since the last run are fetched in one chunk however long the period is.
+    """
+    if not split_time:
+        # don't split request
+        return [(start_date, end_date)]
+
+    logger = get_run_logger()
+    count_fn = partial(count_events, updated_after=updated_after) if updated_after else count_events
+    chunks = plan_ranges(start_date, end_date, count_fn, USGS_LIMIT, period_years=period_years,
+                         anchored=updated_after is None)
+
+    for chunk in chunks:
+        if chunk.count > USGS_LIMIT:
+            logger.warning(
+                f"too many events in a day, data will be truncated: "
+                f"start={chunk.start_date}, end={chunk.end_date}, count={chunk.count}")
+
+    return [(chunk.start_date, chunk.end_date) for chunk in chunks]
+
+
+def run_chunks(chunks: list,
+               replace: bool,
+               split_time: bool,
+               max_workers: int = 1,
+               process_fn=None,
+               retries: int = 0,
+               **options) -> list:
+    """
+    Run process_fn (process_data by default) for every chunk with at most max_workers chunks in flight.
+    options are passed to process_fn as they are.
+    Returns the file paths in the same order as chunks, whatever the completion order was.
+    If some chunks failed, the other chunks are still processed, then the failed chunks are retried
+    one at a time (up to retries times) so that a failure isn't caused by the others again,
+    and the error of the first chunk (in chunk order) which still failed is raised at the end.
+    """
+    process_fn = process_fn or process_data
+    logger = get_run_logger()
+
+    results = [None] * len(chunks)
+    errors = {}
+    if max_workers <= 1:
+        for i, (start, end) in enumerate(chunks):
+            try:
+                results[i] = process_fn(start, end, replace, split_time, **options)
+            except Exception as e:
+                logger.error(f"chunk failed: start={start}, end={end}: {e}")
+                errors[i] = e
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # copy the context so that the subflows are attached to the current flow run
+            futures = [
+                executor.submit(contextvars.copy_context().run,
+                                process_fn, start, end, replace, split_time, **options)
+                for start, end in chunks]
+
+            for i, ((start, end), future) in enumerate(zip(chunks, futures)):
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logger.error(f"chunk failed: start={start}, end={end}: {e}")
+                    errors[i] = e
+
+    for attempt in range(retries):
+        if not errors:
+            break
+        logger.info(f"retrying {len(errors)} failed chunks one at a time (attempt {attempt + 1} of {retries})")
+        for i in list(errors):
+            start, end = chunks[i]
+            try:
+                results[i] = process_fn(start, end, replace, split_time, **options)
+                del errors[i]
+            except Exception as e:
+                logger.error(f"chunk failed again: start={start}, end={end}: {e}")
+                errors[i] = e
+
+    if errors:
+        raise errors[min(errors)]
+
+    return results
+
+
+def get_resume_key(start_date: date,
+                   end_date: date,
+                   split_time: bool,
+                   updated_after: datetime = None,
+                   period_years: int = None) -> str:
+    """The default key of the plan of a run, the same for a rerun of the same period."""
+    key = f"{start_date}_{end_date}_{'split' if split_time else 'whole'}"
+    if split_time and period_years:
+        key = f"{key}_{period_years}y"
+    return f"{key}_updatedafter_{updated_after.isoformat()}" if updated_after else key
+
+
+def get_run_plan(start_date: date,
+                 end_date: date,
+                 split_time: bool = True,
+                 updated_after: datetime = None,
+                 resume_key: str = None,
+                 period_years: int = None) -> tuple:
+    """
+    Get the chunks of a run and when they were planned: the plan recorded under resume_key in the manifest
+    if its run didn't complete (a rerun of a failed run doesn't count the events again),
+    otherwise a new plan (recorded under resume_key, see complete_run_plan).
+    """
+    manifest = get_manifest()
+    if not manifest:
+        return plan_chunks(start_date, end_date, split_time, updated_after, period_years), None
+
+    resume_key = resume_key or get_resume_key(start_date, end_date, split_time, updated_after, period_years)
+    plan = manifest.get_plan(resume_key)
+    if plan:
+        get_run_logger().info(f"resuming the plan {resume_key} of {plan[1]}")
+        return plan
+
+    chunks = plan_chunks(start_date, end_date, split_time, updated_after, period_years)
+    planned_at = manifest.set_plan(resume_key, chunks)
+    checkpoint(force=True)
+    return chunks, planned_at
+
+
+def complete_run_plan(resume_key: str) -> None:
+    """Record that the run of the plan of resume_key completed: a rerun with the same key plans again."""
+    manifest = get_manifest()
+    if manifest:
+        manifest.complete_plan(resume_key)
+
+
+def is_chunk_done(file_path: str, replace: bool, planned_at: str) -> bool:
+    """
+    Whether the file of a chunk is already merged, by this run (since planned_at) if replace is True
+    (a rerun of a run with replace=True only replaces the files the failed run didn't).
+    """
+    manifest = get_manifest()
+    if not manifest:
+        return False
+    if replace:
+        return planned_at is not None and manifest.has_status(file_path, "merged", since=planned_at)
+    return manifest.has_status(file_path, "merged")
+
+
+def merge_files(file_paths: list, load_mode: str = "dataframe", batch_size: int = None) -> None:
+    """
+    Merge the files into the BigQuery table one by one (or batch_size files at a time).
+    A file which fails doesn't stop the others: a failed batch is merged again one file at a time
+    so that only the failed files are left, and the first error is raised at the end.
+    """
+    logger = get_run_logger()
+    errors = []
+
+    if batch_size:
+        for i in range(0, len(file_paths), batch_size):
+            batch = file_paths[i:i + batch_size]
+            try:
+                gcs_to_bq_batch(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    errors.append(e)
+                    continue
+                logger.warning(f"batch failed, merging its {len(batch)} files one at a time: {e}")
+                for file_path in batch:
+                    try:
+                        # the files of a batch are loaded natively
+                        gcs_to_bq(file_path, "native")
+                    except Exception as e:
+                        logger.error(f"file failed: {file_path}: {e}")
+                        errors.append(e)
+    else:
+        for file_path in file_paths:
+            try:
+                gcs_to_bq(file_path, load_mode)
+            except Exception as e:
+                logger.error(f"file failed: {file_path}: {e}")
+                errors.append(e)
+
+    if errors:
+        raise errors[0]
+
+
 @flow(name="world-earthquake-pipeline: web_to_gcs_to_bq")
 def web_to_gcs_to_bq(start_date: date,
                      end_date: date,
                      replace: bool = False,
                      split_time: bool = True,
-                     ) -> None:
+                     max_workers: int = 1,
+                     compress: bool = False,
+                     file_format: str = "ndjson",
+                     load_mode: str = "dataframe",
+                     batch_size: int = None,
+                     updated_after: datetime = None,
+                     fetch_engine: str = "threads",
+                     resume_key: str = None,
+                     chunk_retries: int = 1,
+                     period_years: int = None,
+                     ) -> list:
+    """
+    Fetch earthquake data from start_date till end_date, save the files to GCS and update the BigQuery table.
+    By default every file is merged into the BigQuery table on its own.
+    With batch_size, all files are fetched first and then merged batch_size files at a time,
+    so that the table is merged once per batch instead of once per file (load_mode is ignored,
+    the files are always loaded natively).
+    With updated_after, only the events updated after it are fetched (whatever their time is),
+    e.g. the revisions since the last run.
+    With fetch_engine="async", all files are fetched first by an asyncio engine
+    with max_workers requests in flight from this thread, then merged one by one (or by batch_size).
+    With the manifest (WORLD_EARTHQUAKE_MANIFEST_PATH), a run is checkpointed chunk by chunk and can be resumed:
+    a rerun of a failed run with the same period (or the same resume_key) reuses the plan of the chunks and skips
+    the chunks already merged (by the failed run if replace is True), a file loaded to a temp table is merged
+    without loading it. Once a run completes, its plan isn't resumed anymore: the next run plans again.
+    Failed chunks are retried one at a time up to chunk_retries times before the flow fails.
+    With period_years, no chunk spans more than one period of period_years years, e.g. 10 to save
+    the sparse historical events in files of a decade at most.
+    """
+    if fetch_engine not in FETCH_ENGINES:
+        raise ValueError(f"unsupported fetch engine: {fetch_engine}")
 
     logger = get_run_logger()
     logger.info(
         f"web_to_gcs_to_bq: start={start_date}, "
-        f"end={end_date}, replace={replace}")
+        f"end={end_date}, replace={replace}, max_workers={max_workers}")
 
-    if not split_time:
-        # don't split request
-        process_data(start_date, end_date, replace, False)
+    resume_key = resume_key or get_resume_key(start_date, end_date, split_time, updated_after, period_years)
+    try:
+        chunks, planned_at = get_run_plan(start_date, end_date, split_time, updated_after, resume_key, period_years)
+        all_file_paths = [get_file_path(start, end, split_time, compress, file_format, updated_after)
+                          for start, end in chunks]
+        pending = [i for i, file_path in enumerate(all_file_paths)
+                   if not is_chunk_done(file_path, replace, planned_at)]
+        logger.info(f"planned {len(chunks)} chunks, {len(chunks) - len(pending)} already merged")
+        chunks = [chunks[i] for i in pending]
 
-    else:
-        # basically we will split request monthly
-        current_date = start_date
-
-        while (current_date + timedelta(days=1)) <= end_date:
-            if current_date == start_date:
-                it_start_date = start_date
-            else:
-                it_start_date = current_date.replace(day=1)
-
-            it_end_date = min(
-                (current_date + relativedelta(months=1)).replace(day=1),
-                end_date)
-
-            # check count
-            count = check_count(it_start_date, it_end_date)
-
-            if count <= USGS_LIMIT:
-                process_data(it_start_date, it_end_date, replace, True)
-            else:
-                # split weekly
-                week_start_date = it_start_date
-                while (week_start_date + timedelta(days=1)) <= it_end_date:
-                    week_end_date = min(
-                        week_start_date + timedelta(days=7), it_end_date)
-
-                    process_data(week_start_date, week_end_date, replace, True)
-                    week_start_date += timedelta(days=7)
-
-            # next month
-            current_date = (
-                current_date + relativedelta(months=1)).replace(day=1)
+        if fetch_engine == "async":
+            file_paths = fetch_chunks_async(chunks, replace, split_time, max_workers, logger,
+                                            compress=compress, file_format=file_format, updated_after=updated_after)
+        elif batch_size:
+            file_paths = run_chunks(chunks, replace, split_time, max_workers, process_fn=fetch_data,
+                                    retries=chunk_retries,
+                                    compress=compress, file_format=file_format, updated_after=updated_after)
+        else:
+            file_paths = run_chunks(chunks, replace, split_time, max_workers, retries=chunk_retries,
+                                    compress=compress, file_format=file_format, load_mode=load_mode,
+                                    updated_after=updated_after)
+
+        if fetch_engine == "async" or batch_size:
+            merge_files(file_paths, load_mode, batch_size)
+
+        for i, file_path in zip(pending, file_paths):
+            all_file_paths[i] = file_path
+        # every chunk is merged, a rerun is a new run (e.g. replace=True replaces every file again)
+        complete_run_plan(resume_key)
+        return all_file_paths
+    finally:
+        # keep what was done even if some chunks failed
+        save_manifest()
+        emit_metrics(logger)
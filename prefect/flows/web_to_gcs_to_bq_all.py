@@ -6,27 +6,46 @@ from flows.utils.web_to_gcs_to_bq import web_to_gcs_to_bq
 # Define constants for the special years
 YEAR_START = 1568
 YEAR_SPLIT = 1950
+# the events before YEAR_SPLIT are sparse, their files span a decade at most
+HISTORICAL_PERIOD_YEARS = 10
 
 
 @flow(name="world-earthquake-pipeline: web_to_gcs_to_bq_all")
-def web_to_gcs_to_bq_all(replace=False) -> None:
+def web_to_gcs_to_bq_all(replace=False,
+                         max_workers: int = 1,
+                         file_format: str = "ndjson",
+                         batch_size: int = None,
+                         fetch_engine: str = "threads",
+                         resume_key: str = None) -> None:
     """
     Fetch earthquake data from 1568-01-01 till yesterday
     and save ndjson files to GCS and then update the BigQuery table.
-    The time period for fetching data is like this because of the limitation (up to 20000) of the request:
-    - from 1568-01-01 till 1949-12-31: one time
-    - from 1950-01-01: monthly (or weekly)
+    Both periods are split into ranges of up to 20000 events (the limit of a request) planned by the counts of events:
+    - from 1568-01-01 till 1949-12-31: ranges within a decade, e.g. usgs/1900/01/earthquake_1900-01-01_1910-01-01.ndjson
+    - from 1950-01-01: ranges of up to 20000 events
+    Up to max_workers chunks are processed concurrently.
+    Files are saved as file_format ("ndjson" or "parquet").
+    With batch_size, the files are merged into the BigQuery table batch_size files at a time.
+    With fetch_engine="async", max_workers requests are kept in flight by a single thread,
+    e.g. max_workers=32 for a backfill on a small VM.
+    With the manifest, a rerun after a failure resumes where the failed run stopped, see web_to_gcs_to_bq
+    (pass the same resume_key if the rerun isn't on the same day, the end date of the run changes every day).
     """
 
-    # Fetch data from YEAR_START till YEAR_SPLIT in one go
+    # Fetch data from YEAR_START till YEAR_SPLIT in ranges planned by the counts of events, by decade
     start = datetime(YEAR_START, 1, 1).date()
     end = datetime(YEAR_SPLIT, 1, 1).date()
-    web_to_gcs_to_bq(start, end, replace, split_time=False)
+    web_to_gcs_to_bq(start, end, replace, split_time=True,
+                     max_workers=max_workers, file_format=file_format, batch_size=batch_size,
+                     fetch_engine=fetch_engine, resume_key=f"{resume_key}_{YEAR_START}" if resume_key else None,
+                     period_years=HISTORICAL_PERIOD_YEARS)
 
-    # Fetch data from YEAR_SPLIT till now in monthly (or weekly) splits
+    # Fetch data from YEAR_SPLIT till now in ranges planned by the counts of events
     start = datetime(YEAR_SPLIT, 1, 1).date()
     end = datetime.now().date()
-    web_to_gcs_to_bq(start, end, replace, split_time=True)
+    web_to_gcs_to_bq(start, end, replace, split_time=True,
+                     max_workers=max_workers, file_format=file_format, batch_size=batch_size,
+                     fetch_engine=fetch_engine, resume_key=f"{resume_key}_{YEAR_SPLIT}" if resume_key else None)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,50 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from prefect import flow
 
 from flows.utils.web_to_gcs_to_bq import web_to_gcs_to_bq
-from flows.utils.gcs_to_bq import get_last_datetime
+from flows.utils.gcs_to_bq import get_last_datetime, get_last_updated, get_merged_months
+from flows.web_to_gcs_to_bq_all import YEAR_START
+from flows.run_dbt import run_dbt
 
 
 @flow(name="world-earthquake-pipeline: web_to_gcs_to_bq_daily")
-def web_to_gcs_to_bq_daily() -> None:
+def web_to_gcs_to_bq_daily(incremental: bool = False, build_models: bool = True) -> None:
+    """
+    Fetch the earthquakes since the last one in the BigQuery table.
+    With incremental, fetch the earthquakes of any time updated since the last update in the table instead,
+    so that revisions of older events (e.g. magnitude, review status) are also merged.
+    Deleted events are not (USGS leaves them out unless includedeleted is requested), their records stay valid.
+    With build_models, the dbt models are built once the data is merged (run_dbt),
+    only for the months which changed (nothing is built if no month changed).
+    """
+    if incremental:
+        # Get the watermark of the updates in the BigQuery table
+        last_updated = get_last_updated()
+        if last_updated:
+            # Fetch and save earthquake data updated after the watermark
+            # (end_date is tomorrow so that the events of today are included)
+            start_date = datetime(YEAR_START, 1, 1).date()
+            end_date = datetime.now().date() + timedelta(days=1)
+            file_paths = web_to_gcs_to_bq(start_date, end_date, replace=False, split_time=True,
+                                          updated_after=last_updated)
 
-    # Get the datetime of the last earthquake in the BigQuery table
-    last_datetime = get_last_datetime()
-    if last_datetime:
-        # Fetch and save earthquake data from the last earthquake till now
-        start_date = last_datetime.date()
-        end_date = datetime.now().date()
-        web_to_gcs_to_bq(start_date, end_date, replace=False, split_time=True)
+        else:
+            raise Exception("There is no data in the BigQuery table. Please run web_to_gcs_to_bq_all.")
 
     else:
-        raise Exception("There is no data in the BigQuery table. Please run web_to_gcs_to_bq_all.")
+        # Get the datetime of the last earthquake in the BigQuery table
+        last_datetime = get_last_datetime()
+        if last_datetime:
+            # Fetch and save earthquake data from the last earthquake till now
+            start_date = last_datetime.date()
+            end_date = datetime.now().date()
+            file_paths = web_to_gcs_to_bq(start_date, end_date, replace=False, split_time=True)
+
+        else:
+            raise Exception("There is no data in the BigQuery table. Please run web_to_gcs_to_bq_all.")
+
+    if build_models:
+        run_dbt(changed_months=get_merged_months(file_paths or []))
 
 
 if __name__ == "__main__":
@@ -5,7 +5,11 @@ from flows.utils.web_to_gcs_to_bq import web_to_gcs_to_bq
 
 
 @flow(name="world-earthquake-pipeline: web_to_gcs_to_bq_with_params")
-def web_to_gcs_to_bq_with_params(start_date: str, end_date: str, replace: bool = False) -> None:
+def web_to_gcs_to_bq_with_params(start_date: str,
+                                 end_date: str,
+                                 replace: bool = False,
+                                 max_workers: int = 1,
+                                 file_format: str = "ndjson") -> None:
 
     try:
         # Parse the start and end dates
@@ -13,6 +17,7 @@ def web_to_gcs_to_bq_with_params(start_date: str, end_date: str, replace: bool =
         end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
 
         # Fetch and save earthquake data from start_date till end_date
-        web_to_gcs_to_bq(start_date, end_date, replace, split_time=True)
+        web_to_gcs_to_bq(start_date, end_date, replace, split_time=True,
+                         max_workers=max_workers, file_format=file_format)
     except ValueError as e:
         raise ValueError(f"Invalid date format. Please provide dates in 'YYYY-MM-DD' format. {e}")
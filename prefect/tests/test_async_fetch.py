@@ -0,0 +1,98 @@
+import asyncio
+import json
+from datetime import date
+from unittest.mock import patch, MagicMock
+import httpx
+import pytest
+from flows.utils.async_fetch import AsyncFetchEngine, run_coroutine
+
+CHUNKS = [(date(2023, 1, 1), date(2023, 1, 11)),
+          (date(2023, 1, 11), date(2023, 1, 21)),
+          (date(2023, 1, 21), date(2023, 2, 1))]
+
+
+def geojson(start):
+    features = [{"type": "Feature", "id": f"{start}-{i}", "properties": {"mag": i}} for i in range(3)]
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+
+def consume_features(features, file_path, bucket=None, metrics=None):
+    return MagicMock(), len(list(features))
+
+
+@pytest.fixture
+def gcs():
+    with patch("flows.utils.async_fetch.record_upload") as mock_record_upload, \
+            patch("flows.utils.async_fetch.if_file_exists") as mock_if_file_exists, \
+            patch("flows.utils.async_fetch.write_features_to_gcs", side_effect=consume_features) as mock_write:
+        mock_if_file_exists.fn.return_value = False
+        yield mock_write, mock_record_upload, mock_if_file_exists
+
+
+def test_run(gcs):
+    mock_write, mock_record_upload, _ = gcs
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, content=geojson(request.url.params["starttime"]))
+
+    engine = AsyncFetchEngine(max_fetches=2, transport=httpx.MockTransport(handler))
+    file_paths = run_coroutine(engine.run(CHUNKS, False, True))
+
+    assert file_paths == ["usgs/2023/01/earthquake_2023-01-01_2023-01-11.ndjson",
+                          "usgs/2023/01/earthquake_2023-01-11_2023-01-21.ndjson",
+                          "usgs/2023/01/earthquake_2023-01-21_2023-02-01.ndjson"]
+    assert max_in_flight == 2
+    assert sorted(c.args[1] for c in mock_write.call_args_list) == file_paths
+    assert sorted(c.args[4] for c in mock_record_upload.call_args_list) == [3, 3, 3]
+
+
+def test_run_skips_existing_files(gcs):
+    mock_write, _, mock_if_file_exists = gcs
+    mock_if_file_exists.fn.return_value = True
+
+    engine = AsyncFetchEngine(transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    run_coroutine(engine.run(CHUNKS, False, True))
+
+    mock_write.assert_not_called()
+
+
+@patch("flows.utils.async_fetch.get_backoff", return_value=0)
+def test_run_retries(mock_backoff, gcs):
+    statuses = iter([503, 429])
+
+    def handler(request):
+        status = next(statuses, 200)
+        return httpx.Response(status, content=geojson("x") if status == 200 else b"")
+
+    engine = AsyncFetchEngine(max_fetches=1, transport=httpx.MockTransport(handler))
+    engine.bucket = MagicMock()
+
+    async def acquire_async():
+        pass
+
+    engine.bucket.acquire_async.side_effect = acquire_async
+    run_coroutine(engine.run(CHUNKS[:1], False, True))
+
+    assert mock_backoff.call_count == 2
+
+
+def test_run_raises_first_error_after_all_chunks(gcs):
+    mock_write, _, _ = gcs
+
+    def handler(request):
+        if request.url.params["starttime"] == "2023-01-11":
+            return httpx.Response(404)
+        return httpx.Response(200, content=geojson("x"))
+
+    engine = AsyncFetchEngine(transport=httpx.MockTransport(handler))
+    with pytest.raises(httpx.HTTPStatusError):
+        run_coroutine(engine.run(CHUNKS, False, True))
+
+    assert mock_write.call_count == 2
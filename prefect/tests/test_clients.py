@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pytest
+from flows.utils import clients
+from flows.utils.duckdb_warehouse import DuckDBClient
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clients.clear_clients()
+    yield
+    clients.clear_clients()
+
+
+@patch("flows.utils.clients.GcpCredentials")
+def test_clients_are_cached(mock_credentials):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: clients.get_bigquery_client(), range(32)))
+
+    assert all(result is results[0] for result in results)
+    mock_credentials.load.assert_called_once_with(clients.BLOCK_NAME)
+    mock_credentials.load.return_value.get_bigquery_client.assert_called_once_with()
+
+
+@patch("flows.utils.clients.GcsBucket")
+def test_bucket_is_built_once(mock_gcs_bucket):
+    assert clients.get_bucket() is clients.get_bucket()
+    assert clients.get_gcs_bucket() is mock_gcs_bucket.load.return_value
+    mock_gcs_bucket.load.return_value.get_bucket.assert_called_once_with()
+
+
+@patch("flows.utils.clients.os.getpid", side_effect=[1, 1, 2])
+@patch("flows.utils.clients.GcpCredentials")
+def test_clients_are_per_process(mock_credentials, mock_getpid):
+    mock_credentials.load.side_effect = lambda name: object()
+
+    first = clients.get_gcp_credentials()
+    assert clients.get_gcp_credentials() is first
+    # e.g. in a forked process
+    assert clients.get_gcp_credentials() is not first
+
+
+@patch("flows.utils.clients.BigQueryWarehouse")
+def test_clear_clients_closes(mock_warehouse):
+    warehouse = clients.get_warehouse()
+    clients.clear_clients()
+
+    warehouse.close.assert_called_once_with()
+    assert mock_warehouse.load.call_count == 1
+    clients.get_warehouse()
+    assert mock_warehouse.load.call_count == 2
+
+
+@patch("flows.utils.clients.get_gcsfs", return_value=None)
+def test_duckdb_warehouse(mock_gcsfs, tmp_path):
+    with patch("flows.utils.clients.WAREHOUSE", "duckdb"), \
+            patch("flows.utils.clients.DUCKDB_PATH", str(tmp_path / "warehouse.duckdb")):
+        client = clients.get_bigquery_client()
+
+    assert isinstance(client, DuckDBClient)
+    assert clients.get_bigquery_client() is client
+
+
+def test_unsupported_warehouse():
+    with patch("flows.utils.clients.WAREHOUSE", "sqlite"), pytest.raises(ValueError):
+        clients.get_bigquery_client()
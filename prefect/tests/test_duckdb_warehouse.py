@@ -0,0 +1,176 @@
+import io
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+import logging
+import pytest
+from unittest.mock import patch, ANY
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from benchmarks.offline.fake_gcs import FakeBucket, FakeGCSFileSystem
+from flows.utils.duckdb_warehouse import DuckDBClient, translate
+from flows.utils.gcs_to_bq import (get_flatten_query, get_hash_query, get_merge_query, get_hash_columns,
+                                   get_raw_schema, get_schema, get_usgs_table, update_bigquery_table,
+                                   get_missing_strings_query, get_moved_query, DAY_MILLIS)
+from flows.utils.gcs_to_bq import USGS_TABLE as PIPELINE_USGS_TABLE
+from flows.utils.schema import get_arrow_schema
+
+USGS_TABLE = "project.dataset.usgs_data"
+
+
+@pytest.fixture
+def client():
+    client = DuckDBClient()
+    yield client
+    client.close()
+
+
+def get_parquet(records):
+    columns = {field.name: [record.get(field.name) for record in records] for field in get_arrow_schema()}
+    buffer = io.BytesIO()
+    pq.write_table(pa.table(columns, schema=get_arrow_schema()), buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def merge(client, records):
+    config = bigquery.LoadJobConfig(schema=get_schema(), source_format=bigquery.SourceFormat.PARQUET)
+    client.delete_table("project.dataset.temp_raw", not_found_ok=True)
+    client.load_table_from_file(get_parquet(records), "project.dataset.temp_raw", job_config=config)
+    client.query(get_hash_query("`project.dataset.temp_raw`", "project.dataset.temp")).result()
+    return client.query(get_merge_query("project.dataset.temp", get_hash_columns(), table_ref=USGS_TABLE))
+
+
+def test_translate():
+    sql = translate("""
+    MERGE `p.d.t` AS t2 USING (SELECT geometry.coordinates[SAFE_OFFSET(0)] AS x FROM `p.d.raw`) AS t1
+    CREATE OR REPLACE TABLE `p.d.temp_2023-01-01_2023-02-01`
+    OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY))
+    SELECT FARM_FINGERPRINT(CONCAT('a')), CURRENT_TIMESTAMP()""")
+
+    assert 'MERGE INTO "d"."t" AS t2' in sql
+    assert "geometry.coordinates[1] AS x" in sql
+    assert '"d"."temp_2023-01-01_2023-02-01"\n' in sql
+    assert "OPTIONS" not in sql and "expiration_timestamp" not in sql
+    assert "farm_fingerprint(CONCAT('a')), CURRENT_TIMESTAMP" in sql
+
+
+def test_merge(client):
+    client.create_table(get_usgs_table(USGS_TABLE))
+
+    job = merge(client, [{"id": "a", "properties_mag": 1.0, "properties_updated": 1},
+                         {"id": "b", "properties_mag": 2.0, "properties_updated": 1}])
+    assert job.num_dml_affected_rows == 2
+
+    # a is updated, b is the same, c is new
+    merge(client, [{"id": "a", "properties_mag": 1.5, "properties_updated": 2},
+                   {"id": "b", "properties_mag": 2.0, "properties_updated": 1},
+                   {"id": "c", "properties_mag": 3.0, "properties_updated": 2}])
+
+    rows = client.query(f"SELECT id, properties_mag, is_valid, valid_to IS NULL AS open FROM `{USGS_TABLE}` "
+                        "ORDER BY id, properties_mag").result()
+    assert [tuple(row.values()) for row in rows] == [
+        ("a", 1.0, False, False), ("a", 1.5, True, True), ("b", 2.0, True, True), ("c", 3.0, True, True)]
+
+
+def test_missing_strings(client):
+    client.create_table(get_usgs_table(USGS_TABLE))
+    # a record of the former pandas load path, whose missing strings were stored as "nan" and "None"
+    merge(client, [{"id": "a", "properties_mag": 1.0, "properties_place": "nan", "properties_alert": "None",
+                    "properties_net": "us"}])
+
+    job = client.query(get_missing_strings_query(USGS_TABLE))
+    assert job.num_dml_affected_rows == 1
+    assert client.query(get_missing_strings_query(USGS_TABLE)).num_dml_affected_rows == 0
+
+    # the same event loaded with NULL strings doesn't get a new version
+    job = merge(client, [{"id": "a", "properties_mag": 1.0, "properties_net": "us"}])
+    rows = client.query(f"SELECT properties_place, properties_alert, properties_net, is_valid FROM `{USGS_TABLE}`")
+    assert [tuple(row.values()) for row in rows.result()] == [(None, None, "us", True)]
+
+
+def test_load_ndjson_and_flatten(client, tmp_path):
+    bucket = FakeBucket(str(tmp_path), "bucket")
+    client.connection.register_filesystem(FakeGCSFileSystem(str(tmp_path)))
+    feature = {"type": "Feature", "id": "a", "bbox": [1],
+               "properties": {"mag": 1.5, "time": 1672531200000, "magType": "ml", "unknown": "x"},
+               "geometry": {"type": "Point", "coordinates": [10.0, 20.0, 5.0]}}
+    bucket.blob("usgs/a.ndjson").upload_from_string(json.dumps(feature) + "\n")
+
+    config = bigquery.LoadJobConfig(schema=get_raw_schema(),
+                                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    job = client.load_table_from_uri(["gs://bucket/usgs/a.ndjson"], "project.dataset.raw", job_config=config)
+    client.query(get_flatten_query("project.dataset.raw", "project.dataset.temp")).result()
+
+    assert job.output_rows == 1
+    row = client.query("SELECT * FROM `project.dataset.temp`").result()[0]
+    assert (row["properties_magType"], row["geometry_longitude"], row["geometry_altitude"]) == ("ml", 10.0, 5.0)
+    assert row["hash_value"] is not None
+
+
+def test_delete_table(client):
+    client.query("CREATE TABLE `project.dataset.t` AS SELECT 1 AS x")
+    client.delete_table("project.dataset.t")
+
+    with pytest.raises(NotFound):
+        client.get_table("project.dataset.t")
+    client.delete_table("project.dataset.t", not_found_ok=True)
+
+
+def test_update_bigquery_table_time_revised(client):
+    # an event whose time is revised by more than MERGE_TIME_MARGIN is still matched by the merge
+    day = 19358  # 2023-01-01
+    config = bigquery.LoadJobConfig(schema=get_schema(), source_format=bigquery.SourceFormat.PARQUET)
+
+    def merge_records(records):
+        client.delete_table("project.dataset.temp_raw", not_found_ok=True)
+        client.load_table_from_file(get_parquet(records), "project.dataset.temp_raw", job_config=config)
+        client.query(get_hash_query("`project.dataset.temp_raw`", "project.dataset.temp")).result()
+        return update_bigquery_table.fn("project.dataset.temp")
+
+    with patch("flows.utils.gcs_to_bq.get_bigquery_client", return_value=client), \
+            patch("flows.utils.gcs_to_bq.get_run_logger", return_value=logging.getLogger()):
+        assert merge_records([{"id": "a", "properties_time": day * DAY_MILLIS, "properties_updated": 1}]) == [
+            "2022-12", "2023-01"]
+        months = merge_records([{"id": "a", "properties_time": (day + 40) * DAY_MILLIS, "properties_updated": 2}])
+
+    rows = client.query(f"SELECT properties_time, is_valid FROM `{PIPELINE_USGS_TABLE}` "
+                        "ORDER BY properties_updated").result()
+    assert [tuple(row.values()) for row in rows] == [(day * DAY_MILLIS, False), ((day + 40) * DAY_MILLIS, True)]
+    # the month of the former record changed too
+    assert months == ["2022-12", "2023-01", "2023-02"]
+
+
+def test_update_bigquery_table_moved_ids(client):
+    # only the ids without a valid record in the time range of the merge are looked up out of it
+    day = 19358  # 2023-01-01
+    config = bigquery.LoadJobConfig(schema=get_schema(), source_format=bigquery.SourceFormat.PARQUET)
+
+    def merge_records(records):
+        client.delete_table("project.dataset.temp_raw", not_found_ok=True)
+        client.load_table_from_file(get_parquet(records), "project.dataset.temp_raw", job_config=config)
+        client.query(get_hash_query("`project.dataset.temp_raw`", "project.dataset.temp")).result()
+        return update_bigquery_table.fn("project.dataset.temp")
+
+    with patch("flows.utils.gcs_to_bq.get_bigquery_client", return_value=client), \
+            patch("flows.utils.gcs_to_bq.get_run_logger", return_value=logging.getLogger()), \
+            patch("flows.utils.gcs_to_bq.get_moved_query", wraps=get_moved_query) as mock_moved_query:
+        merge_records([{"id": "a", "properties_time": day * DAY_MILLIS, "properties_updated": 1},
+                       {"id": "b", "properties_time": (day + 40) * DAY_MILLIS, "properties_updated": 1}])
+        mock_moved_query.reset_mock()
+
+        # every id has a valid record in the range: no lookup
+        merge_records([{"id": "a", "properties_time": day * DAY_MILLIS, "properties_updated": 2}])
+        mock_moved_query.assert_not_called()
+
+        # a new event and a moved one
+        months = merge_records([{"id": "b", "properties_time": day * DAY_MILLIS, "properties_updated": 2},
+                                {"id": "c", "properties_time": day * DAY_MILLIS, "properties_updated": 2}])
+        mock_moved_query.assert_called_once_with(ANY, ANY, ["b", "c"])
+
+    rows = client.query(f"SELECT id, COUNT(*) AS n FROM `{PIPELINE_USGS_TABLE}` WHERE is_valid = TRUE "
+                        "GROUP BY id ORDER BY id").result()
+    assert [tuple(row.values()) for row in rows] == [("a", 1), ("b", 1), ("c", 1)]
+    assert months == ["2022-12", "2023-01", "2023-02"]
@@ -0,0 +1,66 @@
+import io
+import json
+import pyarrow as pa
+from flows.utils.gcs_to_bq import get_arrow_schema
+from flows.utils.flatten import read_ndjson_table
+from flows.utils.parquet import flatten_feature, to_record_batch
+
+
+FEATURES = [
+    {
+        "type": "Feature",
+        "properties": {"mag": 4, "place": "10 km S of Tokyo, Japan", "time": 1672531200000,
+                       "updated": 1672531300000, "tz": 540, "felt": None, "nst": 12.0, "magType": "mb",
+                       "unknown": "ignored"},
+        "geometry": {"type": "Point", "coordinates": [139.7, 35.6, 10]},
+        "id": "us1"
+    },
+    {
+        "type": "Feature",
+        "properties": {"mag": None, "place": None, "time": -11676096000000, "tz": None},
+        "geometry": {"type": "Point", "coordinates": [1.0, 2.0]},
+        "id": "us2"
+    },
+    {"type": "Feature", "properties": {"mag": 1.5}, "geometry": None, "id": "us3"},
+]
+
+
+def to_ndjson(features) -> io.BytesIO:
+    return io.BytesIO("".join(json.dumps(feature) + "\n" for feature in features).encode())
+
+
+def test_read_ndjson_table():
+    table = read_ndjson_table(to_ndjson(FEATURES))
+
+    # same result as the row by row flattening of the Parquet writer
+    expected = pa.Table.from_batches([to_record_batch([flatten_feature(f) for f in FEATURES], get_arrow_schema())])
+    assert table.schema == get_arrow_schema()
+    assert table.to_pylist() == expected.to_pylist()
+
+
+def test_read_ndjson_table_values():
+    rows = read_ndjson_table(to_ndjson(FEATURES)).to_pylist()
+
+    assert rows[0]["properties_tz"] == "540"
+    assert rows[0]["properties_nst"] == 12
+    assert rows[0]["properties_time"] == 1672531200000
+    assert rows[1]["properties_place"] is None
+    assert rows[1]["geometry_altitude"] is None
+    assert rows[2]["geometry_longitude"] is None
+    assert rows[2]["properties_title"] is None
+
+
+def test_read_ndjson_table_blocks():
+    features = [dict(FEATURES[i % 3], id=f"us{i}") for i in range(300)]
+
+    table = read_ndjson_table(to_ndjson(features), block_size=1024)
+
+    assert table.num_rows == 300
+    assert table.column("id").to_pylist() == [f"us{i}" for i in range(300)]
+
+
+def test_read_ndjson_table_empty():
+    table = read_ndjson_table(io.BytesIO(b""))
+
+    assert table.num_rows == 0
+    assert table.schema == get_arrow_schema()
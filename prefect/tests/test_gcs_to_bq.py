@@ -0,0 +1,115 @@
+import pytest
+from datetime import date
+from flows.utils.gcs_to_bq import (get_flatten_query, get_hash_query, get_raw_schema, get_schema_field_names,
+                                   get_merge_query, get_batch_table_ref, get_usgs_table, get_months, month_range,
+                                   get_moved_query, get_unmatched_ids_query, is_plain_id,
+                                   USGS_TABLE)
+
+
+def test_get_raw_schema():
+    schema = {field.name: field for field in get_raw_schema()}
+
+    assert list(schema) == ["id", "type", "properties", "geometry"]
+    assert [field.name for field in schema["properties"].fields][:3] == ["mag", "place", "time"]
+    assert schema["geometry"].fields[1].mode == "REPEATED"
+
+
+def test_get_flatten_query():
+    query = get_flatten_query("project.dataset.raw", "project.dataset.temp")
+
+    assert "CREATE OR REPLACE TABLE `project.dataset.temp`" in query
+    assert "FROM\n        `project.dataset.raw`" in query
+    assert "AS hash_value" in query
+    assert "properties.magType AS properties_magType" in query
+    assert "geometry.coordinates[SAFE_OFFSET(2)] AS geometry_altitude" in query
+    # every column of the schema is selected
+    assert all(f"{field}," in query or f"AS {field}" in query for field in get_schema_field_names())
+
+
+def test_get_batch_table_ref():
+    table_ref = get_batch_table_ref([
+        "usgs/2023/02/earthquake_2023-02-01_2023-03-01.ndjson",
+        "usgs/2023/01/earthquake_2023-01-01_2023-02-01.parquet"])
+
+    assert table_ref.endswith(".usgs_temp_batch_2023-01-01_2023-03-01")
+
+    with pytest.raises(ValueError):
+        get_batch_table_ref(["usgs/invalid.ndjson"])
+
+
+def test_get_merge_query():
+    query = get_merge_query("project.dataset.temp", ["properties_mag", "properties_place"])
+
+    assert query.count("MERGE") == 1
+    assert f"MERGE `{USGS_TABLE}` AS t2" in query
+    assert "FROM\n            `project.dataset.temp`" in query
+    # the hash values are calculated at load time
+    assert "FARM_FINGERPRINT" not in query
+    assert "t2.hash_value != t1.hash_value" in query
+    assert "INSERT (id, properties_mag, properties_place, is_valid, valid_from, valid_to, hash_value)" in query
+    assert "VALUES (t1.id, t1.properties_mag, t1.properties_place, TRUE" in query
+
+
+def test_get_merge_query_with_time_range():
+    query = get_merge_query("project.dataset.temp", ["properties_time"], (1672531200000, 1675209600000))
+
+    assert "AND t2.properties_time BETWEEN 1672444800000 AND 1675296000000" in query
+    assert "AND t3.properties_time BETWEEN 1672444800000 AND 1675296000000" in query
+
+
+def test_get_usgs_table():
+    table = get_usgs_table("project.dataset.usgs_data")
+
+    assert table.range_partitioning.field == "properties_time"
+    assert table.clustering_fields == ["id", "is_valid"]
+    assert [field.name for field in table.schema][-4:] == ["is_valid", "valid_from", "valid_to", "hash_value"]
+
+
+def test_get_hash_query():
+    query = get_hash_query("`project.dataset.raw`", "project.dataset.temp")
+
+    assert "CREATE OR REPLACE TABLE `project.dataset.temp`" in query
+    assert "FARM_FINGERPRINT(CONCAT(IFNULL(CAST(type AS STRING), ''), " \
+           "IFNULL(CAST(properties_mag AS STRING), '')," in query
+    assert "CAST(id AS STRING)" not in query
+
+    query = get_hash_query("`project.dataset.raw`", "project.dataset.temp", append=True)
+
+    assert "INSERT INTO `project.dataset.temp`" in query
+
+
+def test_get_months():
+    day = (date(2023, 2, 15) - date(1970, 1, 1)).days
+    assert get_months([day]) == ["2023-02"]
+    # the margin of a day reaches the previous and the next month
+    assert get_months([day - 14, day + 13]) == ["2023-01", "2023-02", "2023-03"]
+    assert get_months([day], margin=0) == ["2023-02"]
+    assert get_months([]) == []
+    assert month_range("2022-11", "2023-02") == ["2022-11", "2022-12", "2023-01", "2023-02"]
+
+
+def test_get_moved_query():
+    query = get_moved_query("project.dataset.temp", (1672531200000, 1675209600000))
+
+    assert f"FROM `{USGS_TABLE}` AS t2" in query
+    assert "t2.id IN (SELECT id FROM `project.dataset.temp`)" in query
+    assert "t2.properties_time NOT BETWEEN 1672444800000 AND 1675296000000" in query
+
+    # the ids are listed to prune the blocks of the clustering by id
+    query = get_moved_query("project.dataset.temp", (1672531200000, 1675209600000), ids=["us7000abcd", "ci40123"])
+    assert "t2.id IN ('us7000abcd', 'ci40123')" in query
+    assert "project.dataset.temp" not in query
+
+
+def test_get_unmatched_ids_query():
+    query = get_unmatched_ids_query("project.dataset.temp", (1672531200000, 1675209600000))
+
+    assert "FROM `project.dataset.temp` AS t1" in query
+    assert f"FROM `{USGS_TABLE}`" in query
+    assert "AND properties_time BETWEEN 1672444800000 AND 1675296000000" in query
+    assert "t2.id IS NULL" in query
+
+
+def test_is_plain_id():
+    assert is_plain_id("us7000abcd")
+    assert not is_plain_id("a' OR TRUE OR '")
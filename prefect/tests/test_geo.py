@@ -0,0 +1,36 @@
+import pytest
+from flows.utils.geo import geohash, get_cell, encode_cell, decode_cell, get_cell_center, mag_bin
+
+
+@pytest.mark.parametrize("latitude, longitude, precision, expected", [
+    (57.64911, 10.40744, 11, "u4pruydqqvj"),
+    (57.64911, 10.40744, 3, "u4p"),
+    (19.4, -155.3, 3, "8e3"),
+    (-33.45, -70.66, 3, "66j"),
+    (0, 0, 1, "s"),
+    # the edges are in the last cell
+    (90, 180, 3, "zzz"),
+    (-90, -180, 3, "000"),
+    (None, 10.4, 3, None),
+])
+def test_geohash(latitude, longitude, precision, expected):
+    assert geohash(latitude, longitude, precision) == expected
+
+
+def test_decode_cell():
+    for latitude, longitude in [(57.64911, 10.40744), (-33.45, -70.66), (89.9, -179.9)]:
+        cell = get_cell(latitude, longitude, 5)
+        assert decode_cell(encode_cell(*cell, 5)) == cell
+
+
+def test_get_cell_center():
+    latitude, longitude = get_cell_center("u4p")
+    assert geohash(latitude, longitude, 3) == "u4p"
+    # a cell of precision 3 is 1.40625 degrees of latitude x 1.40625 degrees of longitude
+    assert latitude == pytest.approx(56.953125)
+    assert longitude == pytest.approx(10.546875)
+
+
+@pytest.mark.parametrize("mag, expected", [(4.7, 4.5), (5.0, 5.0), (0.2, 0.0), (-0.3, -0.5), (None, None)])
+def test_mag_bin(mag, expected):
+    assert mag_bin(mag) == expected
@@ -0,0 +1,61 @@
+import gzip
+import io
+import json
+import pytest
+from flows.utils.geojson_stream import iter_features, write_ndjson
+
+
+FEATURES = [
+    {"type": "Feature",
+     "properties": {"mag": 4.5, "place": "10 km S of Tōkyō, \"Japan\" ]", "time": 1672531200000},
+     "geometry": {"type": "Point", "coordinates": [139.7, 35.6, 10.0]},
+     "id": f"us{i}"}
+    for i in range(100)
+]
+
+COLLECTION = json.dumps({
+    "type": "FeatureCollection",
+    "metadata": {"title": "USGS Earthquakes", "count": len(FEATURES)},
+    "features": FEATURES,
+    "bbox": [139.7, 35.6, 10.0, 139.7, 35.6, 10.0]
+}, ensure_ascii=False).encode("utf-8")
+
+
+def split_bytes(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 100, 1024 * 1024])
+def test_iter_features(size):
+    assert list(iter_features(split_bytes(COLLECTION, size))) == FEATURES
+
+
+def test_iter_features_empty():
+    assert list(iter_features([b'{"type": "FeatureCollection", "features": []}'])) == []
+
+
+def test_iter_features_truncated():
+    with pytest.raises(ValueError):
+        list(iter_features(split_bytes(COLLECTION[:1000], 100)))
+
+
+def test_iter_features_not_collection():
+    with pytest.raises(ValueError):
+        list(iter_features([b'{"error": "bad request"}']))
+
+
+def test_write_ndjson():
+    file_obj = io.BytesIO()
+    count = write_ndjson(iter(FEATURES), file_obj)
+
+    assert count == len(FEATURES)
+    assert [json.loads(line) for line in file_obj.getvalue().splitlines()] == FEATURES
+
+
+def test_write_ndjson_compress():
+    file_obj = io.BytesIO()
+    count = write_ndjson(iter(FEATURES), file_obj, compress=True)
+
+    assert count == len(FEATURES)
+    lines = gzip.decompress(file_obj.getvalue()).splitlines()
+    assert [json.loads(line) for line in lines] == FEATURES
@@ -0,0 +1,136 @@
+from datetime import date
+from unittest.mock import patch
+import pytest
+from flows.utils.manifest import Manifest, load_manifest, get_manifest, checkpoint, record_failure
+
+
+def test_get_count():
+    manifest = Manifest("manifest.jsonl")
+    manifest.set_count(date(2020, 1, 1), date(2020, 2, 1), 12345)
+    manifest.set_count(date(2023, 5, 1), date(2023, 6, 1), 100)
+
+    today = date(2023, 6, 15)
+    assert manifest.get_count(date(2020, 1, 1), date(2020, 2, 1), today) == 12345
+    # too recent, may still change
+    assert manifest.get_count(date(2023, 5, 1), date(2023, 6, 1), today) is None
+    # not counted
+    assert manifest.get_count(date(2020, 2, 1), date(2020, 3, 1), today) is None
+
+
+def test_update_file():
+    manifest = Manifest("manifest.jsonl")
+    manifest.update_file("usgs/2020/01/a.ndjson", start_date=date(2020, 1, 1), end_date=date(2020, 2, 1),
+                         count=10, status="uploaded")
+    manifest.update_file("usgs/2020/01/a.ndjson", status="loaded")
+
+    record = manifest.get_file("usgs/2020/01/a.ndjson")
+    assert record["start_date"] == "2020-01-01"
+    assert record["count"] == 10
+    assert record["status"] == "loaded"
+    assert manifest.get_file("usgs/2020/02/b.ndjson") is None
+
+
+def test_dumps_loads():
+    manifest = Manifest("manifest.jsonl")
+    manifest.set_count(date(2020, 1, 1), date(2020, 2, 1), 12345)
+    manifest.update_file("usgs/2020/01/a.ndjson", count=10, status="uploaded")
+
+    loaded = Manifest.loads("manifest.jsonl", manifest.dumps())
+    assert loaded.records() == manifest.records()
+
+
+def test_load_manifest(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    assert load_manifest(path).records() == []
+
+    with open(path, "w") as file:
+        file.write('{"kind": "file", "file_path": "a", "status": "uploaded"}\n'
+                   '{"kind": "file", "file_path": "a", "status": "loaded"}\n')
+
+    # the last record wins
+    assert load_manifest(path).get_file("a")["status"] == "loaded"
+
+
+def test_has_status():
+    manifest = Manifest("manifest.jsonl")
+    manifest.set_status("a", "loaded", temp_ref="project.dataset.temp")
+    manifest.set_status("b", "merged")
+
+    assert manifest.has_status("a", "uploaded")
+    assert manifest.has_status("a", "loaded")
+    assert not manifest.has_status("a", "merged")
+    assert manifest.has_status("b", "merged")
+    assert not manifest.has_status("c", "uploaded")
+    assert manifest.has_status("b", "merged", since=manifest.get_file("b")["updated_at"])
+    assert not manifest.has_status("b", "merged", since="9999-01-01T00:00:00+00:00")
+
+
+def test_legacy_loaded_is_merged():
+    # "loaded" meant merged before the temp tables were recorded
+    manifest = Manifest.loads("manifest.jsonl", '{"kind": "file", "file_path": "a", "status": "loaded"}\n')
+
+    assert manifest.get_status("a") == "merged"
+
+
+def test_set_failed():
+    manifest = Manifest("manifest.jsonl")
+    manifest.set_status("a", "uploaded")
+    manifest.set_failed("a", "merge", ValueError("boom"))
+
+    record = manifest.get_file("a")
+    assert (record["status"], record["failed_stage"], record["error"]) == ("uploaded", "merge", "ValueError: boom")
+    assert manifest.get_failed_files() == ["a"]
+
+    # a success clears the failure
+    manifest.set_status("a", "merged")
+    assert manifest.get_file("a")["error"] is None
+    assert manifest.get_failed_files() == []
+
+
+def test_plan():
+    manifest = Manifest("manifest.jsonl")
+    chunks = [(date(2020, 1, 1), date(2020, 2, 1)), (date(2020, 2, 1), date(2020, 2, 15))]
+    planned_at = manifest.set_plan("1950-01-01_2023-06-01_split", chunks)
+
+    loaded = Manifest.loads("manifest.jsonl", manifest.dumps())
+    assert loaded.get_plan("1950-01-01_2023-06-01_split") == (chunks, planned_at)
+    assert loaded.get_plan("other") is None
+
+    # the plan of a completed run isn't resumed
+    loaded.complete_plan("1950-01-01_2023-06-01_split")
+    assert Manifest.loads("manifest.jsonl", loaded.dumps()).get_plan("1950-01-01_2023-06-01_split") is None
+
+
+def test_record_failure_and_checkpoint(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    with patch("flows.utils.manifest.MANIFEST_PATH", path), patch("flows.utils.manifest._manifest", None):
+        with pytest.raises(ValueError), record_failure(["a", "b"], "load"):
+            raise ValueError("boom")
+
+        # the failures were saved right away (the first checkpoint of the process)
+        assert load_manifest(path).get_file("b")["failed_stage"] == "load"
+
+        get_manifest().set_status("a", "merged")
+        checkpoint()
+        # saved less than CHECKPOINT_INTERVAL ago
+        assert load_manifest(path).get_status("a") is None
+        checkpoint(force=True)
+        assert load_manifest(path).get_status("a") == "merged"
+
+
+def test_get_changed_months():
+    manifest = Manifest("manifest.jsonl")
+    manifest.set_status("a", "merged", months=["2023-01", "2023-02"])
+    since = manifest.get_file("a")["updated_at"]
+    manifest.set_status("b", "merged", months=["2023-02", "2023-03"])
+    manifest.set_status("c", "uploaded")
+    manifest.set_watermark("dbt", since)
+
+    loaded = Manifest.loads("manifest.jsonl", manifest.dumps())
+    assert loaded.get_watermark("dbt") == since
+    assert loaded.get_changed_months(since) == ["2023-01", "2023-02", "2023-03"]
+    assert loaded.get_changed_months("9999-01-01T00:00:00+00:00") == []
+    # unknown before the first watermark or if a merged file has no months
+    assert loaded.get_changed_months(None) is None
+    loaded.set_status("d", "merged", months=None)
+    assert loaded.get_changed_months(since) is None
@@ -0,0 +1,122 @@
+import asyncio
+import io
+import json
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+from prefect import flow
+from prefect.client.orchestration import get_client
+from prefect.client.schemas.filters import ArtifactFilter, ArtifactFilterFlowRunId
+from flows.utils import metrics
+from flows.utils.metrics import (ChunkMetrics, MetricsRegistry, TimedIterator, TimedWriter, to_openmetrics,
+                                 get_chunk_metrics, emit_metrics)
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics():
+    metrics._metrics.clear()
+    yield
+    metrics._metrics.clear()
+
+
+def test_chunk_metrics_stage():
+    chunk = ChunkMetrics("usgs/2023/01/a.ndjson")
+    with chunk.stage("parse"):
+        time.sleep(0.01)
+    chunk.add("parse", "rows", 10)
+    chunk.add("parse", "rows", 5)
+    chunk.add("parse", "bytes", None)
+
+    stages = chunk.stages()
+    assert stages["parse"]["seconds"] >= 0.01
+    assert stages["parse"]["rows"] == 15
+    assert "bytes" not in stages["parse"]
+
+
+def test_chunk_metrics_add_job():
+    chunk = ChunkMetrics("a")
+    job = MagicMock(spec=["total_bytes_processed", "slot_millis", "num_dml_affected_rows"],
+                    total_bytes_processed=1024, slot_millis=300, num_dml_affected_rows=7)
+    chunk.add_job("merge", job)
+
+    assert chunk.stages()["merge"] == {"bq_bytes_processed": 1024, "bq_slot_ms": 300, "rows": 7}
+
+
+def test_timed_iterator_and_writer():
+    chunk = ChunkMetrics("a")
+    file_obj = io.BytesIO()
+    writer = TimedWriter(file_obj, chunk, "upload")
+
+    for data in TimedIterator([b"abc", b"de"], chunk, "fetch"):
+        writer.write(data)
+
+    assert file_obj.getvalue() == b"abcde"
+    assert writer.tell() == 5
+    assert chunk.get("fetch", "bytes") == 5
+    assert chunk.get("upload", "bytes") == 5
+    assert chunk.get("upload", "seconds") > 0
+
+
+def test_to_openmetrics():
+    registry = MetricsRegistry()
+    registry.get('usgs/"a".ndjson').add("fetch", "seconds", 1.5)
+    registry.get("b").add("fetch", "seconds", 2)
+    registry.get("b").add("merge", "bq_slot_ms", 300)
+
+    text = to_openmetrics(registry.records())
+
+    assert text.splitlines() == [
+        "# TYPE world_earthquake_pipeline_seconds gauge",
+        'world_earthquake_pipeline_seconds{chunk="usgs/\\"a\\".ndjson",stage="fetch"} 1.5',
+        'world_earthquake_pipeline_seconds{chunk="b",stage="fetch"} 2',
+        "# TYPE world_earthquake_pipeline_bq_slot_ms gauge",
+        'world_earthquake_pipeline_bq_slot_ms{chunk="b",stage="merge"} 300',
+        "# EOF",
+    ]
+
+
+def test_emit_metrics_jsonl(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    get_chunk_metrics("a").add("load", "rows", 3)
+
+    with patch.object(metrics, "METRICS_PATH", path), patch.object(metrics, "create_table_artifact") as mock_artifact:
+        records = emit_metrics()
+
+    with open(path) as file:
+        lines = [json.loads(line) for line in file]
+    assert lines == records
+    assert lines[0]["chunk"] == "a" and lines[0]["stage"] == "load" and lines[0]["rows"] == 3
+    mock_artifact.assert_called_once()
+    # the metrics are emitted once
+    assert emit_metrics() == []
+
+
+def test_emit_metrics_artifact():
+    @flow
+    def emit():
+        get_chunk_metrics("a").add("load", "rows", 3)
+        emit_metrics()
+
+    state = emit(return_state=True)
+
+    async def read_artifacts():
+        async with get_client() as client:
+            flow_run_id = ArtifactFilterFlowRunId(any_=[state.state_details.flow_run_id])
+            return await client.read_artifacts(artifact_filter=ArtifactFilter(flow_run_id=flow_run_id))
+
+    artifacts = asyncio.run(read_artifacts())
+    artifacts = [artifact for artifact in artifacts if artifact.key == metrics.ARTIFACT_KEY]
+    assert [artifact.type for artifact in artifacts] == ["table"]
+    table = json.loads(artifacts[0].data)
+    assert table[0]["chunk"] == "a" and table[0]["stage"] == "load" and table[0]["rows"] == 3
+
+
+def test_emit_metrics_openmetrics(tmp_path):
+    path = str(tmp_path / "metrics.prom")
+    get_chunk_metrics("a").add("load", "rows", 3)
+
+    with patch.object(metrics, "METRICS_PATH", path), patch.object(metrics, "create_table_artifact"):
+        emit_metrics()
+
+    with open(path) as file:
+        assert file.read().endswith("# EOF\n")
@@ -0,0 +1,53 @@
+import io
+import pyarrow.parquet as pq
+from flows.utils.gcs_to_bq import get_schema_field_names
+from flows.utils.parquet import flatten_feature, write_parquet
+
+
+FEATURE = {
+    "type": "Feature",
+    "properties": {"mag": 4, "place": "10 km S of Tokyo, Japan", "time": 1672531200000,
+                   "updated": 1672531300000, "tz": 540, "felt": None, "nst": 12.0, "magType": "mb"},
+    "geometry": {"type": "Point", "coordinates": [139.7, 35.6, 10]},
+    "id": "us1"
+}
+
+
+def test_flatten_feature():
+    row = flatten_feature(FEATURE)
+
+    assert row["id"] == "us1"
+    assert row["properties_magType"] == "mb"
+    assert row["geometry_longitude"] == 139.7
+    assert row["geometry_latitude"] == 35.6
+    assert row["geometry_altitude"] == 10
+
+
+def test_flatten_feature_without_altitude():
+    row = flatten_feature({"id": "us2", "geometry": {"type": "Point", "coordinates": [1.0, 2.0]}})
+
+    assert row["geometry_altitude"] is None
+
+
+def test_write_parquet():
+    file_obj = io.BytesIO()
+    count = write_parquet(iter([FEATURE] * 7), file_obj, batch_size=3)
+
+    table = pq.read_table(io.BytesIO(file_obj.getvalue()))
+    assert count == 7
+    assert table.num_rows == 7
+    assert table.column_names == get_schema_field_names()
+
+    row = table.slice(0, 1).to_pylist()[0]
+    assert row["properties_mag"] == 4.0
+    assert row["properties_tz"] == "540"
+    assert row["properties_nst"] == 12
+    assert row["properties_felt"] is None
+
+
+def test_write_parquet_empty():
+    file_obj = io.BytesIO()
+    count = write_parquet(iter([]), file_obj)
+
+    assert count == 0
+    assert pq.read_table(io.BytesIO(file_obj.getvalue())).num_rows == 0
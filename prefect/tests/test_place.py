@@ -0,0 +1,35 @@
+import pytest
+from flows.utils.place import get_place_orig, normalize_place
+
+
+@pytest.mark.parametrize("place, place_orig", [
+    ("10 km SSW of Volcano, Hawaii", "hawaii"),
+    ("Fox Islands, Aleutian Islands, Alaska", "aleutian islands, alaska"),
+    ("Sea of Okhotsk", "sea of okhotsk"),
+    (None, None),
+])
+def test_get_place_orig(place, place_orig):
+    assert get_place_orig(place) == place_orig
+
+
+@pytest.mark.parametrize("place_orig, place", [
+    ("hawaii", "hawaii"),
+    ("south of the fiji islands", "fiji"),
+    ("off the east coast of honshu", "honshu"),
+    ("near the coast of central peru", "peru"),
+    ("south of panama", "panama"),
+    ("sea of okhotsk", "okhotsk"),
+    ("pakistan-afghanistan border region", "pakistan-afghanistan"),
+    ("andreanof islands region", "andreanof islands"),
+    ("ca", "california"),
+    ("1960 great chilean earthquake (valdivia earthquake)", "chile"),
+    ("northern mid-atlantic ridge", "northern mid-atlantic ridge"),
+    (None, None),
+])
+def test_normalize_place(place_orig, place):
+    assert normalize_place(place_orig) == place
+
+
+def test_normalize_place_ascii():
+    # \w of RE2 doesn't match accented letters: no island name is extracted
+    assert normalize_place("of the é island") == "of the é island"
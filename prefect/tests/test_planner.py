@@ -0,0 +1,136 @@
+from datetime import date, timedelta
+from flows.utils.planner import Chunk, plan_ranges, get_period_dates, get_unit_dates, merge_chunks
+
+
+def make_count_fn(per_day, calls=None):
+    def count_fn(start_date, end_date):
+        if calls is not None:
+            calls.append((start_date, end_date))
+        count = 0
+        current_date = start_date
+        while current_date < end_date:
+            count += per_day(current_date)
+            current_date += timedelta(days=1)
+        return count
+    return count_fn
+
+
+def test_merge_chunks():
+    chunks = [Chunk(date(2020, 1, 1), date(2020, 2, 1), 5000),
+              Chunk(date(2020, 2, 1), date(2020, 3, 1), 5000),
+              Chunk(date(2020, 3, 1), date(2020, 4, 1), 15000)]
+
+    assert merge_chunks(chunks, 20000) == [
+        Chunk(date(2020, 1, 1), date(2020, 3, 1), 10000),
+        Chunk(date(2020, 3, 1), date(2020, 4, 1), 15000)]
+
+
+def test_plan_ranges_under_limit():
+    calls = []
+    chunks = plan_ranges(date(1950, 1, 1), date(1970, 1, 1), make_count_fn(lambda d: 1, calls))
+
+    # one range per decade
+    assert chunks == [Chunk(date(1950, 1, 1), date(1960, 1, 1), 3652), Chunk(date(1960, 1, 1), date(1970, 1, 1), 3653)]
+    assert len(calls) == 2
+
+
+def test_plan_ranges_empty():
+    assert plan_ranges(date(2023, 1, 1), date(2023, 1, 1), make_count_fn(lambda d: 1)) == []
+
+
+def test_plan_ranges_never_exceeds_limit():
+    def per_day(d):
+        if d.year < 1970:
+            return 5
+        if date(2011, 3, 11) <= d < date(2011, 3, 14):
+            return 9000
+        return 700
+
+    start = date(1950, 1, 1)
+    end = date(2020, 1, 1)
+    chunks = plan_ranges(start, end, make_count_fn(per_day))
+
+    assert chunks[0].start_date == start
+    assert chunks[-1].end_date == end
+    assert all(a.end_date == b.start_date for a, b in zip(chunks[:-1], chunks[1:]))
+    assert all(chunk.count <= 20000 for chunk in chunks)
+    # sparse era is fetched in a few requests
+    assert len([chunk for chunk in chunks if chunk.end_date <= date(1970, 1, 1)]) <= 2
+    # the month of the swarm is split at its days
+    assert Chunk(date(2011, 3, 12), date(2011, 3, 16), 19400) in chunks
+    assert Chunk(date(2011, 3, 16), date(2011, 4, 1), 11200) in chunks
+
+
+def test_plan_ranges_stable():
+    # the ranges of the history don't depend on the end date, only the ones of the last month change
+    count_fn = make_count_fn(lambda d: 500 if d.year >= 2000 else 20)
+    chunks = plan_ranges(date(1950, 1, 1), date(2023, 6, 1), count_fn)
+
+    for end in [date(2023, 6, 2), date(2023, 6, 20), date(2024, 1, 1), date(2030, 3, 17)]:
+        later = plan_ranges(date(1950, 1, 1), end, count_fn)
+        assert later[:len(chunks)] == chunks
+
+    assert all(chunk.count <= 20000 for chunk in chunks)
+    assert plan_ranges(date(1950, 1, 1), date(2023, 6, 15), count_fn)[-1] == Chunk(
+        date(2023, 6, 1), date(2023, 6, 15), 7000)
+
+
+def test_plan_ranges_not_anchored():
+    # e.g. the events updated since the last run: one range, one count
+    calls = []
+    chunks = plan_ranges(date(1568, 1, 1), date(2023, 6, 2), make_count_fn(lambda d: d >= date(2023, 5, 1), calls),
+                         anchored=False)
+
+    assert chunks == [Chunk(date(1568, 1, 1), date(2023, 6, 2), 32)]
+    assert len(calls) == 1
+
+    # over the limit: cut, then merged across the calendar units
+    chunks = plan_ranges(date(2020, 1, 1), date(2023, 6, 2), make_count_fn(lambda d: 100), anchored=False)
+    assert all(chunk.count <= 20000 for chunk in chunks)
+    assert [chunk.end_date for chunk in chunks][:-1] == [chunk.start_date for chunk in chunks][1:]
+    assert len(chunks) == 7
+
+
+def test_plan_ranges_day_over_limit():
+    chunks = plan_ranges(date(2023, 1, 1), date(2023, 1, 3), make_count_fn(lambda d: 30000))
+
+    assert chunks == [Chunk(date(2023, 1, 1), date(2023, 1, 2), 30000),
+                      Chunk(date(2023, 1, 2), date(2023, 1, 3), 30000)]
+
+
+def test_get_period_dates():
+    assert get_period_dates(date(1568, 1, 1), date(1600, 1, 1), 10) == [
+        date(1570, 1, 1), date(1580, 1, 1), date(1590, 1, 1)]
+    assert get_period_dates(date(1940, 1, 1), date(1950, 1, 1), 10) == []
+    assert get_period_dates(date(1945, 6, 1), date(1950, 6, 1), 1) == [
+        date(1946, 1, 1), date(1947, 1, 1), date(1948, 1, 1), date(1949, 1, 1), date(1950, 1, 1)]
+
+
+def test_plan_ranges_period_years():
+    # sparse: the whole period is within the limit, but no range spans two decades
+    count_fn = make_count_fn(lambda d: 1)
+    chunks = plan_ranges(date(1568, 1, 1), date(1600, 1, 1), count_fn, period_years=10)
+
+    assert [(chunk.start_date, chunk.end_date) for chunk in chunks] == [
+        (date(1568, 1, 1), date(1570, 1, 1)), (date(1570, 1, 1), date(1580, 1, 1)),
+        (date(1580, 1, 1), date(1590, 1, 1)), (date(1590, 1, 1), date(1600, 1, 1))]
+    assert sum(chunk.count for chunk in chunks) == (date(1600, 1, 1) - date(1568, 1, 1)).days
+
+
+def test_plan_ranges_period_years_dense():
+    # a decade over the limit is still split by the counts
+    count_fn = make_count_fn(lambda d: 10 if d.year >= 1940 else 0)
+    chunks = plan_ranges(date(1930, 1, 1), date(1950, 1, 1), count_fn, limit=20000, period_years=10)
+
+    assert chunks[0] == Chunk(date(1930, 1, 1), date(1940, 1, 1), 0)
+    assert all(chunk.count <= 20000 for chunk in chunks)
+    assert len(chunks) > 2
+    assert chunks[-1].end_date == date(1950, 1, 1)
+
+
+def test_get_unit_dates():
+    assert get_unit_dates(date(2019, 6, 1), date(2023, 1, 1), 1) == [
+        date(2020, 1, 1), date(2021, 1, 1), date(2022, 1, 1)]
+    assert get_unit_dates(date(2023, 1, 15), date(2023, 4, 1), 2) == [date(2023, 2, 1), date(2023, 3, 1)]
+    assert get_unit_dates(date(2023, 1, 30), date(2023, 2, 2), 3) == [date(2023, 1, 31), date(2023, 2, 1)]
+    assert get_unit_dates(date(1568, 1, 1), date(1600, 1, 1), 0, period_years=20) == [date(1580, 1, 1)]
@@ -0,0 +1,90 @@
+import pytest
+from unittest.mock import patch
+from flows.run_dbt import run_dbt, get_changed_months, get_dbt_command, get_unbuilt_months, DBT_WATERMARK
+from flows.utils.duckdb_warehouse import DuckDBClient
+from flows.utils.gcs_to_bq import DAY_MILLIS
+from flows.utils.manifest import Manifest
+
+USGS_TABLE = "project.dataset.usgs_data"
+MART_TABLE = "project.mart.mart_earthquake"
+
+
+@pytest.fixture
+def client():
+    client = DuckDBClient()
+    yield client
+    client.close()
+
+
+def test_get_changed_months():
+    manifest = Manifest("manifest.jsonl")
+    assert get_changed_months(["2023-06"]) == ["2023-06"]
+    assert get_changed_months(None) is None
+    # no watermark yet: the manifest doesn't know what the last build missed
+    assert get_changed_months(["2023-06"], manifest) == ["2023-06"]
+
+    manifest.set_watermark(DBT_WATERMARK, "2023-06-01T05:00:00+00:00")
+    manifest.set_status("a", "merged", months=["2023-05"])
+    assert get_changed_months(["2023-06"], manifest) == ["2023-05", "2023-06"]
+    assert get_changed_months(None, manifest) == ["2023-05"]
+
+    manifest.set_status("b", "merged", months=None)
+    assert get_changed_months(["2023-06"], manifest) is None
+
+
+def test_get_dbt_command():
+    assert get_dbt_command(changed_months=["2023-05", "2023-06"]).endswith(
+        """--select source:earthquake_raw.usgs_data+ --vars '{"is_test_run": false, "changed_months": """
+        """["2023-05", "2023-06"]}'""")
+    assert "--select" not in get_dbt_command()
+    assert get_dbt_command(full_refresh=True, changed_months=["2023-05"]).endswith(
+        """--vars '{"is_test_run": false}' --full-refresh""")
+
+
+@patch("flows.run_dbt.get_manifest", return_value=None)
+@patch("flows.run_dbt.DbtCoreOperation")
+def test_run_dbt_nothing_changed(mock_dbt_core_operation, mock_get_manifest):
+    assert run_dbt(changed_months=[]) is None
+    mock_dbt_core_operation.assert_not_called()
+
+
+def test_get_unbuilt_months(client):
+    day = 19358  # 2023-01-01
+    assert get_unbuilt_months(client, USGS_TABLE, MART_TABLE) is None
+
+    client.query(f"""
+    CREATE TABLE `{USGS_TABLE}` AS
+    SELECT * FROM (VALUES
+    ({day * DAY_MILLIS}, 1, TRUE),
+    ({(day + 40) * DAY_MILLIS}, 2, TRUE),
+    ({(day + 40) * DAY_MILLIS}, 1, FALSE),
+    ({-10000 * DAY_MILLIS}, 1, TRUE)
+    ) AS t(properties_time, properties_updated, is_valid)""")
+    client.query(f"""
+    CREATE TABLE `{MART_TABLE}` AS
+    SELECT epoch_ms(time) AS time, epoch_ms(updated) AS updated FROM (VALUES
+    ({day * DAY_MILLIS}, 1),
+    ({(day + 40) * DAY_MILLIS}, 1),
+    ({(day + 70) * DAY_MILLIS}, 1)
+    ) AS t(time, updated)""")
+    # 2023-02: the update of the event isn't built, 2023-03: the former time of a moved event,
+    # the events before 1950 aren't in the mart
+    assert get_unbuilt_months(client, USGS_TABLE, MART_TABLE) == ["2023-02", "2023-03"]
+
+
+@patch("flows.run_dbt.get_manifest", return_value=None)
+@patch("flows.run_dbt.get_bigquery_client")
+@patch("flows.run_dbt.get_unbuilt_months", return_value=["2023-02"])
+@patch("flows.run_dbt.DbtCliProfile")
+@patch("flows.run_dbt.DbtCoreOperation")
+def test_run_dbt_catch_up(mock_dbt_core_operation, mock_dbt_cli_profile, mock_get_unbuilt_months,
+                          mock_get_bigquery_client, mock_get_manifest):
+    run_dbt(changed_months=["2023-06"], catch_up=True)
+    command = mock_dbt_core_operation.call_args.kwargs["commands"][0]
+    assert command == get_dbt_command(changed_months=["2023-02", "2023-06"])
+
+    # nothing changed and nothing unbuilt
+    mock_get_unbuilt_months.return_value = []
+    mock_dbt_core_operation.reset_mock()
+    assert run_dbt(catch_up=True) is None
+    mock_dbt_core_operation.assert_not_called()
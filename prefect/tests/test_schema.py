@@ -0,0 +1,39 @@
+import pyarrow as pa
+from flows.utils.schema import (get_schema, get_usgs_table_schema, get_dataframe_schema, get_arrow_schema,
+                                get_raw_schema, get_schema_field_names, get_hash_columns, get_scd2_field_names)
+
+
+def test_derived_schemas_are_in_sync():
+    names = get_schema_field_names()
+
+    assert [field.name for field in get_schema()] == names
+    assert list(get_dataframe_schema()) == names
+    assert get_arrow_schema().names == names
+    assert get_hash_columns() == names[1:]
+    assert [field.name for field in get_usgs_table_schema()] == names + get_scd2_field_names()
+
+    properties = {field.name: field for field in get_raw_schema()}["properties"]
+    assert [f"properties_{field.name}" for field in properties.fields] == [
+        name for name in names if name.startswith("properties_")]
+
+
+def test_types():
+    schema = {field.name: field for field in get_schema()}
+
+    assert schema["id"].mode == "REQUIRED"
+    assert schema["properties_time"].field_type == "INTEGER"
+    assert get_dataframe_schema()["properties_time"] == "Int64"
+    assert get_arrow_schema().field("properties_mag").type == pa.float64()
+    assert not get_arrow_schema().field("id").nullable
+
+
+def test_getters_return_copies():
+    schema = get_schema()
+    schema.append(schema[0])
+    get_schema_field_names().append("x")
+    get_dataframe_schema()["id"] = "object"
+
+    assert len(get_schema()) == len(get_schema_field_names())
+    assert "x" not in get_schema_field_names()
+    assert get_dataframe_schema()["id"] == "str"
+    assert get_schema()[0] is schema[0]
@@ -0,0 +1,108 @@
+from unittest.mock import patch, MagicMock
+import pytest
+import requests
+from flows.utils.usgs_client import UsgsClient, TokenBucket, get_retry_after, get_backoff, USGS_COUNT_URL
+
+
+def make_response(status_code, headers=None, json_data=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = json_data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    return response
+
+
+def make_client(responses):
+    client = UsgsClient(rate=1000, burst=1000, max_retries=3)
+    client.session = MagicMock()
+    client.session.get.side_effect = responses
+    return client
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+    for _ in range(6):
+        bucket.acquire()
+    # 2 requests of the burst, then 4 requests at 2 per second
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_token_bucket_pause():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=100, capacity=1, clock=clock, sleep=clock.sleep)
+    bucket.pause(30)
+    bucket.acquire()
+    assert clock.now >= 30
+
+
+def test_get_retry_after():
+    assert get_retry_after(make_response(429, {"Retry-After": "7"})) == 7
+    assert get_retry_after(make_response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert get_retry_after(make_response(429, {"Retry-After": "soon"})) is None
+    assert get_retry_after(make_response(429)) is None
+
+
+def test_get_backoff():
+    for attempt in range(10):
+        assert 0 <= get_backoff(attempt, base=1, maximum=60) <= min(60, 2 ** attempt)
+
+
+@patch("flows.utils.usgs_client.time.sleep")
+def test_get_retries_with_backoff(mock_sleep):
+    client = make_client([make_response(503), make_response(502), make_response(200, json_data=42)])
+
+    assert client.count({"starttime": "2023-01-01"}) == 42
+    assert client.session.get.call_count == 3
+    assert mock_sleep.call_count == 2
+    client.session.get.assert_called_with(USGS_COUNT_URL, params={"starttime": "2023-01-01"},
+                                          stream=False, timeout=client.timeout)
+
+
+@patch("flows.utils.usgs_client.time.sleep")
+def test_get_honors_retry_after(mock_sleep):
+    client = make_client([make_response(429, {"Retry-After": "3"}), make_response(200, json_data=1)])
+    client.bucket = MagicMock()
+
+    assert client.count({}) == 1
+    client.bucket.pause.assert_called_once_with(3.0)
+    mock_sleep.assert_not_called()
+
+
+@patch("flows.utils.usgs_client.time.sleep")
+def test_get_raises_after_retries(mock_sleep):
+    client = make_client([make_response(503) for _ in range(4)])
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get(USGS_COUNT_URL)
+    assert client.session.get.call_count == 4
+
+
+@patch("flows.utils.usgs_client.time.sleep")
+def test_get_does_not_retry_client_errors(mock_sleep):
+    client = make_client([make_response(400)])
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get(USGS_COUNT_URL)
+    assert client.session.get.call_count == 1
+
+
+@patch("flows.utils.usgs_client.time.sleep")
+def test_get_retries_connection_errors(mock_sleep):
+    client = make_client([requests.exceptions.ConnectionError(), make_response(200, json_data=5)])
+
+    assert client.count({}) == 5
+    assert client.session.get.call_count == 2
@@ -0,0 +1,38 @@
+import json
+import pytest
+from benchmarks.offline.fake_gcs import FakeBucket
+from flows.utils.web_to_gcs import write_features_to_gcs, UPLOAD_SUFFIX
+
+FILE_PATH = "usgs/2023/01/earthquake_2023-01-01_2023-02-01.ndjson"
+
+
+def features(n, fail_at=None):
+    for i in range(n):
+        if i == fail_at:
+            raise ValueError("stream failed")
+        yield {"type": "Feature", "id": f"id{i}", "properties": {"mag": i}}
+
+
+def test_write_features_to_gcs(tmp_path):
+    bucket = FakeBucket(str(tmp_path))
+
+    blob, count = write_features_to_gcs(features(3), FILE_PATH, bucket)
+
+    assert count == 3
+    assert blob.name == FILE_PATH
+    with bucket.blob(FILE_PATH).open("rb") as file:
+        assert [json.loads(line)["id"] for line in file] == ["id0", "id1", "id2"]
+    assert not bucket.blob(FILE_PATH + UPLOAD_SUFFIX).exists()
+
+
+def test_write_features_to_gcs_failure_keeps_file(tmp_path):
+    bucket = FakeBucket(str(tmp_path))
+    write_features_to_gcs(features(3), FILE_PATH, bucket)
+
+    # a failed refresh (replace=True) doesn't replace or delete the file of the former run
+    with pytest.raises(ValueError, match="stream failed"):
+        write_features_to_gcs(features(5, fail_at=2), FILE_PATH, bucket)
+
+    with bucket.blob(FILE_PATH).open("rb") as file:
+        assert len(file.readlines()) == 3
+    assert not bucket.blob(FILE_PATH + UPLOAD_SUFFIX).exists()
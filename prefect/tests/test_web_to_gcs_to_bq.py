@@ -2,8 +2,19 @@ from unittest.mock import patch, call, MagicMock
 import pytest
 import requests
 import logging
-from datetime import date
-from flows.utils.web_to_gcs_to_bq import web_to_gcs_to_bq, check_count
+from datetime import date, datetime, timezone
+from flows.utils.web_to_gcs_to_bq import (web_to_gcs_to_bq, check_count, plan_chunks, run_chunks, merge_files,
+                                          get_run_plan)
+from flows.utils.web_to_gcs import get_file_path
+from flows.utils.manifest import Manifest
+from flows.utils.usgs_client import USGS_COUNT_URL
+
+# options passed from web_to_gcs_to_bq to process_data by default
+DEFAULT_OPTIONS = {"compress": False, "file_format": "ndjson", "load_mode": "dataframe", "updated_after": None}
+
+
+def count_per_day(start_date, end_date):
+    return 1000 * (end_date - start_date).days
 
 
 @patch("flows.utils.web_to_gcs_to_bq.check_count", return_value=10000)
@@ -13,11 +24,14 @@ def test_web_to_gcs_to_bq_over_month_with_split(mock_process_data, mock_check_co
     end = date(2023, 2, 15)
     web_to_gcs_to_bq(start, end, False, True)
 
-    assert mock_check_count.call_args_list == [
-        call(date(2023, 1, 15), date(2023, 2, 1)), call(date(2023, 2, 1), date(2023, 2, 15))]
+    # the range ends within a month so it is cut at the months (the ranges stay the same when the end moves)
+    assert mock_check_count.call_args_list == [call(date(2023, 1, 15), date(2023, 2, 15)),
+                                               call(date(2023, 1, 15), date(2023, 2, 1)),
+                                               call(date(2023, 2, 1), date(2023, 2, 15))]
 
-    assert mock_process_data.call_args_list == [call(date(2023, 1, 15), date(
-        2023, 2, 1), False, True), call(date(2023, 2, 1), date(2023, 2, 15), False, True)]
+    assert mock_process_data.call_args_list == [
+        call(date(2023, 1, 15), date(2023, 2, 1), False, True, **DEFAULT_OPTIONS),
+        call(date(2023, 2, 1), date(2023, 2, 15), False, True, **DEFAULT_OPTIONS)]
 
 
 @patch("flows.utils.web_to_gcs_to_bq.check_count", return_value=10000)
@@ -27,10 +41,11 @@ def test_web_to_gcs_to_bq_split_time_false(mock_process_data, mock_check_count):
     end = date(2023, 2, 15)
     web_to_gcs_to_bq(start, end, False, False)
 
-    assert mock_process_data.call_args_list == [call(date(2023, 1, 15), date(2023, 2, 15), False, False)]
+    assert mock_process_data.call_args_list == [
+        call(date(2023, 1, 15), date(2023, 2, 15), False, False, **DEFAULT_OPTIONS)]
 
 
-@patch("flows.utils.web_to_gcs_to_bq.check_count", return_value=20001)
+@patch("flows.utils.web_to_gcs_to_bq.check_count", side_effect=count_per_day)
 @patch("flows.utils.web_to_gcs_to_bq.process_data")
 def test_web_to_gcs_to_bq_over_limit(mock_process_data, mock_check_count):
     start = date(2023, 1, 1)
@@ -38,11 +53,9 @@ def test_web_to_gcs_to_bq_over_limit(mock_process_data, mock_check_count):
 
     web_to_gcs_to_bq(start, end, False, True)
 
-    calls = [call(date(2023, 1, 1), date(2023, 1, 8), False, True),
-             call(date(2023, 1, 8), date(2023, 1, 15), False, True),
-             call(date(2023, 1, 15), date(2023, 1, 22), False, True),
-             call(date(2023, 1, 22), date(2023, 1, 29), False, True),
-             call(date(2023, 1, 29), date(2023, 2, 1), False, True)]
+    # the month over the limit is split at its days, merged again up to the limit
+    calls = [call(date(2023, 1, 1), date(2023, 1, 21), False, True, **DEFAULT_OPTIONS),
+             call(date(2023, 1, 21), date(2023, 2, 1), False, True, **DEFAULT_OPTIONS)]
 
     assert mock_process_data.call_args_list == calls
 
@@ -55,13 +68,15 @@ def test_web_to_gcs_to_bq_on_limit(mock_process_data, mock_check_count):
 
     web_to_gcs_to_bq(start, end, False, True)
 
-    assert mock_process_data.call_args_list == [call(date(2023, 1, 1), date(2023, 2, 1), False, True)]
+    assert mock_process_data.call_args_list == [
+        call(date(2023, 1, 1), date(2023, 2, 1), False, True, **DEFAULT_OPTIONS)]
 
 
-@patch('requests.get')
+@patch("flows.utils.web_to_gcs_to_bq.get_client")
 @patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
-def test_check_count_url(mock_logger, mock_get):
+def test_check_count_url(mock_logger, mock_get_client):
     mock_logger.return_value = logging.getLogger()
+    mock_get = mock_get_client.return_value.get
     mock_get.return_value.json.return_value = 12345
 
     start_date = date(2023, 1, 1)
@@ -70,15 +85,35 @@ def test_check_count_url(mock_logger, mock_get):
     assert count == 12345
 
     mock_get.assert_called_with(
-        'https://earthquake.usgs.gov/fdsnws/event/1/count',
+        USGS_COUNT_URL,
         params={'starttime': start_date, 'endtime': end_date}
     )
 
 
-@patch("requests.get")
+@patch("flows.utils.web_to_gcs_to_bq.get_client")
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_check_count_updated_after(mock_logger, mock_get_client):
+    mock_logger.return_value = logging.getLogger()
+    mock_get = mock_get_client.return_value.get
+    mock_get.return_value.json.return_value = 123
+
+    start_date = date(1568, 1, 1)
+    end_date = date(2023, 6, 2)
+    updated_after = datetime(2023, 6, 1, 10, 30, 15, 250000, tzinfo=timezone.utc)
+    count = check_count.fn(start_date, end_date, updated_after)
+    assert count == 123
+
+    mock_get.assert_called_with(
+        USGS_COUNT_URL,
+        params={'starttime': start_date, 'endtime': end_date, 'updatedafter': '2023-06-01T10:30:15.250'}
+    )
+
+
+@patch("flows.utils.web_to_gcs_to_bq.get_client")
 @patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
-def test_check_count_success(mock_logger, mock_get):
+def test_check_count_success(mock_logger, mock_get_client):
     mock_logger.return_value = logging.getLogger()
+    mock_get = mock_get_client.return_value.get
     mock_get.return_value.json.return_value = 12345
     start_date = date(2023, 1, 1)
     end_date = date(2023, 2, 1)
@@ -87,13 +122,12 @@ def test_check_count_success(mock_logger, mock_get):
     assert count == 12345
 
 
-@patch("requests.get")
+@patch("flows.utils.web_to_gcs_to_bq.get_client")
 @patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
-def test_check_count_error_status(mock_logger, mock_get):
+def test_check_count_error_status(mock_logger, mock_get_client):
     mock_logger.return_value = logging.getLogger()
-    mock_response = MagicMock()
-    mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError()
-    mock_get.return_value = mock_response
+    mock_get = mock_get_client.return_value.get
+    mock_get.side_effect = requests.exceptions.HTTPError()
 
     with pytest.raises(requests.exceptions.HTTPError):
         start_date = date(2023, 1, 1)
@@ -101,10 +135,11 @@ def test_check_count_error_status(mock_logger, mock_get):
         check_count.fn(start_date, end_date)
 
 
-@patch("requests.get")
+@patch("flows.utils.web_to_gcs_to_bq.get_client")
 @patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
-def test_check_count_invalid_json(mock_logger, mock_get):
+def test_check_count_invalid_json(mock_logger, mock_get_client):
     mock_logger.return_value = logging.getLogger()
+    mock_get = mock_get_client.return_value.get
     mock_response = MagicMock()
     mock_response.json.side_effect = ValueError()
     mock_get.return_value = mock_response
@@ -113,3 +148,227 @@ def test_check_count_invalid_json(mock_logger, mock_get):
         start_date = date(2023, 1, 1)
         end_date = date(2023, 2, 1)
         check_count.fn(start_date, end_date)
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", side_effect=count_per_day)
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_plan_chunks(mock_logger, mock_check_count):
+    mock_logger.return_value = logging.getLogger()
+    chunks = plan_chunks(date(2023, 1, 15), date(2023, 2, 15))
+
+    assert chunks == [(date(2023, 1, 15), date(2023, 2, 1)),
+                      (date(2023, 2, 1), date(2023, 2, 15))]
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", return_value=120)
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_plan_chunks_updated_after(mock_logger, mock_check_count):
+    # the daily incremental run: the events of any time updated since the last run, in one chunk
+    updated_after = datetime(2023, 6, 1, 5, 0, tzinfo=timezone.utc)
+    chunks = plan_chunks(date(1568, 1, 1), date(2023, 6, 2), updated_after=updated_after)
+
+    assert chunks == [(date(1568, 1, 1), date(2023, 6, 2))]
+    mock_check_count.assert_called_once_with(date(1568, 1, 1), date(2023, 6, 2), updated_after)
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", return_value=10000)
+def test_plan_chunks_split_time_false(mock_check_count):
+    chunks = plan_chunks(date(2023, 1, 15), date(2023, 2, 15), split_time=False)
+
+    assert chunks == [(date(2023, 1, 15), date(2023, 2, 15))]
+    mock_check_count.assert_not_called()
+
+
+def fake_process_data(start_date, end_date, replace, split_time, **options):
+    return f"{start_date}_{end_date}"
+
+
+@patch("flows.utils.web_to_gcs_to_bq.process_data", side_effect=fake_process_data)
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_run_chunks_concurrent(mock_logger, mock_process_data):
+    mock_logger.return_value = logging.getLogger()
+    chunks = [(date(2023, 1, day), date(2023, 1, day + 1)) for day in range(1, 20)]
+
+    results = run_chunks(chunks, False, True, max_workers=4)
+
+    assert results == [f"{start}_{end}" for start, end in chunks]
+    assert sorted(mock_process_data.call_args_list) == sorted(
+        [call(start, end, False, True) for start, end in chunks])
+
+
+def failing_process_data(start_date, end_date, replace, split_time):
+    if start_date.day % 2 == 0:
+        raise ValueError(f"failed: {start_date}")
+    return f"{start_date}_{end_date}"
+
+
+@patch("flows.utils.web_to_gcs_to_bq.process_data", side_effect=failing_process_data)
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_run_chunks_concurrent_error(mock_logger, mock_process_data):
+    mock_logger.return_value = logging.getLogger()
+    chunks = [(date(2023, 1, day), date(2023, 1, day + 1)) for day in range(1, 8)]
+
+    with pytest.raises(ValueError, match="failed: 2023-01-02"):
+        run_chunks(chunks, False, True, max_workers=3)
+
+    # the other chunks are still processed
+    assert mock_process_data.call_count == len(chunks)
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", side_effect=count_per_day)
+@patch("flows.utils.web_to_gcs_to_bq.fetch_data", side_effect=fake_process_data)
+@patch("flows.utils.web_to_gcs_to_bq.process_data")
+@patch("flows.utils.web_to_gcs_to_bq.gcs_to_bq_batch")
+def test_web_to_gcs_to_bq_batch(mock_gcs_to_bq_batch, mock_process_data, mock_fetch_data, mock_check_count):
+    start = date(2023, 1, 1)
+    end = date(2023, 2, 15)
+
+    file_paths = web_to_gcs_to_bq(start, end, False, True, batch_size=2)
+
+    mock_process_data.assert_not_called()
+    assert file_paths == ["2023-01-01_2023-01-21", "2023-01-21_2023-02-01", "2023-02-01_2023-02-15"]
+    assert mock_gcs_to_bq_batch.call_args_list == [
+        call(["2023-01-01_2023-01-21", "2023-01-21_2023-02-01"]),
+        call(["2023-02-01_2023-02-15"])]
+
+
+def fake_fetch_chunks_async(chunks, replace, split_time, max_fetches, logger, **options):
+    return [f"{start}_{end}" for start, end in chunks]
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", side_effect=count_per_day)
+@patch("flows.utils.web_to_gcs_to_bq.fetch_chunks_async", side_effect=fake_fetch_chunks_async)
+@patch("flows.utils.web_to_gcs_to_bq.process_data")
+@patch("flows.utils.web_to_gcs_to_bq.gcs_to_bq")
+def test_web_to_gcs_to_bq_async(mock_gcs_to_bq, mock_process_data, mock_fetch_chunks_async, mock_check_count):
+    start = date(2023, 1, 1)
+    end = date(2023, 2, 15)
+
+    file_paths = web_to_gcs_to_bq(start, end, False, True, max_workers=16, fetch_engine="async")
+
+    mock_process_data.assert_not_called()
+    assert mock_fetch_chunks_async.call_args.args[3] == 16
+    assert file_paths == ["2023-01-01_2023-01-21", "2023-01-21_2023-02-01", "2023-02-01_2023-02-15"]
+    assert mock_gcs_to_bq.call_args_list == [call(file_path, "dataframe") for file_path in file_paths]
+
+
+def test_web_to_gcs_to_bq_unknown_fetch_engine():
+    with pytest.raises(ValueError):
+        web_to_gcs_to_bq(date(2023, 1, 1), date(2023, 2, 1), fetch_engine="greenlets")
+
+
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_run_chunks_retries(mock_logger):
+    mock_logger.return_value = logging.getLogger()
+    chunks = [(date(2023, 1, day), date(2023, 1, day + 1)) for day in range(1, 8)]
+    failed = set()
+
+    def flaky_process_data(start_date, end_date, replace, split_time):
+        # every even chunk fails once (e.g. while the others overload the service)
+        if start_date.day % 2 == 0 and start_date not in failed:
+            failed.add(start_date)
+            raise ValueError(f"failed: {start_date}")
+        return f"{start_date}_{end_date}"
+
+    results = run_chunks(chunks, False, True, max_workers=3, process_fn=flaky_process_data, retries=1)
+
+    assert results == [f"{start}_{end}" for start, end in chunks]
+
+
+def merged_process_data(manifest, fail=()):
+    """fake_process_data recording the merged files in manifest, the chunks starting in fail fail."""
+    def process_data(start_date, end_date, replace, split_time, **options):
+        if start_date in fail:
+            raise ValueError(f"failed: {start_date}")
+        manifest.set_status(get_file_path(start_date, end_date, split_time), "merged")
+        return fake_process_data(start_date, end_date, replace, split_time, **options)
+    return process_data
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", side_effect=count_per_day)
+@patch("flows.utils.web_to_gcs_to_bq.process_data")
+def test_web_to_gcs_to_bq_resume(mock_process_data, mock_check_count):
+    manifest = Manifest("manifest.jsonl")
+    start = date(2023, 1, 1)
+    end = date(2023, 2, 15)
+    with patch("flows.utils.web_to_gcs_to_bq.get_manifest", return_value=manifest), \
+            patch("flows.utils.web_to_gcs_to_bq.checkpoint"), \
+            patch("flows.utils.web_to_gcs_to_bq.save_manifest"):
+        # the last two chunks fail
+        mock_process_data.side_effect = merged_process_data(manifest, fail=(date(2023, 1, 21), date(2023, 2, 1)))
+        with pytest.raises(ValueError):
+            web_to_gcs_to_bq(start, end, False, True, chunk_retries=0)
+        assert manifest.get_plan("2023-01-01_2023-02-15_split")[0] == [
+            (date(2023, 1, 1), date(2023, 1, 21)), (date(2023, 1, 21), date(2023, 2, 1)),
+            (date(2023, 2, 1), date(2023, 2, 15))]
+
+        mock_check_count.reset_mock()
+        mock_process_data.reset_mock()
+        mock_process_data.side_effect = merged_process_data(manifest)
+        web_to_gcs_to_bq(start, end, False, True)
+
+        # the plan is reused, the merged chunk is skipped
+        mock_check_count.assert_not_called()
+        assert mock_process_data.call_args_list == [
+            call(date(2023, 1, 21), date(2023, 2, 1), False, True, **DEFAULT_OPTIONS),
+            call(date(2023, 2, 1), date(2023, 2, 15), False, True, **DEFAULT_OPTIONS)]
+        # the run completed, its plan isn't resumed anymore
+        assert manifest.get_plan("2023-01-01_2023-02-15_split") is None
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", side_effect=count_per_day)
+@patch("flows.utils.web_to_gcs_to_bq.process_data")
+def test_web_to_gcs_to_bq_replace_twice(mock_process_data, mock_check_count):
+    manifest = Manifest("manifest.jsonl")
+    start = date(2023, 1, 1)
+    end = date(2023, 2, 15)
+    mock_process_data.side_effect = merged_process_data(manifest)
+    with patch("flows.utils.web_to_gcs_to_bq.get_manifest", return_value=manifest), \
+            patch("flows.utils.web_to_gcs_to_bq.checkpoint"), \
+            patch("flows.utils.web_to_gcs_to_bq.save_manifest"):
+        web_to_gcs_to_bq(start, end, True, True)
+        mock_process_data.reset_mock()
+        with patch("flows.utils.web_to_gcs_to_bq.get_run_plan", wraps=get_run_plan) as mock_get_run_plan, \
+                patch.object(manifest, "set_plan", wraps=manifest.set_plan) as mock_set_plan:
+            web_to_gcs_to_bq(start, end, True, True)
+
+    # the second run plans again and replaces every file again
+    mock_get_run_plan.assert_called_once()
+    mock_set_plan.assert_called_once()
+    assert mock_process_data.call_count == 3
+
+
+@patch("flows.utils.web_to_gcs_to_bq.gcs_to_bq")
+@patch("flows.utils.web_to_gcs_to_bq.gcs_to_bq_batch")
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_merge_files_batch_fallback(mock_logger, mock_gcs_to_bq_batch, mock_gcs_to_bq):
+    mock_logger.return_value = logging.getLogger()
+    mock_gcs_to_bq_batch.side_effect = [None, ValueError("batch failed")]
+    mock_gcs_to_bq.side_effect = [None, ValueError("file failed: d")]
+
+    with pytest.raises(ValueError, match="file failed: d"):
+        merge_files(["a", "b", "c", "d"], batch_size=2)
+
+    # only the files of the failed batch are merged again, one at a time
+    assert mock_gcs_to_bq.call_args_list == [call("c", "native"), call("d", "native")]
+
+
+@patch("flows.utils.web_to_gcs_to_bq.check_count", return_value=5000)
+@patch('flows.utils.web_to_gcs_to_bq.get_run_logger')
+def test_plan_chunks_period_years(mock_logger, mock_check_count):
+    mock_logger.return_value = logging.getLogger()
+    chunks = plan_chunks(date(1568, 1, 1), date(1590, 1, 1), period_years=10)
+
+    assert chunks == [(date(1568, 1, 1), date(1570, 1, 1)), (date(1570, 1, 1), date(1580, 1, 1)),
+                      (date(1580, 1, 1), date(1590, 1, 1))]
+    assert [get_file_path(start, end) for start, end in chunks] == [
+        "usgs/1568-1569/earthquake_1568-01-01_1570-01-01.ndjson",
+        "usgs/1570-1579/earthquake_1570-01-01_1580-01-01.ndjson",
+        "usgs/1580-1589/earthquake_1580-01-01_1590-01-01.ndjson"]
+
+
+def test_get_file_path_folders():
+    # a chunk is saved under its month, its year or its years
+    assert get_file_path(date(2023, 1, 21), date(2023, 2, 1)) == "usgs/2023/01/earthquake_2023-01-21_2023-02-01.ndjson"
+    assert get_file_path(date(2023, 1, 1), date(2023, 4, 1)) == "usgs/2023/earthquake_2023-01-01_2023-04-01.ndjson"
+    assert get_file_path(date(1950, 1, 1), date(1960, 1, 1)) == "usgs/1950-1959/earthquake_1950-01-01_1960-01-01.ndjson"
@@ -1,11 +1,15 @@
 from unittest.mock import patch
-from datetime import datetime, date
+import pytest
+from datetime import datetime, date, timedelta
 from flows.web_to_gcs_to_bq_daily import web_to_gcs_to_bq_daily
 
 
+@patch("flows.web_to_gcs_to_bq_daily.run_dbt")
+@patch("flows.web_to_gcs_to_bq_daily.get_merged_months", return_value=["2023-05", "2023-06"])
 @patch("flows.web_to_gcs_to_bq_daily.get_last_datetime", return_value=datetime(2023, 6, 1, 10, 30))
-@patch("flows.web_to_gcs_to_bq_daily.web_to_gcs_to_bq")
-def test_web_to_gcs_to_bq_daily(mock_web_to_gcs_to_bq, mock_get_last_datetime):
+@patch("flows.web_to_gcs_to_bq_daily.web_to_gcs_to_bq", return_value=["usgs/2023/06/earthquake.ndjson"])
+def test_web_to_gcs_to_bq_daily(mock_web_to_gcs_to_bq, mock_get_last_datetime, mock_get_merged_months,
+                                mock_run_dbt):
     web_to_gcs_to_bq_daily()
     mock_web_to_gcs_to_bq.assert_called_once_with(
         date(2023, 6, 1),
@@ -13,3 +17,42 @@ def test_web_to_gcs_to_bq_daily(mock_web_to_gcs_to_bq, mock_get_last_datetime):
         replace=False,
         split_time=True
     )
+    # the models are built once the ingest is done, for the months it changed
+    mock_get_merged_months.assert_called_once_with(["usgs/2023/06/earthquake.ndjson"])
+    mock_run_dbt.assert_called_once_with(changed_months=["2023-05", "2023-06"])
+
+
+@patch("flows.web_to_gcs_to_bq_daily.run_dbt")
+@patch("flows.web_to_gcs_to_bq_daily.get_last_datetime", return_value=datetime(2023, 6, 1, 10, 30))
+@patch("flows.web_to_gcs_to_bq_daily.web_to_gcs_to_bq", return_value=[])
+def test_web_to_gcs_to_bq_daily_without_models(mock_web_to_gcs_to_bq, mock_get_last_datetime, mock_run_dbt):
+    web_to_gcs_to_bq_daily(build_models=False)
+    mock_run_dbt.assert_not_called()
+
+
+@patch("flows.web_to_gcs_to_bq_daily.run_dbt")
+@patch("flows.web_to_gcs_to_bq_daily.get_last_updated", return_value=datetime(2023, 6, 1, 10, 30))
+@patch("flows.web_to_gcs_to_bq_daily.get_last_datetime")
+@patch("flows.web_to_gcs_to_bq_daily.web_to_gcs_to_bq", return_value=[])
+def test_web_to_gcs_to_bq_daily_incremental(mock_web_to_gcs_to_bq, mock_get_last_datetime, mock_get_last_updated,
+                                            mock_run_dbt):
+    web_to_gcs_to_bq_daily(incremental=True)
+    mock_get_last_datetime.assert_not_called()
+    mock_web_to_gcs_to_bq.assert_called_once_with(
+        date(1568, 1, 1),
+        datetime.now().date() + timedelta(days=1),
+        replace=False,
+        split_time=True,
+        updated_after=datetime(2023, 6, 1, 10, 30)
+    )
+    mock_run_dbt.assert_called_once_with(changed_months=[])
+
+
+@patch("flows.web_to_gcs_to_bq_daily.run_dbt")
+@patch("flows.web_to_gcs_to_bq_daily.get_last_updated", return_value=None)
+@patch("flows.web_to_gcs_to_bq_daily.web_to_gcs_to_bq")
+def test_web_to_gcs_to_bq_daily_incremental_no_data(mock_web_to_gcs_to_bq, mock_get_last_updated, mock_run_dbt):
+    with pytest.raises(Exception):
+        web_to_gcs_to_bq_daily(incremental=True)
+    mock_web_to_gcs_to_bq.assert_not_called()
+    mock_run_dbt.assert_not_called()